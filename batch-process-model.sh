@@ -1,6 +1,6 @@
 #!/bin/bash
 
-# Batch Face Swap Processing with Parallel Execution
+# Batch Face Swap Processing (runs faceswap_pipeline.py)
 # Usage: ./batch-process-model.sh <model_name> <source_face> <targets_dir> [parallel_jobs]
 
 if [ "$#" -lt 3 ]; then
@@ -10,20 +10,33 @@ if [ "$#" -lt 3 ]; then
     echo "  model_name    - Name of the model (e.g., 'blondie', 'sarah', 'alex')"
     echo "  source_face   - Path to source face image"
     echo "  targets_dir   - Directory containing target body images"
-    echo "  parallel_jobs - Number of parallel processes (default: 3)"
+    echo "  parallel_jobs - Concurrent API calls per pipeline stage (default: 3)"
     echo ""
     echo "Example:"
     echo "  ./batch-process-model.sh blondie source/blondie-1.png targets/ 3"
     echo ""
     echo "Features:"
     echo "  - Processes all .jpg, .jpeg, .png images in targets_dir"
-    echo "  - Runs multiple processes in parallel for faster processing"
+    echo "  - Runs every target through one pipeline process, stages in parallel"
+    echo "  - Rejects blurry/tiny/faceless targets locally before any paid API call"
     echo "  - Automatically skips already processed files (resume capability)"
     echo "  - Creates organized folder structure: {model_name}/outputs/"
     echo "  - Generates captions and metadata in dataset/{model_name}/"
     exit 1
 fi
 
+# Load environment variables from .env file
+if [ -f .env ]; then
+    export $(cat .env | grep -v '^#' | xargs)
+fi
+
+# MaxStudio key must come from the environment or .env
+if [ -z "$API_KEY" ]; then
+    echo "Error: API_KEY is not set (export it or add it to .env)"
+    exit 1
+fi
+export API_KEY
+
 MODEL_NAME="$1"
 SOURCE_FACE="$2"
 TARGETS_DIR="$3"
@@ -51,7 +64,7 @@ echo ""
 echo "Model Name:       $MODEL_NAME"
 echo "Source Face:      $SOURCE_FACE"
 echo "Targets Dir:      $TARGETS_DIR"
-echo "Parallel Jobs:    $PARALLEL_JOBS"
+echo "Workers/Stage:    $PARALLEL_JOBS"
 echo "Log Directory:    $LOG_DIR"
 echo ""
 
@@ -100,7 +113,7 @@ if [ "$REMAINING_COUNT" -eq 0 ]; then
     exit 0
 fi
 
-read -p "Process $REMAINING_COUNT file(s) with $PARALLEL_JOBS parallel jobs? (y/n) " -n 1 -r
+read -p "Process $REMAINING_COUNT file(s) with $PARALLEL_JOBS workers per stage? (y/n) " -n 1 -r
 echo ""
 
 if [[ ! $REPLY =~ ^[Yy]$ ]]; then
@@ -117,54 +130,17 @@ echo ""
 # Track start time
 START_TIME=$(date +%s)
 
-# Process files in parallel using GNU parallel or xargs
-process_file() {
-    local target_file="$1"
-    local model_name="$2"
-    local source_face="$3"
-    local log_dir="$4"
-
-    local basename=$(basename "$target_file" | sed 's/\.[^.]*$//')
-    local log_file="${log_dir}/${basename}.log"
-
-    echo "[$(date '+%H:%M:%S')] Processing: $(basename "$target_file")"
-
-    # Run face-swap-model.sh and capture output
-    ./face-swap-model.sh "$model_name" "$source_face" "$target_file" > "$log_file" 2>&1
-
-    if [ $? -eq 0 ]; then
-        echo "[$(date '+%H:%M:%S')] ✓ Success: $(basename "$target_file")"
-        return 0
-    else
-        echo "[$(date '+%H:%M:%S')] ✗ Failed: $(basename "$target_file") (see $log_file)"
-        return 1
-    fi
-}
-
-export -f process_file
-export MODEL_NAME SOURCE_FACE LOG_DIR
-
-# Check if GNU parallel is available
-if command -v parallel &> /dev/null; then
-    echo "Using GNU Parallel for processing..."
-    echo ""
-
-    printf '%s\n' "${TO_PROCESS[@]}" | \
-        parallel -j "$PARALLEL_JOBS" --line-buffer \
-        process_file {} "$MODEL_NAME" "$SOURCE_FACE" "$LOG_DIR"
+# Group telemetry from the run under one id
+# (recorded only when PIPELINE_TELEMETRY is set; view with: python3 telemetry.py report)
+export PIPELINE_RUN_ID="${PIPELINE_RUN_ID:-${MODEL_NAME}-$(date +%Y%m%d-%H%M%S)}"
 
-    EXIT_CODE=$?
-else
-    echo "GNU Parallel not found, using xargs..."
-    echo "Tip: Install parallel for better progress reporting: sudo apt-get install parallel"
-    echo ""
+# One process runs every stage as a queue with $PARALLEL_JOBS workers each,
+# sharing one S3 client and HTTP pool (see faceswap_pipeline.py)
+LOG_FILE="${LOG_DIR}/batch-$(date +%Y%m%d-%H%M%S).log"
+python3 faceswap_pipeline.py "$MODEL_NAME" "$SOURCE_FACE" "$TARGETS_DIR" \
+    --concurrency "$PARALLEL_JOBS" 2>&1 | tee "$LOG_FILE"
 
-    # Fallback to xargs
-    printf '%s\n' "${TO_PROCESS[@]}" | \
-        xargs -I {} -P "$PARALLEL_JOBS" bash -c 'process_file "$@"' _ {} "$MODEL_NAME" "$SOURCE_FACE" "$LOG_DIR"
-
-    EXIT_CODE=$?
-fi
+EXIT_CODE=${PIPESTATUS[0]}
 
 # Calculate duration
 END_TIME=$(date +%s)
@@ -187,13 +163,24 @@ echo "  Images:         ${MODEL_NAME}/outputs/faceswapped/"
 echo "  Captions:       dataset/${MODEL_NAME}/captions/"
 echo "  Metadata:       dataset/${MODEL_NAME}/meta/meta.jsonl"
 echo "  Logs:           ${LOG_DIR}/"
+if [ -n "$PIPELINE_TELEMETRY" ]; then
+    echo "  Telemetry:      python3 telemetry.py report $PIPELINE_TELEMETRY --run $PIPELINE_RUN_ID"
+fi
 echo ""
 
+# Targets the local pre-filter dropped before any API call
+REJECTED_COUNT=$(grep -c "⚠ Rejected:" "$LOG_FILE" 2>/dev/null)
+if [ "${REJECTED_COUNT:-0}" -gt 0 ]; then
+    echo "⚠️  $REJECTED_COUNT target(s) rejected by the quality pre-filter (blurry, small, badly exposed or no face)"
+    echo "See quality_filter.py to check or tune the thresholds"
+    echo ""
+fi
+
 # Check for failures
-FAILED_COUNT=$(grep -l "✗" "$LOG_DIR"/*.log 2>/dev/null | wc -l)
-if [ "$FAILED_COUNT" -gt 0 ]; then
+FAILED_COUNT=$(grep -c "✗ Failed:" "$LOG_FILE" 2>/dev/null)
+if [ "${FAILED_COUNT:-0}" -gt 0 ]; then
     echo "⚠️  Warning: $FAILED_COUNT file(s) failed to process"
-    echo "Check logs in $LOG_DIR/ for details"
+    echo "Check $LOG_FILE for details"
     echo ""
 fi
 
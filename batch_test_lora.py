@@ -7,15 +7,33 @@ Usage:
   Phase 2: python3 batch_test_lora.py --test-strengths --checkpoint 750
   Phase 3: python3 batch_test_lora.py --test-prompts --checkpoint 750 --strength 0.7
   Phase 4: python3 batch_test_lora.py --mass-generate --checkpoint 750 --strength 0.7
+           (add --latent-batch 4 to render 4 variations per prompt submission)
+
+  Custom:  python3 batch_test_lora.py --spec sweeps/checkpoints.yaml
+
+Each phase is a sweep spec run through lora_sweep.py: jobs have fixed
+seeds and ids, progress is kept in sweeps/manifests/, and re-running an
+interrupted phase only submits the jobs that have not finished. Jobs go
+through ComfyUIScheduler, which keeps --queue-depth prompts queued on the
+server and moves on as soon as one completes. Give --comfyui-url a
+comma-separated list of pods to spread jobs over all of them
+(comfyui_pool.py: least-loaded routing, failover when a pod dies).
+Watch a running phase with comfyui_progress.py (or ./check_progress.sh).
 """
 
-import requests
-import json
 import time
 import argparse
 from pathlib import Path
 
+from comfyui_pool import ComfyUIPool, create_dispatcher
+from comfyui_outputs import DEFAULT_STORE_DIR, OutputStore
+from lora_sweep import expand_spec, load_spec, manifest_path, run_sweep
+
 COMFYUI_URL = "http://127.0.0.1:8188"  # Local or change to RunPod URL
+BASE_WORKFLOW = "blondie_lora_workflow.json"
+
+# Seeds are fixed per variation so a re-run regenerates (and skips) the same jobs
+SEED_BASE = 1000
 
 # Test prompts for different scenarios
 TEST_PROMPTS = {
@@ -44,29 +62,23 @@ MASS_GENERATION_PROMPTS = [
     "blondie woman, lab coat, modern laboratory, professional scientist",
 ]
 
-def load_base_workflow():
-    """Load the base ComfyUI workflow"""
-    with open('blondie_lora_workflow.json', 'r') as f:
-        return json.load(f)
-
-def queue_generation(workflow, description=""):
-    """Queue a generation in ComfyUI"""
-    payload = {"prompt": workflow, "client_id": f"batch_{int(time.time())}"}
-
-    try:
-        response = requests.post(f"{COMFYUI_URL}/prompt", json=payload, timeout=10)
-        if response.status_code == 200:
-            prompt_id = response.json().get('prompt_id')
-            print(f"  ✅ Queued: {description} (ID: {prompt_id[:8]}...)")
-            return prompt_id
-        else:
-            print(f"  ❌ Failed: {description}")
-            return None
-    except Exception as e:
-        print(f"  ❌ Error: {e}")
-        return None
-
-def test_checkpoints(variations=5):
+def lora_file_for(checkpoint):
+    """LoRA filename for a checkpoint step ("final" = last save)"""
+    return f"blondie_lora-step{checkpoint:08d}.safetensors" if checkpoint != "final" else "blondie_lora.safetensors"
+
+def run_phase(scheduler, spec, store=None):
+    """Run a phase's sweep spec; jobs already done in its manifest are skipped"""
+    counts = run_sweep(spec, scheduler, store=store)
+    if counts['skipped']:
+        print(f"  ↻ {counts['skipped']} job(s) already done in {manifest_path(spec)}")
+    if counts['failed']:
+        print(f"  ⚠ {counts['failed']} job(s) failed; re-run the same command to retry them")
+    print(f"  🔁 {counts['switches']} model switches")
+    if store is not None:
+        print(f"  📥 {store.summary()} → {store.root}")
+    return counts
+
+def test_checkpoints(scheduler, variations=5, store=None):
     """Phase 1: Test all checkpoint versions"""
     print("\n" + "="*60)
     print("PHASE 1: Testing All Checkpoints")
@@ -82,164 +94,149 @@ def test_checkpoints(variations=5):
         "blondie_lora.safetensors",
     ]
 
-    workflow = load_base_workflow()
-    base_prompt = TEST_PROMPTS["portrait"]
-
-    total = len(checkpoints) * variations
-    count = 0
-
-    for checkpoint in checkpoints:
-        step = checkpoint.split("step")[1].split(".")[0] if "step" in checkpoint else "final"
-        print(f"\n📊 Testing Checkpoint: {step} steps")
-
-        for i in range(variations):
-            workflow["2"]["inputs"]["lora_name"] = checkpoint
-            workflow["3"]["inputs"]["text"] = base_prompt
-            workflow["6"]["inputs"]["seed"] = int(time.time()) + i
-            workflow["8"]["inputs"]["filename_prefix"] = f"test_checkpoint_{step}_{i+1:02d}"
-
-            queue_generation(workflow, f"{step} steps (variation {i+1})")
-            count += 1
-
-            # Wait between generations
-            time.sleep(60)
-            print(f"  Progress: {count}/{total} ({count*100//total}%)")
-
-    print(f"\n✅ Phase 1 Complete! Generated {total} images")
+    spec = {
+        "name": f"checkpoints_v{variations}",
+        "workflow": BASE_WORKFLOW,
+        "loras": checkpoints,
+        "prompts": {"portrait": TEST_PROMPTS["portrait"]},
+        "seeds": {"base": SEED_BASE, "count": variations},
+        "prefix": "test_checkpoint_{lora_step}_{variation:02d}",
+    }
+    counts = run_phase(scheduler, spec, store)
+
+    print(f"\n✅ Phase 1 Complete! Generated {counts['images']} images")
     print("📁 Review images and pick the best checkpoint")
 
-def test_strengths(checkpoint, variations=5):
+def test_strengths(scheduler, checkpoint, variations=5, store=None):
     """Phase 2: Test different LoRA strengths"""
     print("\n" + "="*60)
     print(f"PHASE 2: Testing LoRA Strengths (Checkpoint: {checkpoint})")
     print("="*60)
 
-    strengths = [0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
-    workflow = load_base_workflow()
-    base_prompt = TEST_PROMPTS["portrait"]
-
-    lora_file = f"blondie_lora-step{checkpoint:08d}.safetensors" if checkpoint != "final" else "blondie_lora.safetensors"
-
-    total = len(strengths) * variations
-    count = 0
-
-    for strength in strengths:
-        print(f"\n📊 Testing Strength: {strength}")
-
-        for i in range(variations):
-            workflow["2"]["inputs"]["lora_name"] = lora_file
-            workflow["2"]["inputs"]["strength_model"] = strength
-            workflow["2"]["inputs"]["strength_clip"] = strength
-            workflow["3"]["inputs"]["text"] = base_prompt
-            workflow["6"]["inputs"]["seed"] = int(time.time()) + i
-            workflow["8"]["inputs"]["filename_prefix"] = f"test_strength_{int(strength*10)}_{i+1:02d}"
-
-            queue_generation(workflow, f"Strength {strength} (variation {i+1})")
-            count += 1
-
-            time.sleep(60)
-            print(f"  Progress: {count}/{total} ({count*100//total}%)")
-
-    print(f"\n✅ Phase 2 Complete! Generated {total} images")
+    spec = {
+        "name": f"strengths_{checkpoint}_v{variations}",
+        "workflow": BASE_WORKFLOW,
+        "loras": [lora_file_for(checkpoint)],
+        "strengths": [0.5, 0.6, 0.7, 0.8, 0.9, 1.0],
+        "prompts": {"portrait": TEST_PROMPTS["portrait"]},
+        "seeds": {"base": SEED_BASE, "count": variations},
+        "prefix": "test_strength_{strength10}_{variation:02d}",
+    }
+    counts = run_phase(scheduler, spec, store)
+
+    print(f"\n✅ Phase 2 Complete! Generated {counts['images']} images")
     print("📁 Review and pick the best strength")
 
-def test_prompts(checkpoint, strength, variations=10):
+def test_prompts(scheduler, checkpoint, strength, variations=10, store=None):
     """Phase 3: Test different prompt scenarios"""
     print("\n" + "="*60)
     print(f"PHASE 3: Testing Different Prompts")
     print(f"  Checkpoint: {checkpoint}, Strength: {strength}")
     print("="*60)
 
-    workflow = load_base_workflow()
-    lora_file = f"blondie_lora-step{checkpoint:08d}.safetensors" if checkpoint != "final" else "blondie_lora.safetensors"
-
-    workflow["2"]["inputs"]["lora_name"] = lora_file
-    workflow["2"]["inputs"]["strength_model"] = strength
-    workflow["2"]["inputs"]["strength_clip"] = strength
-
-    total = len(TEST_PROMPTS) * variations
-    count = 0
-
-    for category, prompt in TEST_PROMPTS.items():
-        print(f"\n📊 Testing Category: {category}")
-
-        for i in range(variations):
-            workflow["3"]["inputs"]["text"] = prompt
-            workflow["6"]["inputs"]["seed"] = int(time.time()) + i
-            workflow["8"]["inputs"]["filename_prefix"] = f"test_prompt_{category}_{i+1:02d}"
-
-            queue_generation(workflow, f"{category} (variation {i+1})")
-            count += 1
-
-            time.sleep(60)
-            print(f"  Progress: {count}/{total} ({count*100//total}%)")
-
-    print(f"\n✅ Phase 3 Complete! Generated {total} images")
+    spec = {
+        "name": f"prompts_{checkpoint}_s{strength}_v{variations}",
+        "workflow": BASE_WORKFLOW,
+        "loras": [lora_file_for(checkpoint)],
+        "strengths": [strength],
+        "prompts": TEST_PROMPTS,
+        "seeds": {"base": SEED_BASE, "count": variations},
+        "prefix": "test_prompt_{prompt_name}_{variation:02d}",
+    }
+    counts = run_phase(scheduler, spec, store)
+
+    print(f"\n✅ Phase 3 Complete! Generated {counts['images']} images")
     print("📁 Review and pick your favorite prompt styles")
 
-def mass_generate(checkpoint, strength, batch_size=20):
-    """Phase 4: Generate hundreds of images with best settings"""
+def mass_generate(scheduler, checkpoint, strength, batch_size=20, latent_batch=1, store=None):
+    """Phase 4: Generate hundreds of images with best settings
+
+    latent_batch > 1 renders that many variations per prompt submission
+    (EmptyLatentImage batch_size), paying the per-prompt overhead once.
+    """
     print("\n" + "="*60)
     print(f"PHASE 4: Mass Generation")
     print(f"  Checkpoint: {checkpoint}, Strength: {strength}")
     print(f"  Prompts: {len(MASS_GENERATION_PROMPTS)}")
     print(f"  Variations per prompt: {batch_size}")
+    print(f"  Images per submission: {latent_batch}")
     print(f"  Total: {len(MASS_GENERATION_PROMPTS) * batch_size} images")
     print("="*60)
 
-    workflow = load_base_workflow()
-    lora_file = f"blondie_lora-step{checkpoint:08d}.safetensors" if checkpoint != "final" else "blondie_lora.safetensors"
-
-    workflow["2"]["inputs"]["lora_name"] = lora_file
-    workflow["2"]["inputs"]["strength_model"] = strength
-    workflow["2"]["inputs"]["strength_clip"] = strength
-
-    total = len(MASS_GENERATION_PROMPTS) * batch_size
-    count = 0
-
-    for prompt_idx, prompt in enumerate(MASS_GENERATION_PROMPTS, 1):
-        print(f"\n📸 Prompt {prompt_idx}/{len(MASS_GENERATION_PROMPTS)}")
-        print(f"   {prompt[:70]}...")
-
-        for i in range(batch_size):
-            workflow["3"]["inputs"]["text"] = prompt
-            workflow["6"]["inputs"]["seed"] = int(time.time()) + i
-            workflow["8"]["inputs"]["filename_prefix"] = f"batch_p{prompt_idx:02d}_v{i+1:03d}"
-
-            queue_generation(workflow, f"Variation {i+1}/{batch_size}")
-            count += 1
-
-            time.sleep(60)
-
-            if count % 10 == 0:
-                print(f"\n  🎯 Overall Progress: {count}/{total} ({count*100//total}%)\n")
-
-    print(f"\n✅ Phase 4 Complete! Generated {total} images")
+    spec = {
+        "name": f"mass_{checkpoint}_s{strength}_b{batch_size}" + (f"_l{latent_batch}" if latent_batch > 1 else ""),
+        "workflow": BASE_WORKFLOW,
+        "loras": [lora_file_for(checkpoint)],
+        "strengths": [strength],
+        "prompts": MASS_GENERATION_PROMPTS,
+        "seeds": {"base": SEED_BASE, "count": batch_size},
+        "batch_size": latent_batch,
+        "prefix": "batch_p{prompt_index:02d}_v{variation:03d}",
+    }
+    counts = run_phase(scheduler, spec, store)
+
+    print(f"\n✅ Phase 4 Complete! Generated {counts['images']} images")
     print("🎉 You now have hundreds of images to choose from!")
 
+def run_spec_file(scheduler, path, store=None):
+    """Run a user-written sweep spec (see lora_sweep.py for the format)"""
+    spec = load_spec(Path(path))
+    print("\n" + "="*60)
+    print(f"SWEEP: {spec['name']} ({len(expand_spec(spec))} jobs)")
+    print("="*60)
+    counts = run_phase(scheduler, spec, store)
+    print(f"\n✅ Sweep Complete! Generated {counts['images']} images")
+
 def main():
     parser = argparse.ArgumentParser(description="Systematic LoRA Testing")
     parser.add_argument("--test-checkpoints", action="store_true", help="Phase 1: Test all checkpoints")
     parser.add_argument("--test-strengths", action="store_true", help="Phase 2: Test LoRA strengths")
     parser.add_argument("--test-prompts", action="store_true", help="Phase 3: Test different prompts")
     parser.add_argument("--mass-generate", action="store_true", help="Phase 4: Generate hundreds of images")
+    parser.add_argument("--spec", type=str, help="Run a sweep spec file (YAML/JSON) instead of a built-in phase")
     parser.add_argument("--checkpoint", type=int, default=750, help="Checkpoint step to use")
     parser.add_argument("--strength", type=float, default=0.7, help="LoRA strength (0.5-1.0)")
     parser.add_argument("--variations", type=int, default=5, help="Variations per test")
     parser.add_argument("--batch-size", type=int, default=20, help="Variations per prompt in mass generation")
+    parser.add_argument("--latent-batch", type=int, default=1,
+                        help="Images rendered per prompt submission in mass generation (e.g. 4)")
+    parser.add_argument("--comfyui-url", type=str, default=COMFYUI_URL,
+                        help=f"ComfyUI server, or a comma-separated list of pods to spread jobs over (default: {COMFYUI_URL})")
+    parser.add_argument("--queue-depth", type=int, default=2,
+                        help="Prompts kept queued on each server at once (default: 2)")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between completion checks")
+    parser.add_argument("--store", type=str, default=str(DEFAULT_STORE_DIR),
+                        help=f"Where finished images are fetched to, by content hash (default: {DEFAULT_STORE_DIR})")
+    parser.add_argument("--no-fetch", action="store_true", help="Leave images on the ComfyUI server")
 
     args = parser.parse_args()
 
-    if args.test_checkpoints:
-        test_checkpoints(args.variations)
+    scheduler = create_dispatcher(args.comfyui_url, queue_depth=args.queue_depth, poll_interval=args.poll_interval)
+    if not (args.spec or args.test_checkpoints or args.test_strengths or args.test_prompts or args.mass_generate):
+        print("Please specify a phase: --test-checkpoints, --test-strengths, --test-prompts, --mass-generate or --spec")
+        return
+
+    store = None if args.no_fetch else OutputStore(Path(args.store))
+    start_time = time.time()
+
+    if args.spec:
+        run_spec_file(scheduler, args.spec, store)
+    elif args.test_checkpoints:
+        test_checkpoints(scheduler, args.variations, store)
     elif args.test_strengths:
-        test_strengths(args.checkpoint, args.variations)
+        test_strengths(scheduler, args.checkpoint, args.variations, store)
     elif args.test_prompts:
-        test_prompts(args.checkpoint, args.strength, args.variations)
+        test_prompts(scheduler, args.checkpoint, args.strength, args.variations, store)
     elif args.mass_generate:
-        mass_generate(args.checkpoint, args.strength, args.batch_size)
-    else:
-        print("Please specify a phase: --test-checkpoints, --test-strengths, --test-prompts, or --mass-generate")
+        mass_generate(scheduler, args.checkpoint, args.strength, args.batch_size, args.latent_batch, store)
+
+    elapsed = time.time() - start_time
+    print(f"⏱  {scheduler.completed} completed, {scheduler.failed} failed, {scheduler.timed_out} timed out "
+          f"in {elapsed/60:.1f} min")
+    if isinstance(scheduler, ComfyUIPool):
+        print(f"🖥  Nodes: {scheduler.summary()}")
+    if store is not None:
+        store.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Benchmark LoRA sweep submission against the local fake ComfyUI server.
+
+Ordering: two LoRA sweeps (checkpoint comparison and strength comparison)
+are interleaved job by job, as happens when several scripts share one
+server, then submitted once in that order and once grouped by
+(checkpoint, LoRA, strength). The fake server charges --switch-cost
+seconds whenever the next prompt needs different weights.
+
+Latent batching: a mass-generation sweep is submitted with one image per
+prompt and with --latent-batch images per prompt, on a server that charges
+--prompt-overhead seconds per prompt on top of --latency per image.
+
+Pool scaling: the same mass-generation jobs through a ComfyUIPool of 1, 2
+and --nodes fake servers, then again with one server killed mid-run to
+show its jobs being re-queued on the others (and how many it had finished
+unseen, which are rendered twice).
+
+Phases: batch_test_lora.py's own phase functions (checkpoints,
+strengths, prompts, mass generation) run unchanged against a fake server
+that also fails --failure-rate of prompts and jitters run times by
+--jitter, reporting jobs per minute, GPU idle time and p50/p95/p99 job
+latency.
+
+Reports prompts, images, model switches, wall time, images per minute and
+GPU idle time for each pass.
+
+Usage:
+  python3 bench_comfyui.py
+  python3 bench_comfyui.py --latency 0.2 --switch-cost 1.0 --variations 5 --latent-batch 8
+  python3 bench_comfyui.py --suite phases --failure-rate 0.1 --jitter 0.5
+"""
+
+import io
+import time
+import threading
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+from itertools import chain, zip_longest
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import telemetry
+import lora_sweep
+import batch_test_lora
+from comfyui_pool import ComfyUIPool
+from comfyui_scheduler import ComfyUIScheduler
+from fake_comfyui import start_server
+from lora_sweep import SweepManifest, expand_spec, submit_jobs
+from workflow_template import WorkflowTemplate, load_template
+
+WORKFLOW = 'comfyui_workflow_blondie.json'
+CHECKPOINTS = [f"blondie_lora-step{step:08d}.safetensors" for step in (250, 500, 750, 1000)]
+PROMPT = "blondie woman, professional portrait, photorealistic, soft lighting"
+SUITES = ('ordering', 'batching', 'pool', 'phases')
+
+
+def interleaved_jobs(variations: int) -> List[Dict]:
+    """Jobs of two sweeps, alternating as if submitted by two scripts at once."""
+    checkpoint_sweep = expand_spec({
+        'name': 'bench_checkpoints', 'workflow': WORKFLOW, 'loras': CHECKPOINTS, 'strengths': [0.7],
+        'prompts': [PROMPT], 'seeds': {'count': variations}, 'prefix': 'bench_ckpt_{lora_step}_{variation:02d}'
+    })
+    strength_sweep = expand_spec({
+        'name': 'bench_strengths', 'workflow': WORKFLOW, 'loras': CHECKPOINTS[2:3], 'strengths': [0.5, 0.6, 0.8, 0.9],
+        'prompts': [PROMPT], 'seeds': {'count': variations}, 'prefix': 'bench_strength_{strength10}_{variation:02d}'
+    })
+    return [job for job in chain.from_iterable(zip_longest(checkpoint_sweep, strength_sweep)) if job]
+
+
+def mass_jobs(images: int, latent_batch: int) -> List[Dict]:
+    return expand_spec({
+        'name': 'bench_mass', 'workflow': WORKFLOW, 'loras': CHECKPOINTS[2:3], 'strengths': [0.7],
+        'prompts': [PROMPT], 'seeds': {'count': images}, 'batch_size': latent_batch,
+        'prefix': 'bench_mass_v{variation:03d}'
+    })
+
+
+def run_pass(
+    jobs: List[Dict],
+    template: WorkflowTemplate,
+    reorder: bool,
+    args,
+    prompt_overhead: float = 0.0,
+    nodes: int = 0,
+    kill_after: Optional[float] = None
+) -> Dict:
+    """
+    Submit `jobs` to fresh fake servers and wait for them.
+
+    nodes=0 uses a plain ComfyUIScheduler on one server; nodes>=1 a
+    ComfyUIPool over that many servers, the first of which is killed
+    `kill_after` seconds in when given.
+    """
+    servers = [start_server(latency=args.latency, switch_cost=args.switch_cost, prompt_overhead=prompt_overhead)
+               for _ in range(max(nodes, 1))]
+    if nodes:
+        scheduler = ComfyUIPool([server.url for server in servers], queue_depth=args.queue_depth,
+                                poll_interval=args.poll_interval, health_interval=args.poll_interval * 10)
+    else:
+        scheduler = ComfyUIScheduler(servers[0].url, queue_depth=args.queue_depth, poll_interval=args.poll_interval)
+    if kill_after is not None:
+        threading.Timer(kill_after, servers[0].kill).start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        manifest = SweepManifest(Path(tmp) / 'bench.jsonl')
+        for server in servers:
+            server.reset_stats()
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            submit_jobs(scheduler, manifest, jobs, template, reorder=reorder)
+            scheduler.drain()
+        wall = time.perf_counter() - start
+        manifest.close()
+
+    result = {
+        'prompts': scheduler.completed,
+        'images': sum(server.images for server in servers),
+        'switches': sum(server.switches for server in servers),
+        'wall': wall,
+        'idle': sum(server.idle_fraction() for server in servers) / len(servers),
+        'requeued': getattr(scheduler, 'requeued', 0)
+    }
+    for server in servers:
+        if not server.dead:
+            server.shutdown()
+    return result
+
+
+def bench_ordering(template: WorkflowTemplate, args):
+    jobs = interleaved_jobs(args.variations)
+    print(f"\n{'='*70}")
+    print(f"Sweep ordering: {len(jobs)} jobs, {args.latency}s/image, {args.switch_cost}s/switch")
+    print(f"{'='*70}")
+    print_header()
+    for name, reorder in (('interleaved', False), ('grouped', True)):
+        print_row(name, run_pass(jobs, template, reorder, args))
+
+
+def bench_batching(template: WorkflowTemplate, args):
+    print(f"\n{'='*70}")
+    print(f"Latent batching: {args.images} images, {args.latency}s/image, {args.prompt_overhead}s/prompt")
+    print(f"{'='*70}")
+    print_header()
+    for latent_batch in (1, args.latent_batch):
+        r = run_pass(mass_jobs(args.images, latent_batch), template, True, args, args.prompt_overhead)
+        print_row(f"batch {latent_batch}", r)
+
+
+def bench_pool(template: WorkflowTemplate, args):
+    pool_jobs = mass_jobs(args.pool_jobs, 1)
+    print(f"\n{'='*70}")
+    print(f"Pool scaling: {len(pool_jobs)} jobs, {args.latency}s/image, depth {args.queue_depth} per node")
+    print(f"{'='*70}")
+    print_header()
+    sizes = sorted({1, 2, args.nodes} | ({4} if args.nodes > 4 else set()))
+    baseline = None
+    for nodes in sizes:
+        r = run_pass(pool_jobs, template, True, args, nodes=nodes)
+        baseline = baseline or r['images'] / r['wall']
+        print_row(f"{nodes} node(s)", r, f"  x{r['images'] / r['wall'] / baseline:.2f}")
+    kill_after = len(pool_jobs) * args.latency / args.nodes / 3
+    r = run_pass(pool_jobs, template, True, args, nodes=args.nodes, kill_after=kill_after)
+    # Prompts the killed node finished after its last poll are lost with it and rendered again
+    print_row(f"{args.nodes}, 1 killed", r, f"  ({r['requeued']} re-queued after {kill_after:.1f}s, "
+                                            f"{r['images'] - len(pool_jobs)} rendered twice)")
+
+
+def bench_phases(args):
+    """
+    Run batch_test_lora.py's phase functions, unchanged, against one fake server
+    with failures and jitter; latency percentiles come from the scheduler's
+    'comfyui_job' telemetry events.
+    """
+    server = start_server(latency=args.latency, switch_cost=args.switch_cost, prompt_overhead=args.prompt_overhead,
+                          failure_rate=args.failure_rate, jitter=args.jitter, seed=args.seed)
+    phases = [
+        ('checkpoints', lambda s: batch_test_lora.test_checkpoints(s, args.variations)),
+        ('strengths', lambda s: batch_test_lora.test_strengths(s, 750, args.variations)),
+        ('prompts', lambda s: batch_test_lora.test_prompts(s, 750, 0.7, args.variations)),
+        ('mass', lambda s: batch_test_lora.mass_generate(s, 750, 0.7, args.images, args.latent_batch)),
+    ]
+
+    print(f"\n{'='*70}")
+    print(f"batch_test_lora phases: {args.latency}s/image, {args.prompt_overhead}s/prompt, "
+          f"{args.switch_cost}s/switch, {args.failure_rate:.0%} failures, +/-{args.jitter:.0%} jitter")
+    print(f"{'='*70}")
+    print(f"{'phase':<13}{'jobs':>6}{'failed':>8}{'images':>8}{'wall s':>9}{'jobs/min':>10}{'GPU idle':>10}"
+          f"{'p50 s':>8}{'p95 s':>8}{'p99 s':>8}")
+
+    saved_manifest_dir = lora_sweep.MANIFEST_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        lora_sweep.MANIFEST_DIR = Path(tmp) / 'manifests'
+        sink = telemetry.configure(Path(tmp) / 'telemetry.jsonl', run_id='bench')
+        try:
+            for name, run_phase in phases:
+                scheduler = ComfyUIScheduler(server.url, queue_depth=args.queue_depth,
+                                             poll_interval=args.poll_interval)
+                server.reset_stats()
+                started = time.time()
+                with redirect_stdout(io.StringIO()):
+                    run_phase(scheduler)
+                wall = time.time() - started
+
+                durations = sorted(event['dur'] for event in telemetry.load_events(sink.path)
+                                   if event['stage'] == 'comfyui_job' and event['ts'] >= started)
+                jobs = scheduler.completed + scheduler.failed + scheduler.timed_out
+                print(f"{name:<13}{jobs:>6}{scheduler.failed + scheduler.timed_out:>8}{server.images:>8}"
+                      f"{wall:>9.2f}{jobs / wall * 60:>10.1f}{server.idle_fraction():>10.1%}"
+                      f"{telemetry.percentile(durations, 50):>8.2f}{telemetry.percentile(durations, 95):>8.2f}"
+                      f"{telemetry.percentile(durations, 99):>8.2f}")
+        finally:
+            telemetry.close()
+            lora_sweep.MANIFEST_DIR = saved_manifest_dir
+            server.shutdown()
+    print("(p50/p95/p99: seconds from submission to completion, queue wait included)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ComfyUI job submission against fake ComfyUI servers')
+    parser.add_argument('--suite', choices=('all',) + SUITES, default='all', help='Which benchmark to run')
+    parser.add_argument('--variations', type=int, default=4, help='Seeds per checkpoint/strength/prompt')
+    parser.add_argument('--latency', type=float, default=0.1, help='Simulated seconds per image')
+    parser.add_argument('--switch-cost', type=float, default=0.4, help='Simulated seconds per model reload')
+    parser.add_argument('--prompt-overhead', type=float, default=0.3,
+                        help='Simulated seconds per prompt (validation, text encoding) in the batching and phase passes')
+    parser.add_argument('--failure-rate', type=float, default=0.05, help='Fraction of prompts failing in the phase passes')
+    parser.add_argument('--jitter', type=float, default=0.3, help='+/- fraction of run time jitter in the phase passes')
+    parser.add_argument('--seed', type=int, default=1, help='Fake server seed for failures and jitter')
+    parser.add_argument('--images', type=int, default=16, help='Images per prompt in the batching and mass passes')
+    parser.add_argument('--latent-batch', type=int, default=4, help='Images per prompt in the batched pass')
+    parser.add_argument('--nodes', type=int, default=4, help='Largest pool size in the scaling passes')
+    parser.add_argument('--pool-jobs', type=int, default=48, help='Jobs in the scaling passes')
+    parser.add_argument('--queue-depth', type=int, default=2, help='Prompts kept queued on the server')
+    parser.add_argument('--poll-interval', type=float, default=0.02, help='Scheduler poll interval')
+    args = parser.parse_args()
+
+    template = load_template(WORKFLOW)
+    suites = SUITES if args.suite == 'all' else (args.suite,)
+    if 'ordering' in suites:
+        bench_ordering(template, args)
+    if 'batching' in suites:
+        bench_batching(template, args)
+    if 'pool' in suites:
+        bench_pool(template, args)
+    if 'phases' in suites:
+        bench_phases(args)
+    print()
+
+
+def print_header():
+    print(f"{'pass':<14}{'prompts':>8}{'images':>8}{'switches':>10}{'wall s':>9}{'img/min':>9}{'GPU idle':>10}")
+
+
+def print_row(name: str, r: Dict, note: str = ''):
+    print(f"{name:<14}{r['prompts']:>8}{r['images']:>8}{r['switches']:>10}{r['wall']:>9.2f}"
+          f"{r['images'] / r['wall'] * 60:>9.1f}{r['idle']:>10.1%}{note}")
+
+
+if __name__ == '__main__':
+    main()
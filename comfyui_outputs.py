@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Fetch finished ComfyUI outputs into a local content-addressed store.
+
+As soon as a prompt completes, its images (listed in the /history entry)
+are streamed from /view in chunks on a small thread pool, hashed while
+they are written, and moved to
+
+  <store>/<sha[:2]>/<sha>.png      the image, named by its SHA-256
+  <store>/<sha[:2]>/<sha>.json     sidecar: job parameters, seed, timings
+
+Files never sit whole in memory, downloads run while the GPU keeps
+generating, and identical bytes are stored once (the sidecar lists every
+job that produced them). <store>/index.jsonl gets one line per fetched
+file, so the store can be listed without walking it.
+
+Usage:
+  store = OutputStore('generated/store')
+  scheduler = ComfyUIScheduler(url, on_complete=lambda job, entry: store.fetch(url, entry, [...]))
+  ...
+  store.close()   # waits for downloads still running
+
+  python3 comfyui_outputs.py generated/store          # summary of a store
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import telemetry
+from http_client import HttpClient, get_client
+
+
+DEFAULT_STORE_DIR = Path('generated/store')
+CHUNK_SIZE = 256 * 1024
+
+
+def history_images(history_entry: Dict) -> List[Dict]:
+    """Image records ({filename, subfolder, type}) of a /history entry, in output order."""
+    images = []
+    for node_output in history_entry.get('outputs', {}).values():
+        images.extend(node_output.get('images', []))
+    return images
+
+
+class OutputStore:
+    """Content-addressed image store fed by concurrent streaming downloads."""
+
+    def __init__(self, root: Path = DEFAULT_STORE_DIR, workers: int = 4, client: Optional[HttpClient] = None):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.client = client or get_client()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fetch')
+        self._lock = threading.Lock()
+        self._pending: List[Future] = []
+        self._index = open(self.root / 'index.jsonl', 'a', buffering=1)
+
+        self.fetched = 0
+        self.duplicates = 0
+        self.errors = 0
+        self.bytes = 0
+
+    def path_for(self, sha: str, suffix: str = '.png') -> Path:
+        return self.root / sha[:2] / f"{sha}{suffix}"
+
+    def fetch(self, base_url: str, history_entry: Dict, provenance: Optional[List[Dict]] = None) -> List[Future]:
+        """
+        Queue downloads of every image in `history_entry` from `base_url`.
+
+        `provenance[i]` (job parameters, seed, timings, ...) goes into the
+        sidecar of the i-th image. Returns futures resolving to store paths.
+        """
+        futures = []
+        for index, image in enumerate(history_images(history_entry)):
+            meta = provenance[index] if provenance and index < len(provenance) else {}
+            futures.append(self.pool.submit(self._download, base_url.rstrip('/'), image, meta))
+        with self._lock:
+            self._pending = [f for f in self._pending if not f.done()] + futures
+        return futures
+
+    def _download(self, base_url: str, image: Dict, meta: Dict) -> Optional[Path]:
+        params = {'filename': image['filename'], 'subfolder': image.get('subfolder', ''),
+                  'type': image.get('type', 'output')}
+        suffix = Path(image['filename']).suffix or '.png'
+        start = time.perf_counter()
+        sha = hashlib.sha256()
+        size = 0
+        fd, tmp_name = tempfile.mkstemp(dir=self.root, prefix='.fetch-')
+
+        try:
+            with telemetry.span('download', host=base_url) as span, os.fdopen(fd, 'wb') as out:
+                response = self.client.get(f"{base_url}/view", params=params, stream=True, timeout=60)
+                try:
+                    if response.status_code != 200:
+                        raise IOError(f"/view {image['filename']}: HTTP {response.status_code}")
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        sha.update(chunk)
+                        out.write(chunk)
+                        size += len(chunk)
+                finally:
+                    response.close()
+                span['bytes'] = size
+        except Exception as e:
+            os.unlink(tmp_name)
+            print(f"  ⚠ Fetch failed: {image['filename']} from {base_url}: {e}")
+            with self._lock:
+                self.errors += 1
+            return None
+
+        digest = sha.hexdigest()
+        path = self.path_for(digest, suffix)
+        source = dict(meta, filename=image['filename'], subfolder=params['subfolder'], node=base_url,
+                      fetched=round(time.time(), 3), download_s=round(time.perf_counter() - start, 3))
+
+        with self._lock:
+            path.parent.mkdir(exist_ok=True)
+            duplicate = path.exists()
+            if duplicate:
+                os.unlink(tmp_name)
+                self.duplicates += 1
+            else:
+                os.replace(tmp_name, path)
+                self.fetched += 1
+                self.bytes += size
+            self._write_sidecar(digest, size, suffix, source)
+            self._index.write(json.dumps({'sha256': digest, 'bytes': size, 'path': str(path.relative_to(self.root)),
+                                          'filename': image['filename'], 'job_id': meta.get('job_id'),
+                                          'duplicate': duplicate, 'ts': source['fetched']}) + '\n')
+        return path
+
+    def _write_sidecar(self, digest: str, size: int, suffix: str, source: Dict):
+        """Add `source` to the file's sidecar (called with the store lock held)."""
+        sidecar_path = self.path_for(digest, '.json')
+        if sidecar_path.exists():
+            with open(sidecar_path) as f:
+                sidecar = json.load(f)
+        else:
+            sidecar = {'sha256': digest, 'bytes': size, 'ext': suffix, 'sources': []}
+        sidecar['sources'].append(source)
+        tmp = sidecar_path.with_suffix('.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(sidecar, f, indent=2)
+        os.replace(tmp, sidecar_path)
+
+    @property
+    def in_flight(self) -> int:
+        with self._lock:
+            return sum(1 for f in self._pending if not f.done())
+
+    def wait(self):
+        """Block until every queued download has finished."""
+        while True:
+            with self._lock:
+                pending = [f for f in self._pending if not f.done()]
+            if not pending:
+                return
+            for future in pending:
+                future.exception()
+
+    def close(self):
+        self.wait()
+        self.pool.shutdown()
+        self._index.close()
+
+    def summary(self) -> str:
+        text = f"{self.fetched} fetched ({self.bytes / 1e6:.1f} MB)"
+        if self.duplicates:
+            text += f", {self.duplicates} duplicate"
+        if self.errors:
+            text += f", {self.errors} failed"
+        return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize a local ComfyUI output store')
+    parser.add_argument('store', type=str, nargs='?', default=str(DEFAULT_STORE_DIR),
+                        help=f'Store directory (default: {DEFAULT_STORE_DIR})')
+    args = parser.parse_args()
+
+    index = Path(args.store) / 'index.jsonl'
+    if not index.exists():
+        print(f"Error: {index} not found")
+        sys.exit(1)
+
+    files, duplicates, size, jobs = set(), 0, 0, set()
+    with open(index) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record['sha256'] in files or record.get('duplicate'):
+                duplicates += 1
+                continue
+            files.add(record['sha256'])
+            size += record['bytes']
+            if record.get('job_id'):
+                jobs.add(record['job_id'])
+
+    print(f"✓ {args.store}: {len(files)} images ({size / 1e6:.1f} MB) from {len(jobs)} jobs, "
+          f"{duplicates} duplicate downloads")
+
+
+if __name__ == '__main__':
+    main()
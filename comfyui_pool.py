@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Dispatch ComfyUI jobs across a pool of servers (local GPUs or RunPod pods).
+
+Each endpoint gets its own ComfyUIScheduler, so every node keeps up to
+`queue_depth` of our prompts queued and completions are learned the same
+way as with a single server. On top of that the pool:
+
+- probes every node's /system_stats and /queue each `health_interval`
+  seconds; the queue length includes prompts from other clients, so a pod
+  that someone else is also using counts as busier,
+- routes each job to the least-loaded healthy node with a free slot,
+  preferring a node that already has the job's model loaded on ties,
+- marks a node dead after `max_failures` consecutive failed probes, polls
+  or submits, and re-queues its in-flight jobs on the remaining nodes
+  (a dead node is probed again and rejoins once it answers),
+- gives up after `dead_timeout` seconds with every node down: waiting
+  and in-flight jobs are reported to on_complete as 'unreachable', and
+  submit() returns None until a node answers a probe again.
+
+A prompt the dead node finished after its last successful poll is
+re-queued like the rest, since its outputs cannot be fetched from the
+node, so it is rendered twice; bench_comfyui.py's killed-node pass shows
+how many.
+
+ComfyUIPool has the scheduler's interface (submit, drain, adopt, counters,
+on_complete), so lora_sweep.py and batch_test_lora.py take a pool wherever
+they take a scheduler; `create_dispatcher()` picks one from a URL list.
+submit() returns REQUEUED for a job set aside because its node went down,
+and `on_resubmit(job, prompt_id)` reports the prompt id each re-queued
+job gets on its new node, so callers can track it.
+
+Usage:
+  pool = ComfyUIPool(["http://10.0.0.5:8188", "https://pod-8188.proxy.runpod.net"], queue_depth=2)
+  for workflow in workflows:
+      pool.submit(workflow, description="...")
+  pool.drain()
+"""
+
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Set
+
+from comfyui_scheduler import ComfyUIScheduler
+from http_client import HttpClient, get_client
+
+
+# submit() result for a job that will be resubmitted on another node (not a failure)
+REQUEUED = 'requeued'
+
+
+class _Node:
+    """One endpoint: its scheduler plus the pool's view of its health and load."""
+
+    def __init__(self, scheduler: ComfyUIScheduler):
+        self.scheduler = scheduler
+        self.url = scheduler.base_url
+        self.healthy = True
+        self.failures = 0
+        self.external = 0  # prompts queued by other clients at the last probe
+        self.vram_free: Optional[int] = None
+
+    @property
+    def load(self) -> int:
+        return len(self.scheduler.in_flight) + self.external
+
+    def has_slot(self) -> bool:
+        return self.healthy and len(self.scheduler.in_flight) < self.scheduler.queue_depth
+
+
+class ComfyUIPool:
+    """Least-loaded routing of prompts over several ComfyUI servers, with failover."""
+
+    def __init__(
+        self,
+        base_urls: List[str],
+        queue_depth: int = 2,
+        poll_interval: float = 1.0,
+        job_timeout: float = 1800.0,
+        health_interval: float = 10.0,
+        max_failures: int = 3,
+        dead_timeout: float = 600.0,
+        client: Optional[HttpClient] = None,
+        on_complete: Optional[Callable[[Dict, Dict], None]] = None,
+        on_resubmit: Optional[Callable[[Dict, str], None]] = None
+    ):
+        if not base_urls:
+            raise ValueError("at least one ComfyUI endpoint is required")
+        self.client = client or get_client()
+        self.poll_interval = poll_interval
+        self.health_interval = health_interval
+        self.max_failures = max_failures
+        self.dead_timeout = dead_timeout
+        self.on_complete = on_complete
+        self.on_resubmit = on_resubmit
+
+        self.nodes: List[_Node] = []
+        for url in base_urls:
+            node = _Node(ComfyUIScheduler(url, queue_depth=queue_depth, poll_interval=poll_interval,
+                                          job_timeout=job_timeout, client=self.client))
+            node.scheduler.on_complete = self._completion_handler(node)
+            self.nodes.append(node)
+
+        # Jobs taken back from dead nodes, waiting to be resubmitted
+        self.requeue = deque()
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.requeued = 0
+        self.last_model = None
+        self._last_probe = 0.0
+        self._all_dead_since: Optional[float] = None
+
+    @property
+    def endpoints(self) -> List[str]:
+        return [node.url for node in self.nodes]
+
+    @property
+    def in_flight(self) -> Dict[str, Dict]:
+        jobs = {}
+        for node in self.nodes:
+            jobs.update(node.scheduler.in_flight)
+        return jobs
+
+    @property
+    def model_switches(self) -> int:
+        return sum(node.scheduler.model_switches for node in self.nodes)
+
+    def tracked_job_ids(self) -> Set[str]:
+        job_ids = {job['job_id'] for job in self.requeue if 'job_id' in job}
+        for node in self.nodes:
+            job_ids |= node.scheduler.tracked_job_ids()
+        return job_ids
+
+    def _completion_handler(self, node: _Node) -> Callable[[Dict, Dict], None]:
+        def handle(job: Dict, entry: Dict):
+            status = entry.get('status', {}).get('status_str', 'success')
+            if status == 'success':
+                self.completed += 1
+            elif status == 'timeout':
+                self.timed_out += 1
+            else:
+                self.failed += 1
+            if self.on_complete is not None:
+                self.on_complete(dict(job, node=node.url), entry)
+        return handle
+
+    def _pick(self, model: Optional[tuple]) -> Optional[_Node]:
+        candidates = [node for node in self.nodes if node.has_slot()]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda node: (node.load, node.scheduler.last_model != model))
+
+    def _mark_failure(self, node: _Node, reason: str):
+        node.failures += 1
+        if node.healthy and node.failures >= self.max_failures:
+            node.healthy = False
+            jobs = [dict(job, node=node.url) for job in node.scheduler.in_flight.values()]
+            node.scheduler.in_flight.clear()
+            node.scheduler.last_model = None
+            self.requeue.extend(jobs)
+            self.requeued += len(jobs)
+            print(f"  ❌ Node down: {node.url} ({reason}); re-queueing {len(jobs)} job(s)")
+
+    def _mark_ok(self, node: _Node):
+        node.failures = 0
+        self._all_dead_since = None
+        if not node.healthy:
+            node.healthy = True
+            print(f"  ✅ Node back: {node.url}")
+
+    def probe(self):
+        """Refresh health, VRAM and queue length of every node (dead ones included)."""
+        self._last_probe = time.monotonic()
+        for node in self.nodes:
+            try:
+                stats = self.client.get(f"{node.url}/system_stats", timeout=5, retries=0)
+                queue = self.client.get(f"{node.url}/queue", timeout=5, retries=0)
+                if stats.status_code != 200 or queue.status_code != 200:
+                    raise ValueError(f"HTTP {stats.status_code}/{queue.status_code}")
+                devices = stats.json().get('devices', [])
+                queue = queue.json()
+            except Exception as e:
+                self._mark_failure(node, f"probe: {e.__class__.__name__}")
+                continue
+            self._mark_ok(node)
+            node.vram_free = sum(d.get('vram_free', 0) for d in devices) if devices else None
+            queued = {item[1] for item in queue.get('queue_running', []) + queue.get('queue_pending', [])}
+            node.external = len(queued - set(node.scheduler.in_flight))
+
+    def poll(self):
+        """Sleep one interval, collect completions from every live node, re-probe when due."""
+        time.sleep(self.poll_interval)
+        for node in self.nodes:
+            if node.healthy and node.scheduler.in_flight:
+                if node.scheduler.check():
+                    node.failures = 0
+                else:
+                    self._mark_failure(node, "queue poll failed")
+        if time.monotonic() - self._last_probe >= self.health_interval:
+            self.probe()
+        self._resubmit()
+
+    def _resubmit(self):
+        while self.requeue:
+            job = self.requeue[0]
+            node = self._pick(job.get('model_key'))
+            if node is None:
+                return
+            self.requeue.popleft()
+            if 'graph' not in job:
+                # Adopted from an earlier process: the graph is unknown here, so report it lost
+                print(f"  ❌ Lost with its node: {job['description']}")
+                self._completion_handler(node)(job, {'status': {'status_str': 'node_lost', 'messages': []},
+                                                     'outputs': {}})
+                continue
+            meta = {k: v for k, v in job.items()
+                    if k not in ('prompt_id', 'submitted', 'started', 'description', 'graph', 'model_key', 'node')}
+            prompt_id = self._send(node, job['description'], job['graph'], job.get('model_key'), **meta)
+            if prompt_id is None:
+                # Rejected by the new node: report it like any other failed job
+                self._completion_handler(node)(dict(job, prompt_id=job.get('prompt_id')),
+                                               {'status': {'status_str': 'rejected', 'messages': []}, 'outputs': {}})
+            elif prompt_id != REQUEUED and self.on_resubmit is not None:
+                self.on_resubmit(dict(meta, description=job['description'], node=node.url), prompt_id)
+
+    def _send(self, node: _Node, description: str, workflow: Dict, model: Optional[tuple], **meta) -> Optional[str]:
+        """Submit on `node`; returns the prompt id, REQUEUED if the node is unreachable, None if rejected."""
+        # The graph and model ride along in the job so a dead node's jobs can be resubmitted
+        prompt_id = node.scheduler.submit(workflow, description, model=model,
+                                          graph=workflow, model_key=model, **meta)
+        if prompt_id is None:
+            if node.scheduler.last_submit_error == 'connection':
+                self._mark_failure(node, "submit failed")
+                self.requeue.append(dict(meta, description=description, graph=workflow, model_key=model,
+                                         node=node.url))
+                self.requeued += 1
+                return REQUEUED
+            return None
+        self._mark_ok(node)
+        if model is not None:
+            self.last_model = model
+        return prompt_id
+
+    def _wait_for_nodes(self) -> bool:
+        """
+        Sleep one health interval and re-probe while every node is down;
+        False (after failing every waiting job) once `dead_timeout` has passed.
+        """
+        now = time.monotonic()
+        if self._all_dead_since is None:
+            self._all_dead_since = now
+        if now - self._all_dead_since < self.dead_timeout:
+            print(f"  ⚠ No healthy ComfyUI nodes; retrying in {self.health_interval:.0f}s")
+            time.sleep(self.health_interval)
+            self.probe()
+            return True
+        self.probe()
+        if any(n.healthy for n in self.nodes):
+            return True
+        self._give_up(f"no healthy node for {now - self._all_dead_since:.0f}s")
+        return False
+
+    def _give_up(self, reason: str):
+        """Report every re-queued and in-flight job as unreachable."""
+        lost = [(job, job.get('node')) for job in self.requeue]
+        self.requeue.clear()
+        for node in self.nodes:
+            lost.extend((job, node.url) for job in node.scheduler.in_flight.values())
+            node.scheduler.in_flight.clear()
+        for job, url in lost:
+            print(f"  ❌ Gave up: {job['description']} ({reason})")
+            node = next((n for n in self.nodes if n.url == url), self.nodes[0])
+            self._completion_handler(node)(job, {'status': {'status_str': 'unreachable', 'messages': [reason]},
+                                                 'outputs': {}})
+
+    def submit(self, workflow: Dict, description: str = "", model: Optional[tuple] = None, **meta) -> Optional[str]:
+        """
+        Queue `workflow` on the least-loaded healthy node, waiting for a free slot.
+
+        Returns the prompt id, None if the job was rejected by ComfyUI, or
+        REQUEUED if its node went down and it was set aside to be resubmitted
+        on another node (its new prompt id then goes to `on_resubmit`). Also
+        None when every node has been down for `dead_timeout` seconds.
+        """
+        if not self._last_probe:
+            self.probe()
+        self._resubmit()
+        while True:
+            node = self._pick(model)
+            if node is not None:
+                prompt_id = self._send(node, description, workflow, model, **meta)
+                if prompt_id is None:
+                    self.failed += 1
+                return prompt_id
+            if not any(n.healthy for n in self.nodes):
+                if not self._wait_for_nodes():
+                    self.failed += 1
+                    return None
+            else:
+                self.poll()
+
+    def adopt(self, prompt_id: str, description: str = "", base_url: Optional[str] = None, **meta):
+        """Track a prompt queued on `base_url` by an earlier process."""
+        node = next((n for n in self.nodes if n.url == (base_url or '').rstrip('/')), self.nodes[0])
+        node.scheduler.adopt(prompt_id, description, **meta)
+
+    def drain(self):
+        """
+        Block until every job has finished, failed or timed out on some node,
+        or was given up on after `dead_timeout` seconds without a live node.
+        """
+        while self.requeue or any(node.scheduler.in_flight for node in self.nodes):
+            if self.requeue and not any(n.healthy for n in self.nodes):
+                if not self._wait_for_nodes():
+                    return
+                continue
+            self.poll()
+
+    def summary(self) -> str:
+        return ', '.join(
+            f"{node.url} {'up' if node.healthy else 'DOWN'} ({node.scheduler.completed} done)" for node in self.nodes
+        )
+
+
+def create_dispatcher(urls: str, queue_depth: int = 2, poll_interval: float = 1.0, **kwargs):
+    """A ComfyUIScheduler for one URL, or a ComfyUIPool for a comma-separated list."""
+    base_urls = [url.strip() for url in urls.split(',') if url.strip()]
+    if len(base_urls) == 1:
+        return ComfyUIScheduler(base_urls[0], queue_depth=queue_depth, poll_interval=poll_interval)
+    return ComfyUIPool(base_urls, queue_depth=queue_depth, poll_interval=poll_interval, **kwargs)
@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+"""
+Live progress and ETA for running LoRA sweeps (check_progress.sh prints one snapshot).
+
+Progress comes from the sweep manifests (sweeps/manifests/*.jsonl, see
+lora_sweep.py) and from ComfyUI's websocket, never from listing output
+directories:
+
+- each manifest is tailed from the byte offset read last time, so a
+  refresh costs only the lines appended since, however many thousands of
+  jobs the sweep has,
+- the latest header line gives the sweep's total; the last record per job
+  gives done / failed / queued,
+- a listener per ComfyUI server joins /ws under its own client id
+  (MONITOR_CLIENT_ID, never the sweeps' comfyui_scheduler.CLIENT_ID, so it
+  cannot take their websocket over). ComfyUI sends execution events only
+  to the client that queued a prompt, but every client gets a status
+  message on each queue change; on one, the listener reads /queue for the
+  sweeps' running prompt and /history/{prompt_id} for each one that left
+  it, whose execution_start / execution_success timestamps give GPU time
+  per job.
+
+Rolling statistics over the last --window jobs give throughput (jobs/min,
+measured since the sweep's latest start so a pause does not drag it down),
+p50/p95 job time and an ETA for every sweep. The same snapshot is printed
+every --interval seconds and served as JSON on http://127.0.0.1:--port/.
+
+Usage:
+  python3 comfyui_progress.py                               # all sweeps, events from the local server
+  python3 comfyui_progress.py checkpoints_v5 --comfyui-url http://10.0.0.5:8188,https://pod-8188.proxy.runpod.net
+  python3 comfyui_progress.py --once                        # one snapshot from the manifests, then exit
+  curl -s http://127.0.0.1:8190/ | python3 -m json.tool
+"""
+
+import os
+import ssl
+import json
+import time
+import base64
+import socket
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import telemetry
+from comfyui_scheduler import CLIENT_ID
+from http_client import HttpClient, get_client
+from lora_sweep import MANIFEST_DIR
+
+# One per process, so several monitors can run next to the sweeps
+MONITOR_CLIENT_ID = f"{CLIENT_ID}-monitor-{os.getpid()}"
+DEFAULT_PORT = 8190
+# A sweep with queued jobs but no manifest activity for this long is shown as stalled
+STALL_SECONDS = 600
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return '?'
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class RollingStats:
+    """Completion times and durations of the last `window` jobs."""
+
+    def __init__(self, window: int = 200):
+        self.finished = deque(maxlen=window)
+        self.durations = deque(maxlen=window)
+
+    def add(self, finished: float, duration: Optional[float] = None):
+        self.finished.append(finished)
+        if duration is not None:
+            self.durations.append(duration)
+
+    def rate(self, since: float = 0.0) -> Optional[float]:
+        """Jobs per second between the first and last completion after `since`."""
+        times = [t for t in self.finished if t >= since]
+        if len(times) < 2 or times[-1] <= times[0]:
+            return None
+        return (len(times) - 1) / (times[-1] - times[0])
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.durations:
+            return None
+        return telemetry.percentile(sorted(self.durations), q)
+
+
+class SweepProgress:
+    """State of one sweep, built incrementally from its manifest."""
+
+    def __init__(self, path: Path, window: int = 200):
+        self.path = path
+        self.name = path.stem
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.offset = 0
+        self.total = 0
+        self.started = 0.0  # ts of the latest header: when the current run began
+        self.last_update = 0.0
+        self.status: Dict[str, str] = {}
+        self.counts = {'done': 0, 'failed': 0, 'queued': 0}
+        self.images = 0
+        self.prompts: Dict[str, str] = {}  # prompt_id -> job prefix
+        self.jobs = RollingStats(self.window)  # submission -> done, from the manifest
+        self.gpu = RollingStats(self.window)  # execution_start -> success, from ComfyUI history
+
+    def read_new(self) -> List[Dict]:
+        """Apply lines appended since the last call; returns the new job records."""
+        try:
+            size = self.path.stat().st_size
+        except FileNotFoundError:
+            return []
+        if size < self.offset:
+            self.reset()  # manifest replaced or truncated
+        if size == self.offset:
+            return []
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        # Leave a partially written last line for the next read
+        end = data.rfind(b'\n') + 1
+        self.offset += end
+
+        records = []
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if 'total' in record and 'job_id' not in record:
+                self.total = record['total']
+                self.started = record.get('ts', 0.0)
+                self.name = record.get('sweep', self.name)
+            elif 'job_id' in record:
+                self._apply(record)
+                records.append(record)
+            self.last_update = max(self.last_update, record.get('ts', 0.0))
+        return records
+
+    def _apply(self, record: Dict):
+        previous = self.status.get(record['job_id'])
+        status = record['status']
+        if previous in self.counts:
+            self.counts[previous] -= 1
+        if status in self.counts:
+            self.counts[status] += 1
+        self.status[record['job_id']] = status
+
+        if status == 'queued' and record.get('prompt_id'):
+            self.prompts[record['prompt_id']] = record.get('prefix', record['job_id'])
+        elif status == 'done':
+            self.images += len(record.get('outputs', []))
+            self.jobs.add(record['ts'], record.get('duration'))
+
+    def snapshot(self, now: float) -> Dict:
+        done, failed, queued = self.counts['done'], self.counts['failed'], self.counts['queued']
+        remaining = max(self.total - done, 0)
+        rate = self.jobs.rate(since=self.started) or self.jobs.rate()
+        if remaining == 0:
+            state = 'complete'
+        elif queued and now - self.last_update < STALL_SECONDS:
+            state = 'running'
+        elif queued:
+            state = 'stalled'
+        else:
+            state = 'stopped'
+
+        # GPU time per job when ComfyUI history is being followed, else submission -> done from the manifest
+        timing = self.gpu if self.gpu.durations else self.jobs
+        p50, p95 = timing.percentile(50), timing.percentile(95)
+        return {
+            'sweep': self.name,
+            'manifest': str(self.path),
+            'state': state,
+            'total': self.total,
+            'done': done,
+            'failed': failed,
+            'queued': queued,
+            'remaining': remaining,
+            'percent': round(done / self.total * 100, 1) if self.total else 0.0,
+            'images': self.images,
+            'jobs_per_min': round(rate * 60, 2) if rate else None,
+            'eta_s': round(remaining / rate) if rate and remaining and state == 'running' else None,
+            'job_p50_s': round(p50, 2) if p50 is not None else None,
+            'job_p95_s': round(p95, 2) if p95 is not None else None,
+            'last_update': self.last_update,
+        }
+
+
+class EventListener(threading.Thread):
+    """Websocket client for one ComfyUI server; hands every JSON message to `on_event`."""
+
+    def __init__(self, base_url: str, client_id: str, on_event: Callable[[str, Dict], None]):
+        super().__init__(daemon=True, name=f"ws-{base_url}")
+        self.base_url = base_url.rstrip('/')
+        self.client_id = client_id
+        self.on_event = on_event
+        self.connected = False
+        self.queue_remaining: Optional[int] = None
+        self._buffer = b''
+
+    def run(self):
+        delay = 1.0
+        while True:
+            try:
+                sock = self._connect()
+            except (OSError, ValueError):
+                time.sleep(delay)
+                delay = min(delay * 2, 30.0)
+                continue
+            self.connected = True
+            delay = 1.0
+            try:
+                self._read(sock)
+            except (OSError, ValueError):
+                pass
+            finally:
+                self.connected = False
+                sock.close()
+
+    def _connect(self) -> socket.socket:
+        url = urlsplit(self.base_url)
+        secure = url.scheme == 'https'
+        port = url.port or (443 if secure else 80)
+        sock = socket.create_connection((url.hostname, port), timeout=10)
+        if secure:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=url.hostname)
+
+        key = base64.b64encode(os.urandom(16)).decode('ascii')
+        sock.sendall(
+            f"GET {url.path}/ws?clientId={self.client_id} HTTP/1.1\r\nHost: {url.netloc}\r\n"
+            f"Upgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n"
+            f"Sec-WebSocket-Version: 13\r\n\r\n".encode('latin-1')
+        )
+        response = b''
+        while b'\r\n\r\n' not in response:
+            chunk = sock.recv(4096)
+            if not chunk:
+                raise ConnectionError("closed during websocket handshake")
+            response += chunk
+        head, self._buffer = response.split(b'\r\n\r\n', 1)
+        status_line = head.split(b'\r\n', 1)[0]
+        if b' 101 ' not in status_line:
+            raise ValueError(f"websocket upgrade refused: {status_line.decode('latin-1')}")
+        sock.settimeout(None)
+        return sock
+
+    def _recv(self, sock: socket.socket, n: int) -> bytes:
+        while len(self._buffer) < n:
+            chunk = sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("websocket closed")
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:n], self._buffer[n:]
+        return data
+
+    def _read(self, sock: socket.socket):
+        message = b''
+        while True:
+            head = self._recv(sock, 2)
+            fin, opcode, length = head[0] & 0x80, head[0] & 0x0F, head[1] & 0x7F
+            if length == 126:
+                length = int.from_bytes(self._recv(sock, 2), 'big')
+            elif length == 127:
+                length = int.from_bytes(self._recv(sock, 8), 'big')
+            payload = self._recv(sock, length)
+
+            if opcode == 0x8:
+                return
+            if opcode == 0x9:
+                # Client frames must be masked; a zero mask leaves the payload as is
+                sock.sendall(bytes([0x8A, 0x80 | len(payload)]) + bytes(4) + payload)
+                continue
+            if opcode in (0x1, 0x0):
+                message += payload
+                if fin:
+                    self.on_event(self.base_url, json.loads(message))
+                    message = b''
+            # Binary frames (live previews) are ignored
+
+
+class ProgressMonitor:
+    """Manifest tails plus websocket events, combined into per-sweep progress."""
+
+    def __init__(self, manifest_dir: Path = MANIFEST_DIR, sweeps: Optional[List[str]] = None, window: int = 200,
+                 client: Optional[HttpClient] = None):
+        self.manifest_dir = Path(manifest_dir)
+        self.names = set(sweeps or [])
+        self.window = window
+        self.client = client or get_client()
+        self.sweeps: Dict[str, SweepProgress] = {}
+        self.listeners: List[EventListener] = []
+        self.running: Dict[str, Dict] = {}  # prompt_id -> {server, started}
+        self._lock = threading.Lock()
+
+    def listen(self, base_urls: List[str], client_id: str = MONITOR_CLIENT_ID):
+        for base_url in base_urls:
+            listener = EventListener(base_url, client_id, self.on_event)
+            listener.start()
+            self.listeners.append(listener)
+
+    def refresh(self):
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        for path in sorted(self.manifest_dir.glob('*.jsonl')):
+            if self.names and path.stem not in self.names:
+                continue
+            sweep = self.sweeps.get(path.stem)
+            if sweep is None:
+                sweep = self.sweeps[path.stem] = SweepProgress(path, self.window)
+            sweep.read_new()
+
+    def _sweep_of(self, prompt_id: str) -> Optional[SweepProgress]:
+        for sweep in self.sweeps.values():
+            if prompt_id in sweep.prompts:
+                return sweep
+        return None
+
+    def on_event(self, base_url: str, message: Dict):
+        """Handle a websocket message; only status (sent on every queue change) reaches another client id."""
+        if message.get('type') != 'status':
+            return
+        data = message.get('data') or {}
+        with self._lock:
+            for listener in self.listeners:
+                if listener.base_url == base_url:
+                    listener.queue_remaining = data.get('status', {}).get('exec_info', {}).get('queue_remaining')
+        try:
+            queue = self.client.get(f"{base_url}/queue", timeout=10, retries=0).json()
+        except Exception:
+            return  # the next queue change reads it again
+        running = {item[1] for item in queue.get('queue_running', [])
+                   if len(item) > 3 and (item[3] or {}).get('client_id') == CLIENT_ID}
+
+        now = time.time()
+        with self._lock:
+            for prompt_id in running - set(self.running):
+                self.running[prompt_id] = {'server': base_url, 'started': now}
+            finished = {prompt_id: self.running.pop(prompt_id) for prompt_id, job in list(self.running.items())
+                        if job['server'] == base_url and prompt_id not in running}
+        for prompt_id, job in finished.items():
+            self._finished(base_url, prompt_id, job, now)
+
+    def _finished(self, base_url: str, prompt_id: str, job: Dict, now: float):
+        """Add a prompt that left the queue to its sweep's GPU times, unless it failed."""
+        try:
+            history = self.client.get(f"{base_url}/history/{prompt_id}", timeout=10, retries=0).json()
+            entry = history.get(prompt_id, {})
+        except Exception:
+            entry = {}
+        status = entry.get('status', {})
+        if status.get('status_str', 'success') != 'success':
+            return
+        stamps = {name: (data or {}).get('timestamp') for name, data in status.get('messages', [])}
+        if stamps.get('execution_start') and stamps.get('execution_success'):
+            duration = (stamps['execution_success'] - stamps['execution_start']) / 1000
+        else:
+            duration = now - job['started']
+        with self._lock:
+            sweep = self._sweep_of(prompt_id)
+            if sweep is None:
+                self._refresh()  # the queued record may not have been read yet
+                sweep = self._sweep_of(prompt_id)
+            if sweep is not None:
+                sweep.gpu.add(now, duration)
+
+    def snapshot(self) -> Dict:
+        now = time.time()
+        with self._lock:
+            self._refresh()
+            sweeps = [sweep.snapshot(now) for sweep in self.sweeps.values()]
+            running = []
+            for prompt_id, job in self.running.items():
+                sweep = self._sweep_of(prompt_id)
+                running.append({
+                    'prompt_id': prompt_id, 'server': job['server'], 'elapsed_s': round(now - job['started'], 1),
+                    'sweep': sweep.name if sweep else None, 'job': sweep.prompts[prompt_id] if sweep else None,
+                })
+        return {
+            'ts': round(now, 3),
+            'sweeps': sweeps,
+            'running': running,
+            'servers': [{'url': l.base_url, 'connected': l.connected, 'queue_remaining': l.queue_remaining}
+                        for l in self.listeners],
+        }
+
+
+def print_snapshot(snapshot: Dict, active_only: bool = False):
+    now = snapshot['ts']
+    sweeps = [s for s in snapshot['sweeps'] if not active_only or s['state'] in ('running', 'stalled')]
+    print(f"\n📊 {time.strftime('%H:%M:%S', time.localtime(now))} "
+          f"({len(sweeps)} sweep(s) in {'progress' if active_only else 'manifests'})")
+    for s in sweeps:
+        icon = {'complete': '✅', 'running': '🔁', 'stalled': '⚠️ ', 'stopped': '⏸️ '}[s['state']]
+        line = (f"  {icon} {s['sweep']}: {s['done']}/{s['total']} ({s['percent']:.1f}%) {s['state']}, "
+                f"{s['images']} images")
+        if s['failed']:
+            line += f", {s['failed']} failed"
+        if s['queued']:
+            line += f", {s['queued']} queued"
+        if s['jobs_per_min']:
+            line += f" | {s['jobs_per_min']:.1f} jobs/min"
+        if s['job_p50_s'] is not None:
+            line += f" | job p50 {s['job_p50_s']:.1f}s p95 {s['job_p95_s']:.1f}s"
+        if s['eta_s'] is not None:
+            line += f" | ETA {format_duration(s['eta_s'])}"
+        elif s['state'] != 'complete' and s['last_update']:
+            line += f" | last update {format_duration(now - s['last_update'])} ago"
+        print(line)
+    for job in snapshot['running']:
+        print(f"     🖥  {job['job'] or job['prompt_id'][:8]} ({job['elapsed_s']:.0f}s on {job['server']})")
+    for server in snapshot['servers']:
+        if not server['connected']:
+            print(f"     ⚠ No event stream from {server['url']} (retrying)")
+
+
+def serve(monitor: ProgressMonitor, port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Serve monitor snapshots as JSON on a background thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            data = json.dumps(monitor.snapshot()).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Live progress and ETA for LoRA sweeps')
+    parser.add_argument('sweeps', nargs='*', help='Sweep names to show (default: every manifest)')
+    parser.add_argument('--manifest-dir', type=str, default=str(MANIFEST_DIR),
+                        help=f'Directory of sweep manifests (default: {MANIFEST_DIR})')
+    parser.add_argument('--comfyui-url', type=str, default='http://127.0.0.1:8188',
+                        help='ComfyUI server(s) to follow over the websocket, comma-separated')
+    parser.add_argument('--no-events', action='store_true', help='Use the manifests only (no websocket)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help=f'Port of the JSON endpoint, 0 to disable (default: {DEFAULT_PORT})')
+    parser.add_argument('--interval', type=float, default=10.0, help='Seconds between printed updates')
+    parser.add_argument('--window', type=int, default=200, help='Jobs in the rolling statistics')
+    parser.add_argument('--once', action='store_true', help='Print one snapshot and exit')
+    args = parser.parse_args()
+
+    monitor = ProgressMonitor(Path(args.manifest_dir), args.sweeps, window=args.window)
+    if not Path(args.manifest_dir).is_dir():
+        print(f"✗ No manifests in {args.manifest_dir} (run a sweep from this directory first)")
+        return
+    if args.once:
+        print_snapshot(monitor.snapshot())
+        return
+
+    if not args.no_events:
+        monitor.listen([url.strip() for url in args.comfyui_url.split(',') if url.strip()])
+    if args.port:
+        serve(monitor, args.port)
+        print(f"→ JSON progress at http://127.0.0.1:{args.port}/")
+    try:
+        while True:
+            print_snapshot(monitor.snapshot(), active_only=not args.sweeps)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Completion-driven job scheduler for a ComfyUI server.
+
+Instead of queueing a prompt and sleeping a fixed time, the scheduler keeps
+up to `queue_depth` prompts submitted at once and learns about completions
+from the server: one GET /queue per poll shows which of our prompts are
+still running or pending, and only prompts that have left the queue are
+looked up in /history. With a depth of 2 or more the next job is always
+waiting on the server when the current one finishes, so the GPU never
+idles between jobs and a long job simply delays the next submission.
+If the server cannot be read for `max_poll_failures` polls in a row, the
+prompts in flight are given up as failed ('unreachable') so submit() and
+drain() return instead of waiting forever. A prompt that times out is
+cancelled on the server (POST /interrupt if it is running, otherwise
+removed from the queue) so it does not keep the GPU from the prompts
+queued behind it.
+
+Usage:
+  scheduler = ComfyUIScheduler(COMFYUI_URL, queue_depth=2)
+  for workflow in workflows:
+      scheduler.submit(workflow, description="...")
+  scheduler.drain()
+"""
+
+import os
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+import telemetry
+from http_client import HttpClient, get_client
+
+# Marks our prompts in ComfyUI's queue; comfyui_progress.py picks them out by it
+# (and listens on the websocket under an id of its own).
+CLIENT_ID = os.getenv('COMFYUI_CLIENT_ID', 'lora-sweeps')
+
+
+class ComfyUIScheduler:
+    """Keeps a bounded number of prompts in flight and tracks their completion."""
+
+    def __init__(
+        self,
+        base_url: str,
+        queue_depth: int = 2,
+        poll_interval: float = 1.0,
+        job_timeout: float = 1800.0,
+        max_poll_failures: int = 10,
+        client: Optional[HttpClient] = None,
+        on_complete: Optional[Callable[[Dict, Dict], None]] = None,
+        client_id: str = CLIENT_ID
+    ):
+        if queue_depth < 1:
+            raise ValueError("queue_depth must be at least 1")
+        self.base_url = base_url.rstrip('/')
+        self.queue_depth = queue_depth
+        self.poll_interval = poll_interval
+        self.job_timeout = job_timeout
+        self.max_poll_failures = max_poll_failures
+        self.client = client or get_client()
+        self.on_complete = on_complete
+        self.client_id = client_id
+
+        # prompt_id -> job dict (description, submitted, plus caller metadata)
+        self.in_flight: Dict[str, Dict] = {}
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.poll_failures = 0  # consecutive polls that could not read the server
+        # Submissions whose model (checkpoint, LoRA, strength) differs from the previous one
+        self.last_model = None
+        self.model_switches = 0
+        # Why the last submit returned None: 'connection' (server unreachable) or 'rejected'
+        self.last_submit_error: Optional[str] = None
+
+    def submit(self, workflow: Dict, description: str = "", model: Optional[tuple] = None, **meta) -> Optional[str]:
+        """
+        Queue `workflow`, first waiting for a free slot if `queue_depth` are in flight.
+
+        The workflow is serialized immediately, so callers may keep mutating
+        the same dict for the next job. `model` identifies the weights the
+        job needs loaded and is only used to count model switches. Returns
+        the prompt id, or None if ComfyUI rejected the prompt.
+        """
+        while len(self.in_flight) >= self.queue_depth:
+            self.poll()
+
+        payload = {"prompt": workflow, "client_id": self.client_id}
+        try:
+            response = self.client.post(f"{self.base_url}/prompt", json=payload, timeout=30)
+        except Exception as e:
+            print(f"  ❌ Error: {e}")
+            self.failed += 1
+            self.last_submit_error = 'connection'
+            return None
+
+        if response.status_code != 200:
+            print(f"  ❌ Failed: {description} ({response.status_code}: {response.text[:200]})")
+            self.failed += 1
+            self.last_submit_error = 'rejected'
+            return None
+
+        try:
+            prompt_id = response.json().get('prompt_id')
+        except ValueError:
+            prompt_id = None
+        if not prompt_id:
+            print(f"  ❌ Failed: {description} (no prompt_id in response: {response.text[:200]})")
+            self.failed += 1
+            self.last_submit_error = 'rejected'
+            return None
+
+        self.in_flight[prompt_id] = dict(meta, description=description, prompt_id=prompt_id, submitted=time.time())
+        print(f"  ✅ Queued: {description} (ID: {prompt_id[:8]}...)")
+        if model is not None:
+            if self.last_model is not None and model != self.last_model:
+                self.model_switches += 1
+            self.last_model = model
+        return prompt_id
+
+    @property
+    def endpoints(self) -> List[str]:
+        return [self.base_url]
+
+    def adopt(self, prompt_id: str, description: str = "", base_url: Optional[str] = None, **meta):
+        """
+        Track a prompt queued by an earlier process so its completion is reported here.
+
+        `base_url` is accepted so callers can treat a scheduler and a
+        ComfyUIPool alike; it must be this scheduler's server.
+        """
+        if not prompt_id:
+            return
+        self.in_flight[prompt_id] = dict(meta, description=description, prompt_id=prompt_id, submitted=time.time())
+        print(f"  ↻ Re-attached: {description} (ID: {prompt_id[:8]}...)")
+
+    def tracked_job_ids(self) -> Set[str]:
+        """`job_id` metadata of every prompt currently in flight."""
+        return {job['job_id'] for job in self.in_flight.values() if 'job_id' in job}
+
+    def poll(self):
+        """Sleep one interval, then retire every in-flight prompt that has finished."""
+        time.sleep(self.poll_interval)
+        if self.check():
+            self.poll_failures = 0
+            return
+        self.poll_failures += 1
+        if self.poll_failures >= self.max_poll_failures:
+            self.poll_failures = 0
+            self._abandon(f"server unreachable for {self.max_poll_failures} polls")
+
+    def _abandon(self, reason: str):
+        """Give up on every prompt in flight, reporting each as failed."""
+        for prompt_id, job in list(self.in_flight.items()):
+            print(f"  ❌ Gave up: {job['description']} ({reason})")
+            self.in_flight.pop(prompt_id)
+            self.failed += 1
+            if self.on_complete is not None:
+                self.on_complete(job, {'status': {'status_str': 'unreachable', 'messages': [reason]}, 'outputs': {}})
+
+    def check(self) -> bool:
+        """
+        Retire every in-flight prompt that has finished; False if the server could not be read.
+
+        Status reads are not retried by the HTTP client: the next poll is the retry.
+        """
+        try:
+            queue = self.client.get(f"{self.base_url}/queue", timeout=10, retries=0).json()
+        except Exception as e:
+            print(f"  ⚠ Error polling queue: {e}")
+            return False
+
+        # Queue entries are [number, prompt_id, prompt, extra_data, outputs_to_execute]
+        running = {item[1] for item in queue.get('queue_running', [])}
+        active = running | {item[1] for item in queue.get('queue_pending', [])}
+        now = time.time()
+
+        for prompt_id in [p for p in self.in_flight if p not in active]:
+            try:
+                history = self.client.get(f"{self.base_url}/history/{prompt_id}", timeout=10, retries=0).json()
+            except Exception as e:
+                print(f"  ⚠ Error reading history for {prompt_id[:8]}: {e}")
+                continue
+            entry = history.get(prompt_id)
+            if entry is None:
+                continue  # left the queue but history not written yet
+            self._finish(prompt_id, entry)
+
+        # A prompt's timeout clock starts once it is running or is the oldest of ours, so
+        # waiting behind our own earlier prompts is not held against it; a prompt stuck
+        # at the head still times out and the next one's clock starts
+        if self.in_flight:
+            oldest = min(self.in_flight, key=lambda p: self.in_flight[p]['submitted'])
+            for prompt_id, job in self.in_flight.items():
+                if 'started' not in job and (prompt_id in running or prompt_id == oldest):
+                    job['started'] = now
+
+        for prompt_id, job in list(self.in_flight.items()):
+            if 'started' in job and now - job['started'] > self.job_timeout:
+                print(f"  ❌ Timeout: {job['description']} after {self.job_timeout:.0f}s")
+                self.in_flight.pop(prompt_id)
+                self.cancel(prompt_id, running=prompt_id in running)
+                self.timed_out += 1
+                if self.on_complete is not None:
+                    self.on_complete(job, {'status': {'status_str': 'timeout', 'messages': []}, 'outputs': {}})
+        return True
+
+    def cancel(self, prompt_id: str, running: bool):
+        """Stop a prompt on the server: interrupt it if running, else delete it from the queue."""
+        if running:
+            url, payload = f"{self.base_url}/interrupt", {'prompt_id': prompt_id}
+        else:
+            url, payload = f"{self.base_url}/queue", {'delete': [prompt_id]}
+        try:
+            self.client.post(url, json=payload, timeout=10, retries=0)
+        except Exception as e:
+            print(f"  ⚠ Could not cancel {prompt_id[:8]}: {e}")
+
+    def _finish(self, prompt_id: str, entry: Dict):
+        job = self.in_flight.pop(prompt_id)
+        status = entry.get('status', {})
+        duration = time.time() - job['submitted']
+        ok = status.get('status_str', 'success') == 'success'
+
+        if ok:
+            self.completed += 1
+            print(f"  ✓ Done: {job['description']} ({duration:.1f}s)")
+        else:
+            self.failed += 1
+            print(f"  ❌ Generation failed: {job['description']} {status.get('messages', [])}")
+        telemetry.record('comfyui_job', duration, ok=ok)
+
+        if self.on_complete is not None:
+            self.on_complete(job, entry)
+
+    def drain(self):
+        """Block until every submitted prompt has finished, failed or timed out."""
+        while self.in_flight:
+            self.poll()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Crash-injection check for faceswap_pipeline.py's stage journal.
+
+Runs the pipeline against fake MaxStudio, S3 and Anthropic servers, killing
+it (os._exit, no cleanup) at random points and re-running it until a run
+completes. Crash points:
+
+- right after any journal write (stage finished, job submitted, target done),
+- halfway through a journal write, leaving a torn line,
+- before any MaxStudio status poll, i.e. while jobs are in flight.
+
+The fakes outlive the crashes and count paid calls (enhance, detect, swap
+and final enhance per input; captions in total). The pipeline journals an
+Idempotency-Key before each paid call, which the fakes honour, so a call
+that was in flight or answered but not yet journaled at a crash is
+answered again without a charge when the next run resends it. The check
+at the end fails if any call was paid for more than once, and shows that
+every target ended up with exactly one output, caption and meta.jsonl
+record.
+
+Within a run nothing may be resent: a separate run against a MaxStudio
+stand-in that accepts the first submission but answers it too late checks
+that the timed-out submit is billed once and not retried.
+
+Usage:
+  python3 crash_test_faceswap.py
+  python3 crash_test_faceswap.py --targets 50 --crash-rate 0.05 --seed 7
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Dict, Tuple
+
+from PIL import Image
+
+import fake_maxstudio
+import fake_s3
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'scripts'))
+import fake_anthropic
+
+CRASH_EXIT_CODE = 137
+MODEL = 'crashtest'
+
+
+def run_child(crash_rate: float, seed: int, pipeline_args):
+    """Run faceswap_pipeline.main() in this process, dying at random crash points."""
+    import faceswap_pipeline
+    import maxstudio_poller
+
+    rng = random.Random(seed)
+
+    def crash():
+        sys.stdout.flush()
+        os._exit(CRASH_EXIT_CODE)
+
+    record = faceswap_pipeline.FaceSwapJournal.record
+    poll = maxstudio_poller.JobPoller._poll
+
+    def crashing_record(self, target, stage=None, **fields):
+        if rng.random() < crash_rate / 2:
+            line = json.dumps(dict(self.targets.get(target, {}), **fields, target=target))
+            self._file.write(line[:len(line) // 2])
+            self._file.flush()
+            crash()
+        result = record(self, target, stage, **fields)
+        if rng.random() < crash_rate:
+            crash()
+        return result
+
+    async def crashing_poll(self, job):
+        if rng.random() < crash_rate:
+            crash()
+        return await poll(self, job)
+
+    faceswap_pipeline.FaceSwapJournal.record = crashing_record
+    maxstudio_poller.JobPoller._poll = crashing_poll
+
+    sys.argv = ['faceswap_pipeline.py'] + pipeline_args
+    faceswap_pipeline.main()
+
+
+def make_targets(targets_dir: Path, count: int, seed: int):
+    """Skin-toned noise images, so no two targets share content (or S3 keys) and all pass the pre-filter."""
+    rng = random.Random(seed)
+    targets_dir.mkdir(parents=True)
+    for i in range(count):
+        pixels = bytes(max(0, min(255, base + rng.randint(-24, 24))) for _ in range(48 * 64) for base in (205, 150, 125))
+        Image.frombytes('RGB', (48, 64), pixels).save(targets_dir / f"target_{i:03d}.jpg", quality=90)
+
+
+def stalled_submit_check(env: Dict) -> Tuple[bool, str]:
+    """Time out the first MaxStudio submit (after it was accepted); it must be billed once."""
+    maxstudio = fake_maxstudio.start_server(enhance_latency=0.2, swap_latency=0.2, detect_latency=0.05,
+                                            stall_submits=1, stall_seconds=3.0)
+    work = Path(tempfile.mkdtemp(prefix='crash_test_faceswap_stall_'))
+    make_targets(work / 'targets', 1, 0)
+    Image.new('RGB', (48, 48), (200, 170, 150)).save(work / 'face.png')
+    result = subprocess.run(
+        [sys.executable, str(Path(__file__).resolve().parent / 'faceswap_pipeline.py'), MODEL, 'face.png', 'targets',
+         '--request-timeout', '1', '--quality', 'min_edge=32'],
+        cwd=work, env=dict(env, MAXSTUDIO_API_URL=maxstudio.url), capture_output=True, text=True
+    )
+    billed = sum(maxstudio.charges.values())
+    ok = result.returncode == 1 and maxstudio.submitted == 1 and billed == 1
+    return ok, f"{maxstudio.submitted} submitted, {billed} billed, exit {result.returncode} (expected 1, 1, 1)"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Kill faceswap_pipeline.py at random checkpoints and check nothing is paid twice')
+    parser.add_argument('--targets', type=int, default=30, help='Target images')
+    parser.add_argument('--crash-rate', type=float, default=0.02, help='Chance of dying at each crash point')
+    parser.add_argument('--seed', type=int, default=1, help='Seed for targets and crash points')
+    parser.add_argument('--max-runs', type=int, default=200, help='Give up after this many runs')
+    parser.add_argument('--concurrency', type=int, default=8, help='Pipeline workers per stage')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args, pipeline_args = parser.parse_known_args()
+
+    if args.child:
+        run_child(args.crash_rate, args.seed, pipeline_args)
+        return
+
+    maxstudio = fake_maxstudio.start_server(enhance_latency=0.4, swap_latency=0.6, detect_latency=0.05, jitter=0.3)
+    s3 = fake_s3.start_server()
+    anthropic = fake_anthropic.start_server(latency=0.1)
+
+    work = Path(tempfile.mkdtemp(prefix='crash_test_faceswap_'))
+    make_targets(work / 'targets', args.targets, args.seed)
+    Image.new('RGB', (48, 48), (200, 170, 150)).save(work / 'face.png')
+
+    env = dict(
+        os.environ,
+        API_KEY='fake',
+        ANTHROPIC_API_KEY='fake',
+        MAXSTUDIO_API_URL=maxstudio.url,
+        ANTHROPIC_API_URL=anthropic.url,
+        S3_ENDPOINT_URL=s3.url
+    )
+    env.pop('PIPELINE_TELEMETRY', None)
+
+    print(f"Crash test: {args.targets} targets, crash rate {args.crash_rate}, work dir {work}")
+    crashes = 0
+    for run in range(1, args.max_runs + 1):
+        result = subprocess.run(
+            [sys.executable, str(Path(__file__).resolve()), '--child', '--crash-rate', str(args.crash_rate),
+             '--seed', str(args.seed * 10_000 + run), MODEL, 'face.png', 'targets',
+             '--concurrency', str(args.concurrency), '--quality', 'min_edge=32'],
+            cwd=work, env=env, capture_output=True, text=True
+        )
+        if result.returncode == CRASH_EXIT_CODE:
+            crashes += 1
+            done = sum(1 for _ in (work / MODEL / 'outputs' / 'faceswapped').glob('*.jpg'))
+            print(f"  → run {run}: crashed ({done}/{args.targets} outputs so far)")
+            continue
+        if result.returncode != 0:
+            print(result.stdout[-2000:], result.stderr[-2000:])
+            print(f"✗ run {run} exited with {result.returncode}")
+            sys.exit(1)
+        print(f"  ✓ run {run}: completed after {crashes} crash(es)")
+        break
+    else:
+        print(f"✗ no run completed within {args.max_runs} runs")
+        sys.exit(1)
+
+    n = args.targets
+    outputs = sorted((work / MODEL / 'outputs' / 'faceswapped').glob('*.jpg'))
+    captions = sorted((work / 'dataset' / MODEL / 'captions').glob('*.txt'))
+    with open(work / 'dataset' / MODEL / 'meta' / 'meta.jsonl') as f:
+        meta_paths = [json.loads(line)['path'] for line in f if line.strip()]
+    journal = {}
+    with open(work / 'dataset' / MODEL / 'meta' / 'faceswap_journal.jsonl') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            journal[record['target']] = record
+    leftovers = list((work / 'dataset' / MODEL / 'stages').iterdir())
+    charged = {
+        endpoint: sum(count for (name, _), count in maxstudio.charges.items() if name == endpoint)
+        for endpoint in ('image-enhancer', 'detect-face-image', 'swap-image')
+    }
+    repeated = maxstudio.repeated_charges()
+    captions_billed = anthropic.requests - anthropic.replays
+
+    stalled_ok, stalled_detail = stalled_submit_check(env)
+    checks = [
+        ('no MaxStudio call paid for twice', not repeated,
+         f"{len(repeated)} input(s) repeated, {maxstudio.replays} resent call(s) replayed"),
+        ('enhance jobs (target + final)', charged['image-enhancer'] == 2 * n, f"{charged['image-enhancer']} / {2 * n}"),
+        ('face detections', charged['detect-face-image'] == n, f"{charged['detect-face-image']} / {n}"),
+        ('swap jobs', charged['swap-image'] == n, f"{charged['swap-image']} / {n}"),
+        ('captions billed', captions_billed == n,
+         f"{captions_billed} / {n} ({anthropic.replays} resent call(s) replayed)"),
+        ('outputs', len(outputs) == n, f"{len(outputs)} / {n}"),
+        ('captions', len(captions) == n, f"{len(captions)} / {n}"),
+        ('meta.jsonl records, one per output', len(meta_paths) == len(set(meta_paths)) == n,
+         f"{len(meta_paths)} lines, {len(set(meta_paths))} distinct / {n}"),
+        ('journal: every target done', sum(r.get('stage') == 'done' for r in journal.values()) == n,
+         f"{sum(r.get('stage') == 'done' for r in journal.values())} / {n}"),
+        ('intermediate images cleaned up', not leftovers, f"{len(leftovers)} left"),
+        ('timed-out submit not resent', stalled_ok, stalled_detail),
+    ]
+
+    print()
+    print(f"{crashes} crash(es), {maxstudio.submitted} MaxStudio jobs, {maxstudio.polls} status polls, "
+          f"{s3.puts} S3 PUTs")
+    for name, ok, detail in checks:
+        print(f"  {'✓' if ok else '✗'} {name}: {detail}")
+    for (endpoint, job_input), count in repeated[:10]:
+        print(f"    {endpoint} {job_input[:60]} paid {count}x")
+
+    sys.exit(0 if all(ok for _, ok, _ in checks) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,8 @@
 # Face Swap + Caption Workflow Script with Dynamic Model Support
 # Usage: ./face-swap-model.sh <model_name> <source_face.jpg> <target_body.jpg>
 
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+
 # Load environment variables from .env file
 if [ -f .env ]; then
     export $(cat .env | grep -v '^#' | xargs)
@@ -76,13 +78,18 @@ mkdir -p "dataset/${MODEL_NAME}/meta"
 python3 << PYEOF
 import base64
 import json
-import requests
 import time
 import sys
 import os
 from pathlib import Path
-import boto3
-from datetime import datetime
+
+sys.path.insert(0, "$SCRIPT_DIR")
+from http_client import get_client
+from s3_upload import S3Uploader
+import telemetry  # records only when PIPELINE_TELEMETRY is set
+
+# Pooled keep-alive client with retries and circuit breaking
+client = get_client()
 
 API_KEY = "$API_KEY"
 ANTHROPIC_API_KEY = "$ANTHROPIC_API_KEY"
@@ -97,36 +104,26 @@ AWS_SECRET_ACCESS_KEY = "$AWS_SECRET_ACCESS_KEY"
 AWS_S3_BUCKET = "$AWS_S3_BUCKET"
 AWS_REGION = "$AWS_REGION"
 
-# Initialize S3 client
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
-)
+# Content-addressed uploads: identical bytes are uploaded once and reused
+# across jobs and runs (see s3_upload.py)
+uploader = S3Uploader(AWS_S3_BUCKET, AWS_REGION, endpoint_url=os.getenv('S3_ENDPOINT_URL') or None)
 
-def upload_to_s3(image_data, filename):
-    """Upload image to S3 and return public URL"""
+def upload_to_s3(image_data):
+    """Upload image to S3 (unless already there) and return public URL"""
     try:
-        key = f"{MODEL_NAME}/temp/{datetime.now().strftime('%Y%m%d')}/{filename}"
-        s3_client.put_object(
-            Bucket=AWS_S3_BUCKET,
-            Key=key,
-            Body=image_data,
-            ContentType='image/jpeg',
-            ACL='public-read'
-        )
-        url = f"https://{AWS_S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{key}"
-        return url
+        return uploader.upload(image_data, f"{MODEL_NAME}/temp")
     except Exception as e:
         print(f"  Error uploading to S3: {e}")
         return None
 
+pipeline_start = time.perf_counter()
+
 print("Step 1: Enhancing target image...")
+step_start = time.perf_counter()
 with open(TARGET_BODY, 'rb') as f:
     target_base64 = base64.b64encode(f.read()).decode('utf-8')
 
-response = requests.post(
+response = client.post(
     'https://api.maxstudio.ai/image-enhancer',
     headers={'Content-Type': 'application/json', 'x-api-key': API_KEY},
     json={'image': target_base64}
@@ -143,7 +140,7 @@ print(f"  Job ID: {job_id}")
 print("  Polling for completion...")
 for i in range(60):
     time.sleep(2)
-    status_resp = requests.get(
+    status_resp = client.get(
         f'https://api.maxstudio.ai/image-enhancer/{job_id}',
         headers={'x-api-key': API_KEY}
     )
@@ -154,6 +151,7 @@ for i in range(60):
             enhanced_base64 = data['result']
             enhanced_bytes = base64.b64decode(enhanced_base64)
             print(f"  ✓ Enhanced ({len(enhanced_bytes)} bytes)")
+            telemetry.record('enhance', time.perf_counter() - step_start, bytes=len(target_base64), polls=i + 1)
             break
         elif data['status'] == 'failed':
             print("  ✗ Enhancement failed")
@@ -167,18 +165,19 @@ else:
 
 # Upload enhanced image to S3
 print("\nStep 1.5: Uploading enhanced image to S3...")
-enhanced_url = upload_to_s3(enhanced_bytes, 'enhanced_target.jpg')
+enhanced_url = upload_to_s3(enhanced_bytes)
 if not enhanced_url:
     print("  ✗ Failed to upload to S3")
     sys.exit(1)
 print(f"  ✓ Uploaded: {enhanced_url}")
 
 print("\nStep 2: Detecting faces in enhanced image...")
-detect_resp = requests.post(
-    'https://api.maxstudio.ai/detect-face-image',
-    headers={'Content-Type': 'application/json', 'x-api-key': API_KEY},
-    json={'imageUrl': enhanced_url}
-)
+with telemetry.span('detect'):
+    detect_resp = client.post(
+        'https://api.maxstudio.ai/detect-face-image',
+        headers={'Content-Type': 'application/json', 'x-api-key': API_KEY},
+        json={'imageUrl': enhanced_url}
+    )
 
 if detect_resp.status_code != 200:
     print(f"  Error: {detect_resp.status_code} - {detect_resp.text}")
@@ -201,7 +200,7 @@ with open(SOURCE_FACE, 'rb') as f:
     source_bytes = f.read()
     source_base64 = base64.b64encode(source_bytes).decode('utf-8')
 
-source_url = upload_to_s3(source_bytes, 'source_face.jpg')
+source_url = upload_to_s3(source_bytes)
 if not source_url:
     print(f"  Upload failed, using data URL")
     source_url = f'data:image/jpeg;base64,{source_base64}'
@@ -209,7 +208,8 @@ else:
     print(f"  ✓ Uploaded: {source_url}")
 
 print("\nStep 4: Face swapping...")
-swap_resp = requests.post(
+step_start = time.perf_counter()
+swap_resp = client.post(
     'https://api.maxstudio.ai/swap-image',
     headers={'Content-Type': 'application/json', 'x-api-key': API_KEY},
     json={
@@ -231,7 +231,7 @@ print(f"  Job ID: {swap_job_id}")
 print("  Polling for completion...")
 for i in range(60):
     time.sleep(3)
-    status_resp = requests.get(
+    status_resp = client.get(
         f'https://api.maxstudio.ai/swap-image/{swap_job_id}',
         headers={'x-api-key': API_KEY}
     )
@@ -242,9 +242,13 @@ for i in range(60):
             swapped_url = data['result']['mediaUrl']
             print(f"  ✓ Swapped: {swapped_url}")
 
+            telemetry.record('swap', time.perf_counter() - step_start, polls=i + 1)
+
             # Download swapped image
-            img_resp = requests.get(swapped_url)
-            swapped_bytes = img_resp.content
+            with telemetry.span('download') as span:
+                img_resp = client.get(swapped_url)
+                swapped_bytes = img_resp.content
+                span['bytes'] = len(swapped_bytes)
             break
         elif data['status'] == 'failed':
             print("  ✗ Face swap failed")
@@ -254,9 +258,10 @@ else:
     sys.exit(1)
 
 print("\nStep 5: Final enhancement...")
+step_start = time.perf_counter()
 final_base64 = base64.b64encode(swapped_bytes).decode('utf-8')
 
-final_resp = requests.post(
+final_resp = client.post(
     'https://api.maxstudio.ai/image-enhancer',
     headers={'Content-Type': 'application/json', 'x-api-key': API_KEY},
     json={'image': final_base64}
@@ -272,7 +277,7 @@ print(f"  Job ID: {final_job_id}")
 print("  Polling for completion...")
 for i in range(60):
     time.sleep(2)
-    status_resp = requests.get(
+    status_resp = client.get(
         f'https://api.maxstudio.ai/image-enhancer/{final_job_id}',
         headers={'x-api-key': API_KEY}
     )
@@ -282,6 +287,7 @@ for i in range(60):
         if data['status'] == 'completed':
             final_base64 = data['result']
             final_bytes = base64.b64decode(final_base64)
+            telemetry.record('final_enhance', time.perf_counter() - step_start, bytes=len(swapped_bytes), polls=i + 1)
 
             # Save final result
             with open(OUTPUT_FILE, 'wb') as f:
@@ -357,12 +363,15 @@ payload = {
 }
 
 try:
-    caption_resp = requests.post(
-        'https://api.anthropic.com/v1/messages',
-        headers=headers,
-        json=payload,
-        timeout=60
-    )
+    with telemetry.span('caption', bytes=len(final_base64)) as span:
+        caption_resp = client.post(
+            'https://api.anthropic.com/v1/messages',
+            headers=headers,
+            json=payload,
+            timeout=60,
+            idempotent=True  # a caption request has no side effects
+        )
+        span['status'] = caption_resp.status_code
 
     if caption_resp.status_code == 200:
         result = caption_resp.json()
@@ -429,6 +438,7 @@ with open(meta_path, 'a') as f:
     f.write(json.dumps(meta_entry) + '\n')
 
 print(f"  ✓ Saved metadata: {meta_path}")
+telemetry.record(telemetry.IMAGE_STAGE, time.perf_counter() - pipeline_start, target=TARGET_BODY)
 
 print("\n=== COMPLETE ===")
 print(f"Model: {MODEL_NAME}")
@@ -3,6 +3,8 @@
 # Face Swap + Caption Workflow Script
 # Usage: ./face-swap-with-caption.sh source_face.jpg target_body.jpg
 
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+
 # Load environment variables from .env file
 if [ -f .env ]; then
     export $(cat .env | grep -v '^#' | xargs)
@@ -54,13 +56,17 @@ mkdir -p "Blondie/outputs/faceswapped"
 python3 << PYEOF
 import base64
 import json
-import requests
 import time
 import sys
 import os
 from pathlib import Path
-import boto3
-from datetime import datetime
+
+sys.path.insert(0, "$SCRIPT_DIR")
+from http_client import get_client
+from s3_upload import S3Uploader
+
+# Pooled keep-alive client with retries and circuit breaking
+client = get_client()
 
 API_KEY = "$API_KEY"
 ANTHROPIC_API_KEY = "$ANTHROPIC_API_KEY"
@@ -74,27 +80,14 @@ AWS_SECRET_ACCESS_KEY = "$AWS_SECRET_ACCESS_KEY"
 AWS_S3_BUCKET = "$AWS_S3_BUCKET"
 AWS_REGION = "$AWS_REGION"
 
-# Initialize S3 client
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
-)
+# Content-addressed uploads: identical bytes are uploaded once and reused
+# across jobs and runs (see s3_upload.py)
+uploader = S3Uploader(AWS_S3_BUCKET, AWS_REGION, endpoint_url=os.getenv('S3_ENDPOINT_URL') or None)
 
-def upload_to_s3(image_data, filename):
-    """Upload image to S3 and return public URL"""
+def upload_to_s3(image_data):
+    """Upload image to S3 (unless already there) and return public URL"""
     try:
-        key = f"faceswap/{datetime.now().strftime('%Y%m%d')}/{filename}"
-        s3_client.put_object(
-            Bucket=AWS_S3_BUCKET,
-            Key=key,
-            Body=image_data,
-            ContentType='image/jpeg',
-            ACL='public-read'
-        )
-        url = f"https://{AWS_S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{key}"
-        return url
+        return uploader.upload(image_data, 'faceswap')
     except Exception as e:
         print(f"  Error uploading to S3: {e}")
         return None
@@ -103,7 +96,7 @@ print("Step 1: Enhancing target image...")
 with open(TARGET_BODY, 'rb') as f:
     target_base64 = base64.b64encode(f.read()).decode('utf-8')
 
-response = requests.post(
+response = client.post(
     'https://api.maxstudio.ai/image-enhancer',
     headers={'Content-Type': 'application/json', 'x-api-key': API_KEY},
     json={'image': target_base64}
@@ -120,7 +113,7 @@ print(f"  Job ID: {job_id}")
 print("  Polling for completion...")
 for i in range(60):
     time.sleep(2)
-    status_resp = requests.get(
+    status_resp = client.get(
         f'https://api.maxstudio.ai/image-enhancer/{job_id}',
         headers={'x-api-key': API_KEY}
     )
@@ -144,14 +137,14 @@ else:
 
 # Upload enhanced image to S3
 print("\nStep 1.5: Uploading enhanced image to S3...")
-enhanced_url = upload_to_s3(enhanced_bytes, 'enhanced_target.jpg')
+enhanced_url = upload_to_s3(enhanced_bytes)
 if not enhanced_url:
     print("  ✗ Failed to upload to S3")
     sys.exit(1)
 print(f"  ✓ Uploaded: {enhanced_url}")
 
 print("\nStep 2: Detecting faces in enhanced image...")
-detect_resp = requests.post(
+detect_resp = client.post(
     'https://api.maxstudio.ai/detect-face-image',
     headers={'Content-Type': 'application/json', 'x-api-key': API_KEY},
     json={'imageUrl': enhanced_url}
@@ -178,7 +171,7 @@ with open(SOURCE_FACE, 'rb') as f:
     source_bytes = f.read()
     source_base64 = base64.b64encode(source_bytes).decode('utf-8')
 
-source_url = upload_to_s3(source_bytes, 'source_face.jpg')
+source_url = upload_to_s3(source_bytes)
 if not source_url:
     print(f"  Upload failed, using data URL")
     source_url = f'data:image/jpeg;base64,{source_base64}'
@@ -186,7 +179,7 @@ else:
     print(f"  ✓ Uploaded: {source_url}")
 
 print("\nStep 4: Face swapping...")
-swap_resp = requests.post(
+swap_resp = client.post(
     'https://api.maxstudio.ai/swap-image',
     headers={'Content-Type': 'application/json', 'x-api-key': API_KEY},
     json={
@@ -208,7 +201,7 @@ print(f"  Job ID: {swap_job_id}")
 print("  Polling for completion...")
 for i in range(60):
     time.sleep(3)
-    status_resp = requests.get(
+    status_resp = client.get(
         f'https://api.maxstudio.ai/swap-image/{swap_job_id}',
         headers={'x-api-key': API_KEY}
     )
@@ -220,7 +213,7 @@ for i in range(60):
             print(f"  ✓ Swapped: {swapped_url}")
 
             # Download swapped image
-            img_resp = requests.get(swapped_url)
+            img_resp = client.get(swapped_url)
             swapped_bytes = img_resp.content
             break
         elif data['status'] == 'failed':
@@ -233,7 +226,7 @@ else:
 print("\nStep 5: Final enhancement...")
 final_base64 = base64.b64encode(swapped_bytes).decode('utf-8')
 
-final_resp = requests.post(
+final_resp = client.post(
     'https://api.maxstudio.ai/image-enhancer',
     headers={'Content-Type': 'application/json', 'x-api-key': API_KEY},
     json={'image': final_base64}
@@ -249,7 +242,7 @@ print(f"  Job ID: {final_job_id}")
 print("  Polling for completion...")
 for i in range(60):
     time.sleep(2)
-    status_resp = requests.get(
+    status_resp = client.get(
         f'https://api.maxstudio.ai/image-enhancer/{final_job_id}',
         headers={'x-api-key': API_KEY}
     )
@@ -336,11 +329,12 @@ payload = {
 }
 
 try:
-    caption_resp = requests.post(
+    caption_resp = client.post(
         'https://api.anthropic.com/v1/messages',
         headers=headers,
         json=payload,
-        timeout=60
+        timeout=60,
+        idempotent=True  # a caption request has no side effects
     )
 
     if caption_resp.status_code == 200:
@@ -0,0 +1,775 @@
+#!/usr/bin/env python3
+"""
+Single-process face swap + caption pipeline.
+
+Replaces one face-swap-model.sh (and one Python interpreter, boto3 client and
+HTTP pool) per target with stage queues in one event loop:
+
+  prefilter -> enhance -> upload -> detect -> swap -> final_enhance -> caption
+
+Each stage has its own worker count (--concurrency for all, --limit
+STAGE=N to override one). Blocking calls run on one shared thread pool
+through the shared pooled client (http_client.get_client) and one
+content-addressed S3 uploader (s3_upload.py: the source face is uploaded
+once, or not at all if an earlier run did). MaxStudio jobs are awaited
+on one shared, rate-capped status poller (maxstudio_poller.py), so a
+waiting job holds no thread. Queues between stages are bounded, so
+enhanced images do not pile up in memory ahead of a slow stage. Outputs,
+captions and meta.jsonl match face-swap-model.sh.
+
+The prefilter stage scores each target locally in a process pool
+(quality_filter.py: resolution, sharpness, exposure, skin-tone face check)
+before anything is paid for. Rejected targets are logged and dropped, and
+targets that are already high resolution skip the first enhance job; the
+summary reports the API calls this avoided. --no-prefilter sends every
+target through the full pipeline, --quality NAME=VALUE overrides a threshold.
+
+Every finished stage is checkpointed per target in
+dataset/{model}/meta/faceswap_journal.jsonl, so a re-run resumes each
+target at its first incomplete stage. Before each paid call (MaxStudio
+submit or detect, Anthropic caption) the journal records an intent with
+a fresh Idempotency-Key, and after a submit the job id as well: a re-run
+re-attaches to a journaled job instead of submitting it again, and
+resends an unanswered call under its journaled key, which an API that
+honours the key answers without charging again. The Messages API does
+not document such a key, so a caption in flight at a crash may be paid
+for twice there. Targets with an output but no journal entry (earlier
+face-swap-model.sh runs) are skipped; delete an output to reprocess it.
+Rejected targets are scored again on the next run. crash_test_faceswap.py
+kills runs at random checkpoints and checks that no call is paid for twice.
+
+For local runs, point it at the stand-ins:
+
+  python3 fake_maxstudio.py --port 8700 &
+  python3 fake_s3.py --port 9000 &
+  python3 scripts/fake_anthropic.py --port 8600 &
+  MAXSTUDIO_API_URL=http://127.0.0.1:8700 ANTHROPIC_API_URL=http://127.0.0.1:8600/v1/messages \\
+      python3 faceswap_pipeline.py blondie source/blondie-1.png targets/ --s3-endpoint http://127.0.0.1:9000
+
+Usage:
+  python3 faceswap_pipeline.py <model_name> <source_face> <targets_dir> [--concurrency 8] [--limit swap=12]
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import asyncio
+import hashlib
+import argparse
+import uuid
+from datetime import datetime
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Caption helpers live in scripts/
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'scripts'))
+
+import telemetry
+from post_swap_caption import ANTHROPIC_API_URL, caption_image_data, fallback_caption
+from maxstudio_poller import JobFailed, JobNotFound, JobPoller
+from quality_filter import DEFAULT_THRESHOLDS, ROUTES, assess_target, exit_with_parent, format_avoided
+from s3_upload import S3Uploader
+
+
+MAXSTUDIO_API_URL = os.getenv('MAXSTUDIO_API_URL', 'https://api.maxstudio.ai')
+
+STAGES = ('prefilter', 'enhance', 'upload', 'detect', 'swap', 'final_enhance', 'caption')
+
+# Workers per stage; the MaxStudio job stages mostly wait on the API.
+# prefilter is CPU-bound; its process pool never exceeds the CPU count.
+DEFAULT_LIMITS = {
+    'prefilter': os.cpu_count() or 1,
+    'enhance': 8,
+    'upload': 4,
+    'detect': 4,
+    'swap': 8,
+    'final_enhance': 8,
+    'caption': 4
+}
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+
+
+class StageError(Exception):
+    """A stage failed for one target; the rest of the run carries on."""
+
+
+class TargetRejected(Exception):
+    """The pre-filter judged a target unusable; it is dropped before any paid call."""
+
+
+class FaceSwapJournal:
+    """
+    Append-only JSONL log of each target's progress through the stages.
+
+    Every line holds the target's whole record so far: the last stage it
+    finished (`stage`), the artifacts of finished stages (intermediate image
+    hashes, S3 URL, face box, swap URL, caption) and, while a paid call is
+    in flight, `pending` with its Idempotency-Key (and MaxStudio job id). The last line for a target wins, so a crash
+    can at worst lose the line being written; a torn final line is ignored
+    on load.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.targets: Dict[str, Dict] = {}
+        torn = False
+        if self.path.exists():
+            with open(self.path) as f:
+                for line in f:
+                    torn = not line.endswith('\n')
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if 'target' in record:
+                        self.targets[record['target']] = record
+        self._file = open(self.path, 'a', buffering=1)
+        # Start on a fresh line after a torn one, or the next record would be lost with it
+        if torn:
+            self._file.write('\n')
+
+    def get(self, target: str) -> Dict:
+        return dict(self.targets.get(target, {}))
+
+    def record(self, target: str, stage: Optional[str] = None, **fields) -> Dict:
+        """Merge `fields` into the target's record; finishing a `stage` clears its pending job."""
+        record = dict(self.targets.get(target, {}), **fields, target=target, ts=round(time.time(), 3))
+        if stage is not None:
+            record['stage'] = stage
+            if 'pending' not in fields:
+                record.pop('pending', None)
+        self.targets[target] = record
+        self._file.write(json.dumps(record) + '\n')
+        return record
+
+    def reset(self, target: str) -> Dict:
+        """Start the target over (its output was deleted to reprocess it)."""
+        self.targets.pop(target, None)
+        return self.record(target)
+
+    def close(self):
+        self._file.close()
+
+
+def resume_index(record: Dict) -> Optional[int]:
+    """Index in STAGES a journaled target resumes at (None when it is done)."""
+    stage = record.get('stage')
+    if stage == 'done':
+        return None
+    if stage is None or stage == 'rejected':
+        return 0
+    # After 'caption' only the (free) output writes are left, which caption redoes
+    return min(STAGES.index(stage) + 1, len(STAGES) - 1)
+
+
+def write_atomic(path: Path, data: bytes):
+    tmp_path = path.with_name(path.name + '.tmp')
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def read_base64(path: Path) -> str:
+    with open(path, 'rb') as f:
+        return base64.b64encode(f.read()).decode('utf-8')
+
+
+def find_targets(targets_dir: Path) -> List[Path]:
+    return sorted(p for p in targets_dir.rglob('*') if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS)
+
+
+class FaceSwapPipeline:
+    """Stage queues for one model's face swaps, run with `await run(targets)`."""
+
+    def __init__(
+        self,
+        model_name: str,
+        source_face: Path,
+        uploader: S3Uploader,
+        api_key: str,
+        anthropic_api_key: Optional[str] = None,
+        trigger_token: Optional[str] = None,
+        class_token: str = 'woman',
+        limits: Optional[Dict[str, int]] = None,
+        maxstudio_url: str = MAXSTUDIO_API_URL,
+        anthropic_url: str = ANTHROPIC_API_URL,
+        poll_interval: Optional[float] = None,
+        poll_timeout: Optional[float] = None,
+        max_poll_rate: float = 10.0,
+        request_timeout: float = 60.0,
+        prefilter: bool = True,
+        quality_thresholds: Optional[Dict] = None,
+        root: Path = Path('.')
+    ):
+        self.model_name = model_name
+        self.source_face = source_face
+        self.uploader = uploader
+        self.api_key = api_key
+        self.anthropic_api_key = anthropic_api_key
+        self.trigger_token = trigger_token or model_name.lower()
+        self.class_token = class_token
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self.maxstudio_url = maxstudio_url.rstrip('/')
+        self.anthropic_url = anthropic_url
+        self.poll_interval = poll_interval
+        self.poll_timeout = poll_timeout
+        self.max_poll_rate = max_poll_rate
+        self.request_timeout = request_timeout
+        self.prefilter_enabled = prefilter
+        self.quality_thresholds = {**DEFAULT_THRESHOLDS, **(quality_thresholds or {})}
+        self.client = uploader.client
+
+        self.output_dir = root / model_name / 'outputs' / 'faceswapped'
+        self.captions_dir = root / 'dataset' / model_name / 'captions'
+        self.prompts_dir = root / 'dataset' / model_name / 'prompts'
+        self.meta_path = root / 'dataset' / model_name / 'meta' / 'meta.jsonl'
+        self.journal_path = root / 'dataset' / model_name / 'meta' / 'faceswap_journal.jsonl'
+        # Intermediate images kept until their target is done, so a resumed stage has its input
+        self.stages_dir = root / 'dataset' / model_name / 'stages'
+
+        self.source_url: Optional[str] = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.cpu_pool: Optional[ProcessPoolExecutor] = None
+        self.poller: Optional[JobPoller] = None
+        self.journal: Optional[FaceSwapJournal] = None
+        self.completed = 0
+        self.failed: List[str] = []
+        self.rejected: List[str] = []
+        self.routes = {route: 0 for route in ROUTES}
+        self.total = 0
+
+    def progress(self) -> str:
+        return f"({self.completed + len(self.failed) + len(self.rejected)}/{self.total})"
+
+    def output_path(self, target: Path) -> Path:
+        return self.output_dir / f"{target.stem}_swapped.jpg"
+
+    @property
+    def upload_prefix(self) -> str:
+        return f"{self.model_name}/temp"
+
+    async def _call(self, fn, *args, **kwargs):
+        """Run a blocking call on the shared thread pool."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(fn, *args, **kwargs))
+
+    def _checkpoint(self, job: Dict, stage: Optional[str] = None, **fields):
+        job['record'] = self.journal.record(job['key'], stage, **fields)
+
+    def _kept_path(self, job: Dict, stage: str) -> Path:
+        return self.stages_dir / f"{job['output'].stem}.{stage}.jpg"
+
+    def _discard_kept(self, output: Path):
+        for stage in ('enhance', 'swap'):
+            for path in (self.stages_dir / f"{output.stem}.{stage}.jpg", self.stages_dir / f"{output.stem}.{stage}.jpg.tmp"):
+                path.unlink(missing_ok=True)
+
+    async def _keep(self, job: Dict, stage: str, data: bytes) -> str:
+        """Save a stage's image for later stages; returns its SHA-256 for the journal."""
+        await self._call(write_atomic, self._kept_path(job, stage), data)
+        return hashlib.sha256(data).hexdigest()
+
+    async def _kept(self, job: Dict, stage: str) -> Optional[bytes]:
+        """The stage's saved image, or None when it is missing or does not match the journal."""
+        path = self._kept_path(job, stage)
+        data = await self._call(path.read_bytes) if path.exists() else b''
+        if hashlib.sha256(data).hexdigest() != job['record'].get(f'{stage}_sha256'):
+            return None
+        return data
+
+    async def _refetch(self, job: Dict, stage: str) -> Optional[bytes]:
+        """Fetch a finished stage's image again from MaxStudio (swap URL or enhance job), or None."""
+        record = job['record']
+        try:
+            if stage == 'swap' and record.get('swap_url'):
+                response = await self._call(self.client.get, record['swap_url'])
+                data = response.content if response.status_code == 200 else None
+            elif stage == 'enhance' and record.get('enhance_job'):
+                enhance_job = record['enhance_job']
+                result, _ = await self.poller.wait(
+                    'image-enhancer', enhance_job['job_id'], age=max(0.0, time.time() - enhance_job['ts']))
+                data = await self._call(base64.b64decode, result)
+            else:
+                return None
+        except Exception as e:
+            print(f"  ⚠ Could not fetch the {stage} result for {job['target'].name} again: {e}")
+            return None
+        if data is None or hashlib.sha256(data).hexdigest() != record.get(f'{stage}_sha256'):
+            return None
+        await self._call(write_atomic, self._kept_path(job, stage), data)
+        return data
+
+    async def _restore(self, job: Dict, stage: str) -> bytes:
+        """
+        A finished stage's image for a resumed target: the saved copy, else
+        the result fetched again from MaxStudio, else the stage run again.
+        """
+        data = await self._kept(job, stage) or await self._refetch(job, stage)
+        if data is not None:
+            return data
+        print(f"  ⚠ {stage} image for {job['target'].name} is lost, running {stage} again")
+        await getattr(self, stage)(job)
+        return job.pop('enhanced' if stage == 'enhance' else 'swapped')
+
+    def _intent(self, job: Dict, stage: str) -> str:
+        """
+        Journal the Idempotency-Key a paid call is about to be sent with, or
+        return the one an earlier run journaled for this stage and never
+        saw answered.
+        """
+        pending = job['record'].get('pending')
+        if pending and pending['stage'] == stage and pending.get('key'):
+            return pending['key']
+        key = uuid.uuid4().hex
+        self._checkpoint(job, pending={'stage': stage, 'key': key, 'ts': round(time.time(), 3)})
+        return key
+
+    async def _maxstudio_job(self, job: Dict, stage: str, endpoint: str, payload):
+        """
+        Run the stage's MaxStudio job and wait for the poller to see it finish;
+        returns (result, polls).
+
+        A job journaled as pending by an earlier run is waited on again
+        instead of being resubmitted. `payload` is a coroutine function, so
+        inputs are only read and encoded when a job is actually submitted.
+        """
+        pending = job['record'].get('pending')
+        if pending and pending['stage'] == stage and pending.get('job_id'):
+            try:
+                return await self.poller.wait(endpoint, pending['job_id'], age=max(0.0, time.time() - pending['ts']))
+            except JobNotFound:
+                print(f"  ⚠ {stage} job {pending['job_id']} for {job['target'].name} is gone, resubmitting")
+                self._checkpoint(job, pending=None)
+            except JobFailed:
+                self._checkpoint(job, pending=None)
+                raise
+
+        # Never resent within a run: a submit that timed out may already be a
+        # paid job. A later run resends it under the same journaled key.
+        body = await payload()
+        headers = {'Content-Type': 'application/json', 'x-api-key': self.api_key,
+                   'Idempotency-Key': self._intent(job, stage)}
+        response = await self._call(
+            self.client.post, f"{self.maxstudio_url}/{endpoint}", headers=headers, json=body,
+            timeout=self.request_timeout, idempotent=False)
+        if response.status_code != 200:
+            raise StageError(f"{endpoint}: {response.status_code} - {response.text[:200]}")
+        job_id = response.json()['jobId']
+        self._checkpoint(job, pending=dict(job['record']['pending'], job_id=job_id, ts=round(time.time(), 3)))
+        try:
+            return await self.poller.wait(endpoint, job_id)
+        except JobFailed:
+            # A failed job is not re-attached to; the next run submits a new one
+            self._checkpoint(job, pending=None)
+            raise
+
+    def _skips_enhance(self, job: Dict) -> bool:
+        return job['record'].get('quality', {}).get('route') == 'skip_enhance'
+
+    # Stages: each takes the target's job dict, checkpoints its results in
+    # the journal and raises StageError (or anything else) to drop the target.
+    # Images from the previous stage are handed over in the job dict, or
+    # read back from the stages dir when the target was resumed.
+
+    async def prefilter(self, job: Dict):
+        if self.cpu_pool is None:
+            return
+        with telemetry.span('prefilter') as span:
+            quality = await asyncio.get_running_loop().run_in_executor(
+                self.cpu_pool, partial(assess_target, job['target'], self.quality_thresholds))
+            span['route'] = quality['route']
+        quality.pop('path')
+        self.routes[quality['route']] += 1
+        if quality['route'] == 'reject':
+            self._checkpoint(job, 'rejected', quality=quality)
+            raise TargetRejected(quality['reason'])
+        self._checkpoint(job, 'prefilter', quality=quality)
+
+    async def enhance(self, job: Dict):
+        if self._skips_enhance(job):
+            # Already high resolution: upload the original as is
+            job['enhanced'] = await self._call(job['target'].read_bytes)
+            self._checkpoint(job, 'enhance', enhance_skipped=True)
+            return
+
+        start = time.perf_counter()
+
+        async def payload():
+            return {'image': await self._call(read_base64, job['target'])}
+
+        result, polls = await self._maxstudio_job(job, 'enhance', 'image-enhancer', payload)
+        enhanced = await self._call(base64.b64decode, result)
+        pending = job['record']['pending']
+        self._checkpoint(job, 'enhance', enhance_sha256=await self._keep(job, 'enhance', enhanced),
+                         enhance_job={'job_id': pending['job_id'], 'ts': pending['ts']})
+        job['enhanced'] = enhanced
+        telemetry.record('enhance', time.perf_counter() - start, bytes=len(result), polls=polls)
+
+    async def upload(self, job: Dict):
+        enhanced = job.pop('enhanced', None)
+        if enhanced is None and self._skips_enhance(job):
+            enhanced = await self._call(job['target'].read_bytes)
+        elif enhanced is None:
+            enhanced = await self._restore(job, 'enhance')
+        self._checkpoint(job, 'upload', enhanced_url=await self._call(self.uploader.upload, enhanced, self.upload_prefix))
+
+    async def detect(self, job: Dict):
+        with telemetry.span('detect'):
+            response = await self._call(
+                self.client.post,
+                f"{self.maxstudio_url}/detect-face-image",
+                headers={'Content-Type': 'application/json', 'x-api-key': self.api_key,
+                         'Idempotency-Key': self._intent(job, 'detect')},
+                json={'imageUrl': job['record']['enhanced_url']},
+                timeout=self.request_timeout,
+                idempotent=False
+            )
+        if response.status_code != 200:
+            raise StageError(f"detect-face-image: {response.status_code} - {response.text[:200]}")
+        faces = response.json().get('detectedFaces', [])
+        if not faces:
+            raise StageError('no faces found in target image')
+        self._checkpoint(job, 'detect', face=faces[0])
+
+    async def swap(self, job: Dict):
+        start = time.perf_counter()
+
+        async def payload():
+            return {
+                'mediaUrl': job['record']['enhanced_url'],
+                'faces': [{'newFace': self.source_url, 'originalFace': job['record']['face']}]
+            }
+
+        result, polls = await self._maxstudio_job(job, 'swap', 'swap-image', payload)
+        telemetry.record('swap', time.perf_counter() - start, polls=polls)
+
+        with telemetry.span('download') as span:
+            response = await self._call(self.client.get, result['mediaUrl'])
+            if response.status_code != 200:
+                raise StageError(f"download {result['mediaUrl']}: {response.status_code}")
+            swapped = response.content
+            span['bytes'] = len(swapped)
+        self._checkpoint(job, 'swap', swap_url=result['mediaUrl'], swap_sha256=await self._keep(job, 'swap', swapped))
+        job['swapped'] = swapped
+
+    async def final_enhance(self, job: Dict):
+        start = time.perf_counter()
+        swapped = job.pop('swapped', None)
+
+        async def payload():
+            data = swapped or await self._restore(job, 'swap')
+            return {'image': base64.b64encode(data).decode('utf-8')}
+
+        result, polls = await self._maxstudio_job(job, 'final_enhance', 'image-enhancer', payload)
+        final_bytes = await self._call(base64.b64decode, result)
+        await self._call(write_atomic, job['output'], final_bytes)
+        self._checkpoint(job, 'final_enhance', output_sha256=hashlib.sha256(final_bytes).hexdigest())
+        job['final_base64'] = result
+        telemetry.record('final_enhance', time.perf_counter() - start, bytes=len(final_bytes), polls=polls)
+
+    def _meta_written(self, output: Path) -> bool:
+        if not self.meta_path.exists():
+            return False
+        with open(self.meta_path) as f:
+            return any(json.loads(line).get('path') == str(output) for line in f if line.strip())
+
+    async def caption(self, job: Dict):
+        metadata = job['record'].get('caption')
+        if metadata is None:
+            final_base64 = job.pop('final_base64', None) or await self._call(read_base64, job['output'])
+            if self.anthropic_api_key:
+                with telemetry.span('caption', bytes=len(final_base64)):
+                    metadata = await self._call(
+                        caption_image_data, final_base64, 'image/jpeg', self.anthropic_api_key,
+                        self.trigger_token, self.class_token, self.anthropic_url,
+                        idempotency_key=self._intent(job, 'caption'))
+            if metadata is None:
+                print(f"  ⚠ Caption failed for {job['target'].name}, using fallback")
+                metadata = await self._call(fallback_caption, job['output'], self.trigger_token, self.class_token)
+            self._checkpoint(job, 'caption', caption=metadata)
+
+        basename = job['output'].stem
+        (self.captions_dir / f"{basename}.txt").write_text(metadata['caption'])
+        (self.prompts_dir / f"{basename}.prompt.txt").write_text(metadata['recreation_prompt'])
+
+        # Appended from the event loop thread only, so lines never interleave
+        meta_entry = {
+            'model': self.model_name,
+            'path': str(job['output']),
+            'caption': metadata['caption'],
+            'prompt': metadata['recreation_prompt'],
+            'style': metadata['style'],
+            'ar': metadata['ar'],
+            'source_face': str(self.source_face),
+            'target_body': str(job['target']),
+            'notes': 'faceswap + enhance + caption v2'
+        }
+        # A resumed caption may have been written before the run stopped
+        if 'caption' not in job['resumed'] or not await self._call(self._meta_written, job['output']):
+            with open(self.meta_path, 'a') as f:
+                f.write(json.dumps(meta_entry) + '\n')
+
+        self._checkpoint(job, 'done')
+        await self._call(self._discard_kept, job['output'])
+        self.completed += 1
+        telemetry.record(telemetry.IMAGE_STAGE, time.perf_counter() - job['start'], target=str(job['target']))
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] ✓ Success: {job['target'].name} {self.progress()}")
+
+    async def _worker(self, stage: str, queue: asyncio.Queue, next_queue: Optional[asyncio.Queue]):
+        handler = getattr(self, stage)
+        while True:
+            job = await queue.get()
+            try:
+                await handler(job)
+            except TargetRejected as e:
+                self.rejected.append(str(job['target']))
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] ⚠ Rejected: {job['target'].name} ({e}) {self.progress()}")
+            except Exception as e:
+                self.failed.append(str(job['target']))
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] ✗ Failed: {job['target'].name} ({stage}: {e}) "
+                      f"{self.progress()}")
+            else:
+                if next_queue is not None:
+                    await next_queue.put(job)
+            finally:
+                queue.task_done()
+
+    async def run(self, targets: List[Path]) -> Dict:
+        """Process `targets`, resuming journaled ones and skipping finished ones; returns counts."""
+        self.journal = FaceSwapJournal(self.journal_path)
+        todo = []
+        for target in targets:
+            record = self.journal.get(str(target))
+            if not record and self.output_path(target).exists():
+                continue
+            if record.get('stage') == 'done' and not self.output_path(target).exists():
+                record = self.journal.reset(str(target))
+            index = resume_index(record)
+            if index is not None:
+                todo.append((target, record, index))
+            elif self.stages_dir.exists():
+                # Left behind if a run stopped between finishing a target and cleaning up
+                self._discard_kept(self.output_path(target))
+        skipped = len(targets) - len(todo)
+        resumed = sum(1 for _, record, index in todo if index > 0 or record.get('pending'))
+        self.total = len(todo)
+        if not todo:
+            self.journal.close()
+            return {'completed': 0, 'failed': [], 'rejected': [], 'skipped': skipped, 'resumed': 0}
+        if resumed:
+            print(f"→ Resuming {resumed} target(s) from {self.journal_path}")
+
+        for directory in (self.output_dir, self.captions_dir, self.prompts_dir, self.meta_path.parent, self.stages_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+
+        # Started before the thread pool, so the workers fork from a single-threaded process
+        if self.prefilter_enabled and any(index == 0 for _, _, index in todo):
+            self.cpu_pool = ProcessPoolExecutor(max_workers=min(self.limits['prefilter'], os.cpu_count() or 1),
+                                                initializer=exit_with_parent)
+        self.executor = ThreadPoolExecutor(max_workers=sum(self.limits.values()), thread_name_prefix='faceswap')
+        self.poller = JobPoller(
+            self.client,
+            self.maxstudio_url,
+            self.api_key,
+            executor=self.executor,
+            max_rate=self.max_poll_rate,
+            fixed_interval=self.poll_interval,
+            timeout=self.poll_timeout
+        )
+        try:
+            source_bytes = await self._call(self.source_face.read_bytes)
+            try:
+                self.source_url = await self._call(self.uploader.upload, source_bytes, self.upload_prefix)
+            except Exception as e:
+                print(f"  ⚠ Source face upload failed ({e}), using data URL")
+                self.source_url = f"data:image/jpeg;base64,{base64.b64encode(source_bytes).decode('utf-8')}"
+
+            queues = [asyncio.Queue(maxsize=self.limits[stage] * 2) for stage in STAGES]
+            workers = [
+                asyncio.ensure_future(self._worker(stage, queues[i], queues[i + 1] if i + 1 < len(STAGES) else None))
+                for i, stage in enumerate(STAGES)
+                for _ in range(self.limits[stage])
+            ]
+            try:
+                for target, record, index in todo:
+                    await queues[index].put({'target': target, 'key': str(target), 'record': record, 'resumed': record,
+                                             'output': self.output_path(target), 'start': time.perf_counter()})
+                # A job reaches the next queue before task_done(), so joining in order drains the pipeline
+                for queue in queues:
+                    await queue.join()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                await self.poller.close()
+        finally:
+            self.executor.shutdown(wait=True)
+            if self.cpu_pool is not None:
+                self.cpu_pool.shutdown()
+            self.journal.close()
+
+        return {'completed': self.completed, 'failed': self.failed, 'rejected': self.rejected,
+                'skipped': skipped, 'resumed': resumed}
+
+
+def parse_limits(values: List[str]) -> Dict[str, int]:
+    limits = {}
+    for value in values:
+        stage, _, count = value.partition('=')
+        if stage not in STAGES or not count.isdigit() or int(count) < 1:
+            raise argparse.ArgumentTypeError(f"--limit expects STAGE=N with STAGE one of {', '.join(STAGES)}: {value}")
+        limits[stage] = int(count)
+    return limits
+
+
+def parse_quality(values: List[str]) -> Dict:
+    thresholds = {}
+    for value in values:
+        name, _, number = value.partition('=')
+        try:
+            thresholds[name] = type(DEFAULT_THRESHOLDS[name])(number)
+        except (KeyError, ValueError):
+            raise argparse.ArgumentTypeError(
+                f"--quality expects NAME=VALUE with NAME one of {', '.join(DEFAULT_THRESHOLDS)}: {value}")
+    return thresholds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Face swap, enhance and caption a directory of targets in one process')
+    parser.add_argument('model_name', type=str, help="Model name (e.g. 'blondie'); sets folders and trigger token")
+    parser.add_argument('source_face', type=str, help='Source face image')
+    parser.add_argument('targets_dir', type=str, help='Directory of target body images (.jpg, .jpeg, .png)')
+    parser.add_argument('--concurrency', type=int, help='Workers for every stage (default: per-stage defaults)')
+    parser.add_argument('--limit', action='append', default=[], metavar='STAGE=N',
+                        help=f"Workers for one stage, repeatable ({', '.join(STAGES)})")
+    parser.add_argument('--trigger-token', type=str, default=os.getenv('TRIGGER_TOKEN'),
+                        help='Caption trigger token (default: TRIGGER_TOKEN or the model name)')
+    parser.add_argument('--class-token', type=str, default=os.getenv('CLASS_TOKEN', 'woman'),
+                        help='Caption class token (default: CLASS_TOKEN or woman)')
+    parser.add_argument('--maxstudio-url', type=str, default=MAXSTUDIO_API_URL, help='MaxStudio API base URL')
+    parser.add_argument('--anthropic-url', type=str, default=ANTHROPIC_API_URL, help='Anthropic Messages API URL')
+    parser.add_argument('--poll-interval', type=float,
+                        help='Poll MaxStudio jobs on this fixed interval instead of adaptively')
+    parser.add_argument('--poll-timeout', type=float,
+                        help='Seconds before a MaxStudio job times out (default: 120 for enhance, 180 for swap)')
+    parser.add_argument('--request-timeout', type=float, default=60.0,
+                        help='Seconds to wait for a MaxStudio submit or detection (never retried once sent)')
+    parser.add_argument('--max-poll-rate', type=float, default=10.0,
+                        help='Cap on MaxStudio status calls per second across all jobs')
+    parser.add_argument('--no-prefilter', action='store_true',
+                        help='Send every target through the full pipeline without scoring it locally first')
+    parser.add_argument('--quality', action='append', default=[], metavar='NAME=VALUE',
+                        help=f"Override a pre-filter threshold, repeatable ({', '.join(DEFAULT_THRESHOLDS)}; "
+                             f"see quality_filter.py)")
+    parser.add_argument('--s3-bucket', type=str, default=os.getenv('AWS_S3_BUCKET', 'modelcrew'), help='S3 bucket')
+    parser.add_argument('--s3-region', type=str, default=os.getenv('AWS_REGION', 'us-east-2'), help='S3 region')
+    parser.add_argument('--s3-endpoint', type=str, default=os.getenv('S3_ENDPOINT_URL'),
+                        help='Path-style S3 endpoint to PUT to instead of AWS (e.g. fake_s3.py)')
+    parser.add_argument('--telemetry', type=str, nargs='?', const=str(telemetry.DEFAULT_TELEMETRY_PATH),
+                        help=f'Record stage timings to this JSONL file (default when given without a path: '
+                             f'{telemetry.DEFAULT_TELEMETRY_PATH}; also enabled by PIPELINE_TELEMETRY)')
+    args = parser.parse_args()
+
+    try:
+        limits = parse_limits(args.limit)
+        quality_thresholds = parse_quality(args.quality)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    if args.concurrency:
+        limits = {**{stage: args.concurrency for stage in STAGES}, **limits}
+
+    if args.telemetry:
+        telemetry.configure(Path(args.telemetry))
+
+    source_face = Path(args.source_face)
+    targets_dir = Path(args.targets_dir)
+    if not source_face.is_file():
+        print(f"Error: Source face file not found: {source_face}")
+        sys.exit(1)
+    if not targets_dir.is_dir():
+        print(f"Error: Targets directory not found: {targets_dir}")
+        sys.exit(1)
+
+    api_key = os.getenv('API_KEY')
+    if not api_key:
+        print("Error: API_KEY (MaxStudio) not set")
+        sys.exit(1)
+    anthropic_api_key = os.getenv('ANTHROPIC_API_KEY')
+    if not anthropic_api_key:
+        print("Warning: ANTHROPIC_API_KEY not set. Using fallback captions.")
+
+    try:
+        uploader = S3Uploader(args.s3_bucket, args.s3_region, endpoint_url=args.s3_endpoint)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    pipeline = FaceSwapPipeline(
+        args.model_name,
+        source_face,
+        uploader,
+        api_key,
+        anthropic_api_key=anthropic_api_key,
+        trigger_token=args.trigger_token,
+        class_token=args.class_token,
+        limits=limits,
+        maxstudio_url=args.maxstudio_url,
+        anthropic_url=args.anthropic_url,
+        poll_interval=args.poll_interval,
+        poll_timeout=args.poll_timeout,
+        max_poll_rate=args.max_poll_rate,
+        request_timeout=args.request_timeout,
+        prefilter=not args.no_prefilter,
+        quality_thresholds=quality_thresholds
+    )
+    targets = find_targets(targets_dir)
+    if not targets:
+        print(f"Error: No image files found in {targets_dir}")
+        sys.exit(1)
+
+    print(f"Model: {args.model_name} (trigger: {pipeline.trigger_token})")
+    print(f"Targets: {len(targets)} in {targets_dir}")
+    print("Workers: " + ', '.join(f"{stage} {pipeline.limits[stage]}" for stage in STAGES))
+    print()
+
+    start = time.perf_counter()
+    result = asyncio.run(pipeline.run(targets))
+    elapsed = time.perf_counter() - start
+
+    print()
+    print("=== COMPLETE ===")
+    print(f"Already done: {result['skipped']}")
+    print(f"Resumed:      {result['resumed']}")
+    print(f"Processed:    {result['completed']}")
+    print(f"Rejected:     {len(result['rejected'])}")
+    print(f"Failed:       {len(result['failed'])}")
+    if any(pipeline.routes.values()):
+        routes = pipeline.routes
+        print(f"Pre-filter:   {routes['full']} full, {routes['skip_enhance']} skip-enhance, {routes['reject']} rejected "
+              f"(avoided {format_avoided(routes)})")
+    polling = pipeline.poller.stats() if pipeline.poller else None
+    if polling and polling['jobs']:
+        latencies = ', '.join(f"{endpoint} {latency:.1f}s" for endpoint, latency in polling['median_latency'].items())
+        print(f"Status polls: {polling['status_calls']} ({polling['calls_per_job']:.1f}/job), "
+              f"median job latency: {latencies or 'n/a'}")
+    print(f"S3 uploads:   {uploader.puts} new, {uploader.found} already in bucket, {uploader.reused} reused")
+    if result['completed']:
+        print(f"Duration:     {elapsed:.1f}s ({result['completed'] / elapsed * 60:.1f} images/min)")
+    for target in result['rejected']:
+        print(f"  ⚠ {target}")
+    for target in result['failed']:
+        print(f"  ✗ {target}")
+
+    if telemetry.enabled():
+        print(f"Telemetry: {telemetry.sink_path()} (python3 telemetry.py report {telemetry.sink_path()})")
+        telemetry.close()
+
+    sys.exit(1 if result['failed'] else 0)
+
+
+if __name__ == '__main__':
+    main()
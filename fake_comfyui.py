@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for a ComfyUI server.
+
+Implements the endpoints the generation scripts use (POST /prompt, GET
+/queue, /history, /history/{prompt_id}, /view, /system_stats, the /ws
+websocket, and POST /interrupt and /queue {"delete": [...]} to cancel)
+on one asyncio event loop, with a single simulated GPU that runs queued
+prompts one at a time:
+
+- a prompt takes --prompt-overhead seconds (validation, text encoding)
+  plus --latency seconds per image in its EmptyLatentImage batch, scaled
+  by a random factor within +/- --jitter,
+- a prompt whose checkpoint, LoRA file or LoRA strength differs from the
+  previous one also pays --switch-cost seconds, like the model reload and
+  re-patch on a real server,
+- a --failure-rate fraction of prompts end in execution_error with no
+  outputs.
+
+Websocket clients (/ws?clientId=...) get the messages ComfyUI sends:
+status on every queue change (a prompt queued, started or finished), and
+execution_start, executing, progress, executed and execution_success /
+execution_error for the prompts they queued with that client_id. History
+entries keep execution_start and the final message with millisecond
+timestamps, as ComfyUI does. GPU busy time, model switches and failures are
+tracked so schedulers can be compared. /view streams --image-bytes of
+deterministic bytes per output file.
+
+Usage:
+  python3 fake_comfyui.py --port 8188 --latency 2.0 --failure-rate 0.02 --jitter 0.3
+  python3 batch_test_lora.py --mass-generate --comfyui-url http://127.0.0.1:8188
+
+In-process (benchmarks), start_server() runs the loop on a daemon thread.
+"""
+
+import json
+import time
+import uuid
+import base64
+import random
+import asyncio
+import hashlib
+import argparse
+import threading
+from collections import deque
+from typing import Dict, Optional, Set
+from urllib.parse import parse_qs, urlsplit
+
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+REASONS = {101: 'Switching Protocols', 200: 'OK', 400: 'Bad Request', 404: 'Not Found'}
+PROGRESS_TICKS = 10
+
+
+def websocket_frame(payload: bytes, opcode: int = 0x1) -> bytes:
+    """One unmasked server-to-client frame (text by default)."""
+    if len(payload) < 126:
+        header = bytes([0x80 | opcode, len(payload)])
+    elif len(payload) < 1 << 16:
+        header = bytes([0x80 | opcode, 126]) + len(payload).to_bytes(2, 'big')
+    else:
+        header = bytes([0x80 | opcode, 127]) + len(payload).to_bytes(8, 'big')
+    return header + payload
+
+
+class FakeComfyUIServer:
+    """HTTP/1.1 + websocket front end and one task playing the GPU, all on one event loop."""
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 8188,
+        latency: float = 2.0,
+        switch_cost: float = 0.0,
+        prompt_overhead: float = 0.0,
+        image_bytes: int = 256 * 1024,
+        failure_rate: float = 0.0,
+        jitter: float = 0.0,
+        seed: Optional[int] = None
+    ):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.switch_cost = switch_cost
+        self.prompt_overhead = prompt_overhead
+        self.image_bytes = image_bytes
+        self.failure_rate = failure_rate
+        self.jitter = jitter
+        self.random = random.Random(seed)
+
+        self.counters: Dict[str, int] = {}
+        self.files: Set[str] = set()
+        self.loaded_model = None
+        self.pending = deque()
+        self.running = None
+        self.history: Dict[str, Dict] = {}
+        self.number = 0
+
+        self.images = 0
+        self.switches = 0
+        self.failures = 0
+        self.cancelled = 0
+        self.busy = 0.0
+        self.started = time.perf_counter()
+        self.dead = False
+        self._interrupt: Optional[asyncio.Event] = None
+
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._listener: Optional[asyncio.AbstractServer] = None
+        self._work: Optional[asyncio.Event] = None
+        self._gpu: Optional[asyncio.Task] = None
+        self._connections: Set[asyncio.StreamWriter] = set()
+        self._sockets: Dict[str, asyncio.StreamWriter] = {}  # websocket clientId -> writer
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        """Bind the listener and start the GPU task on the running loop."""
+        self.loop = asyncio.get_running_loop()
+        self._work = asyncio.Event()
+        self._interrupt = asyncio.Event()
+        self._listener = await asyncio.start_server(self._serve_connection, self.host, self.port)
+        self.port = self._listener.sockets[0].getsockname()[1]
+        self.started = time.perf_counter()
+        self._gpu = self.loop.create_task(self._gpu_loop())
+
+    # --- simulated GPU ---
+
+    @staticmethod
+    def model_key(prompt: Dict) -> tuple:
+        """(checkpoint, lora, strength_model, strength_clip) the graph needs loaded."""
+        key = [None, None, None, None]
+        for node in prompt.values():
+            if not isinstance(node, dict):
+                continue
+            inputs = node.get('inputs', {})
+            if node.get('class_type') == 'CheckpointLoaderSimple':
+                key[0] = inputs.get('ckpt_name')
+            elif node.get('class_type') == 'LoraLoader':
+                key[1:] = [inputs.get('lora_name'), inputs.get('strength_model'), inputs.get('strength_clip')]
+        return tuple(key)
+
+    def enqueue(self, prompt: Dict, client_id: str) -> Dict:
+        prompt_id = str(uuid.uuid4())
+        self.number += 1
+        self.pending.append((self.number, prompt_id, prompt, {'client_id': client_id}, []))
+        self._work.set()
+        self._broadcast_status()
+        return {'prompt_id': prompt_id, 'number': self.number, 'node_errors': {}}
+
+    async def _gpu_loop(self):
+        while True:
+            while not self.pending:
+                self._work.clear()
+                await self._work.wait()
+            self.running = self.pending.popleft()
+            self._interrupt.clear()
+            self._broadcast_status()
+            number, prompt_id, prompt, extra, _ = self.running
+            start = time.perf_counter()
+            status, outputs = await self.execute(prompt_id, prompt, extra.get('client_id', ''))
+            self.busy += time.perf_counter() - start
+            self.history[prompt_id] = {'prompt': list(self.running), 'outputs': outputs, 'status': status}
+            self.running = None
+            self._broadcast_status()
+
+    async def execute(self, prompt_id: str, prompt: Dict, client_id: str):
+        """Pretend to run the graph; returns (history status, SaveImage outputs)."""
+        start = {'prompt_id': prompt_id, 'timestamp': int(time.time() * 1000)}
+        self._send_event(client_id, 'execution_start', start)
+        model = self.model_key(prompt)
+        if model != self.loaded_model:
+            if self.loaded_model is not None:
+                self.switches += 1
+            self.loaded_model = model
+            await asyncio.sleep(self.switch_cost)
+
+        batch_size, steps, sampler = 1, 20, None
+        for node_id, node in prompt.items():
+            if not isinstance(node, dict):
+                continue
+            if node.get('class_type') == 'EmptyLatentImage':
+                batch_size = int(node.get('inputs', {}).get('batch_size', 1))
+            elif node.get('class_type') == 'KSampler':
+                steps, sampler = int(node.get('inputs', {}).get('steps', 20)), node_id
+
+        duration = (self.prompt_overhead + self.latency * batch_size) * (1 + self.random.uniform(-self.jitter, self.jitter))
+        self._send_event(client_id, 'executing', {'node': sampler, 'prompt_id': prompt_id})
+        for tick in range(1, PROGRESS_TICKS + 1):
+            try:
+                await asyncio.wait_for(self._interrupt.wait(), duration / PROGRESS_TICKS)
+            except asyncio.TimeoutError:
+                pass
+            if self._interrupt.is_set():
+                self.cancelled += 1
+                interrupted = {'prompt_id': prompt_id, 'node_id': sampler, 'node_type': 'KSampler',
+                               'executed': [], 'timestamp': int(time.time() * 1000)}
+                self._send_event(client_id, 'execution_interrupted', interrupted)
+                return {'status_str': 'error', 'completed': False,
+                        'messages': [['execution_start', start], ['execution_interrupted', interrupted]]}, {}
+            self._send_event(client_id, 'progress', {'value': steps * tick // PROGRESS_TICKS, 'max': steps,
+                                                     'prompt_id': prompt_id, 'node': sampler})
+
+        if self.random.random() < self.failure_rate:
+            self.failures += 1
+            error = {'prompt_id': prompt_id, 'node_id': sampler, 'node_type': 'KSampler',
+                     'exception_type': 'RuntimeError', 'exception_message': 'simulated failure',
+                     'timestamp': int(time.time() * 1000)}
+            self._send_event(client_id, 'execution_error', error)
+            return {'status_str': 'error', 'completed': False,
+                    'messages': [['execution_start', start], ['execution_error', error]]}, {}
+
+        outputs = {}
+        for node_id, node in prompt.items():
+            if isinstance(node, dict) and node.get('class_type') == 'SaveImage':
+                prefix = node.get('inputs', {}).get('filename_prefix', 'ComfyUI')
+                images = []
+                for _ in range(batch_size):
+                    # Like ComfyUI: one counter per prefix, images saved in batch order
+                    self.counters[prefix] = self.counters.get(prefix, 0) + 1
+                    filename = f'{prefix}_{self.counters[prefix]:05d}_.png'
+                    self.files.add(filename)
+                    images.append({'filename': filename, 'subfolder': '', 'type': 'output'})
+                outputs[node_id] = {'images': images}
+                self._send_event(client_id, 'executed', {'node': node_id, 'output': outputs[node_id],
+                                                         'prompt_id': prompt_id})
+        self.images += batch_size
+
+        success = {'prompt_id': prompt_id, 'timestamp': int(time.time() * 1000)}
+        self._send_event(client_id, 'execution_success', success)
+        self._send_event(client_id, 'executing', {'node': None, 'prompt_id': prompt_id})
+        return {'status_str': 'success', 'completed': True,
+                'messages': [['execution_start', start], ['execution_success', success]]}, outputs
+
+    def interrupt(self, prompt_id: Optional[str] = None):
+        """Stop the running prompt (only if it is `prompt_id`, when given), like ComfyUI's /interrupt."""
+        if self.running and prompt_id in (None, self.running[1]):
+            self._interrupt.set()
+
+    def delete_pending(self, prompt_ids):
+        """Drop pending prompts, like POST /queue {"delete": [...]}."""
+        before = len(self.pending)
+        self.pending = deque(item for item in self.pending if item[1] not in prompt_ids)
+        self.cancelled += before - len(self.pending)
+        self._broadcast_status()
+
+    def queue_state(self) -> Dict:
+        return {
+            'queue_running': [list(self.running)] if self.running else [],
+            'queue_pending': [list(item) for item in self.pending]
+        }
+
+    def idle_fraction(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return 1 - self.busy / elapsed if elapsed else 0.0
+
+    def reset_stats(self):
+        self.started = time.perf_counter()
+        self.busy = 0.0
+        self.switches = 0
+        self.images = 0
+        self.failures = 0
+        self.cancelled = 0
+
+    # --- websocket ---
+
+    def _status(self) -> Dict:
+        remaining = len(self.pending) + (1 if self.running else 0)
+        return {'status': {'exec_info': {'queue_remaining': remaining}}}
+
+    def _send_event(self, client_id: str, event: str, data: Dict):
+        writer = self._sockets.get(client_id)
+        if writer is not None and not writer.is_closing():
+            writer.write(websocket_frame(json.dumps({'type': event, 'data': data}).encode('utf-8')))
+
+    def _broadcast_status(self):
+        frame = websocket_frame(json.dumps({'type': 'status', 'data': self._status()}).encode('utf-8'))
+        for writer in list(self._sockets.values()):
+            if not writer.is_closing():
+                writer.write(frame)
+
+    async def _websocket(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, client_id: str,
+                         key: str):
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode('ascii')).digest()).decode('ascii')
+        writer.write(f'HTTP/1.1 101 {REASONS[101]}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                     f'Sec-WebSocket-Accept: {accept}\r\n\r\n'.encode('latin-1'))
+        client_id = client_id or uuid.uuid4().hex
+        self._sockets[client_id] = writer
+        writer.write(websocket_frame(json.dumps({'type': 'status', 'data': dict(self._status(), sid=client_id)})
+                                     .encode('utf-8')))
+        try:
+            # Clients only send control frames here; read them to notice pings and closes
+            while True:
+                head = await reader.readexactly(2)
+                opcode, length = head[0] & 0x0F, head[1] & 0x7F
+                if length == 126:
+                    length = int.from_bytes(await reader.readexactly(2), 'big')
+                elif length == 127:
+                    length = int.from_bytes(await reader.readexactly(8), 'big')
+                mask = await reader.readexactly(4) if head[1] & 0x80 else bytes(4)
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(await reader.readexactly(length)))
+                if opcode == 0x8:
+                    writer.write(websocket_frame(payload[:2], opcode=0x8))
+                    break
+                if opcode == 0x9:
+                    writer.write(websocket_frame(payload, opcode=0xA))
+        finally:
+            if self._sockets.get(client_id) is writer:
+                del self._sockets[client_id]
+
+    # --- HTTP ---
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Keep-alive HTTP/1.1: one request after another until the client hangs up."""
+        self._connections.add(writer)
+        try:
+            while not self.dead:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                body = await reader.readexactly(length) if length else b''
+
+                url = urlsplit(target)
+                path, query = url.path.rstrip('/'), parse_qs(url.query)
+                if path == '/ws' and headers.get('upgrade', '').lower() == 'websocket':
+                    await self._websocket(reader, writer, query.get('clientId', [''])[0],
+                                          headers.get('sec-websocket-key', ''))
+                    break
+                await self._route(writer, method, path, query, body)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, body):
+        data = json.dumps(body).encode('utf-8')
+        writer.write(f'HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(data)}\r\n\r\n'.encode('latin-1') + data)
+        await writer.drain()
+
+    async def _send_image(self, writer: asyncio.StreamWriter, filename: str):
+        """Stream deterministic stand-in bytes for an output file, 64 KB at a time."""
+        if filename not in self.files:
+            await self._send_json(writer, 404, {'error': 'file not found'})
+            return
+        block = b'\x89PNG\r\n\x1a\n' + hashlib.sha256(filename.encode('utf-8')).digest() * 2040
+        writer.write(f'HTTP/1.1 200 OK\r\nContent-Type: image/png\r\n'
+                     f'Content-Length: {self.image_bytes}\r\n\r\n'.encode('latin-1'))
+        remaining = self.image_bytes
+        while remaining > 0:
+            chunk = block[:min(len(block), remaining)]
+            writer.write(chunk)
+            remaining -= len(chunk)
+            await writer.drain()
+
+    async def _route(self, writer: asyncio.StreamWriter, method: str, path: str, query: Dict, body: bytes):
+        if method == 'POST':
+            try:
+                request = json.loads(body or b'{}')
+            except json.JSONDecodeError:
+                request = {}
+            if path == '/interrupt':
+                self.interrupt(request.get('prompt_id'))
+                await self._send_json(writer, 200, {})
+            elif path == '/queue':
+                self.delete_pending(set(request.get('delete', [])))
+                await self._send_json(writer, 200, {})
+            elif path != '/prompt':
+                await self._send_json(writer, 404, {'error': 'not found'})
+            elif not isinstance(request.get('prompt'), dict):
+                await self._send_json(writer, 400, {'error': {'type': 'invalid_prompt',
+                                                              'message': 'prompt must be an API-format graph'}})
+            else:
+                await self._send_json(writer, 200, self.enqueue(request['prompt'], request.get('client_id', '')))
+        elif path == '/view':
+            await self._send_image(writer, query.get('filename', [''])[0])
+        elif path == '/queue':
+            await self._send_json(writer, 200, self.queue_state())
+        elif path == '/history':
+            await self._send_json(writer, 200, self.history)
+        elif path.startswith('/history/'):
+            prompt_id = path.split('/', 2)[2]
+            entry = self.history.get(prompt_id)
+            await self._send_json(writer, 200, {prompt_id: entry} if entry else {})
+        elif path == '/system_stats':
+            await self._send_json(writer, 200, {
+                'system': {'os': 'fake', 'python_version': '', 'embedded_python': False},
+                'devices': [{'name': 'fake-gpu', 'type': 'cuda', 'index': 0,
+                             'vram_total': 24 * 1024 ** 3, 'vram_free': 20 * 1024 ** 3}]
+            })
+        else:
+            await self._send_json(writer, 404, {'error': 'not found'})
+
+    # --- lifecycle (safe to call from other threads) ---
+
+    def _close(self):
+        self._listener.close()
+        for writer in list(self._connections):
+            writer.transport.abort()
+
+    def kill(self):
+        """Simulate the pod dying: stop listening and drop open keep-alive connections."""
+        self.dead = True
+        self.loop.call_soon_threadsafe(self._close)
+
+    async def _stop(self):
+        self._gpu.cancel()
+        try:
+            await self._gpu
+        except asyncio.CancelledError:
+            pass
+        self.loop.stop()
+
+    def shutdown(self):
+        """Stop serving, then the GPU task and the event loop."""
+        self.kill()
+        asyncio.run_coroutine_threadsafe(self._stop(), self.loop)
+
+
+def start_server(
+    host: str = '127.0.0.1',
+    port: int = 0,
+    latency: float = 2.0,
+    switch_cost: float = 0.0,
+    prompt_overhead: float = 0.0,
+    image_bytes: int = 256 * 1024,
+    failure_rate: float = 0.0,
+    jitter: float = 0.0,
+    seed: Optional[int] = None
+) -> FakeComfyUIServer:
+    """Start a fake server on an event loop in a background thread (port 0 picks a free port)."""
+    server = FakeComfyUIServer(host, port, latency=latency, switch_cost=switch_cost, prompt_overhead=prompt_overhead,
+                               image_bytes=image_bytes, failure_rate=failure_rate, jitter=jitter, seed=seed)
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(server.start())
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for a ComfyUI server')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Bind address')
+    parser.add_argument('--port', type=int, default=8188, help='Port to listen on')
+    parser.add_argument('--latency', type=float, default=2.0, help='Seconds of simulated GPU time per image')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Random +/- fraction applied to each prompt\'s run time (e.g. 0.3)')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='Fraction of prompts that end in execution_error (0-1)')
+    parser.add_argument('--switch-cost', type=float, default=0.0,
+                        help='Extra seconds when a prompt needs a different checkpoint/LoRA/strength')
+    parser.add_argument('--prompt-overhead', type=float, default=0.0,
+                        help='Fixed seconds per prompt (validation, text encoding), independent of batch size')
+    parser.add_argument('--image-bytes', type=int, default=256 * 1024, help='Size of each file served by /view')
+    parser.add_argument('--seed', type=int, help='Random seed for jitter and failures')
+    args = parser.parse_args()
+
+    server = FakeComfyUIServer(args.host, args.port, latency=args.latency, switch_cost=args.switch_cost,
+                               prompt_overhead=args.prompt_overhead, image_bytes=args.image_bytes,
+                               failure_rate=args.failure_rate, jitter=args.jitter, seed=args.seed)
+
+    async def serve():
+        await server.start()
+        print(f"Fake ComfyUI: {server.url} ({args.latency}s per image, {args.prompt_overhead}s per prompt, "
+              f"{args.switch_cost}s per model switch, {args.failure_rate:.0%} failures)")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Ran {len(server.history)} prompts ({server.images} images, {server.failures} failed), "
+              f"{server.switches} model switches, GPU idle {server.idle_fraction():.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the MaxStudio API used by the face-swap pipeline.
+
+Implements the calls face-swap-model.sh and faceswap_pipeline.py make:
+
+  POST /image-enhancer      {image: base64}           -> {jobId}
+  GET  /image-enhancer/{id}                           -> {status, result: base64}
+  POST /detect-face-image   {imageUrl}                -> {detectedFaces: [{x, y, width, height}]}
+  POST /swap-image          {mediaUrl, faces: [...]}  -> {jobId}
+  GET  /swap-image/{id}                               -> {status, result: {mediaUrl}}
+  GET  /media/{id}.jpg                                   swapped image bytes
+
+Jobs report "processing" until --enhance-latency / --swap-latency seconds
+(each scaled by a random factor within +/- --jitter) after submission, then "completed" (or "failed" for --failure-rate of
+them). The enhancer echoes the image back; detect and swap download the
+URLs they are given, so uploads to the S3 stand-in must really be there,
+and the swap "result" is the downloaded image with a marker appended.
+
+A POST carrying an Idempotency-Key header that was already answered with
+200 gets the same response again (the same job id, the same faces)
+without being charged; a repeat that arrives while the first is still
+being handled waits for it. The first --stall-submits submissions are
+accepted (and charged) but answered only after --stall-seconds, to check
+a client that times out does not submit them again. A missing x-api-key
+is answered with 401. Submissions, status polls, replayed keys and the
+peak number of concurrent jobs are counted, and so are paid calls per
+input (image hash or URL), which shows whether any work was paid for
+twice. Clients that drop their connection (e.g. a killed pipeline) are
+not reported.
+
+Usage:
+  python3 fake_maxstudio.py --port 8700 --enhance-latency 6 --swap-latency 10
+  MAXSTUDIO_API_URL=http://127.0.0.1:8700 python3 faceswap_pipeline.py blondie source/blondie-1.png targets/
+"""
+
+import sys
+import json
+import time
+import hashlib
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.request import urlopen
+
+
+class FakeMaxStudioServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding jobs in memory."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        enhance_latency: float = 6.0,
+        swap_latency: float = 10.0,
+        detect_latency: float = 1.0,
+        failure_rate: float = 0.0,
+        jitter: float = 0.0,
+        stall_submits: int = 0,
+        stall_seconds: float = 5.0
+    ):
+        super().__init__(address, FakeMaxStudioHandler)
+        self.latency = {'image-enhancer': enhance_latency, 'swap-image': swap_latency}
+        self.detect_latency = detect_latency
+        self.failure_rate = failure_rate
+        self.jitter = jitter
+        self.stall_submits = stall_submits
+        self.stall_seconds = stall_seconds
+        self.lock = threading.Lock()
+        # Idempotency-Key -> {'done': Event, 'response': (status, body)}
+        self.responses: Dict[str, Dict] = {}
+        self.replays = 0
+        self.jobs: Dict[str, Dict] = {}
+        self.media: Dict[str, bytes] = {}
+        self.submitted = 0
+        self.polls = 0
+        self.detects = 0
+        self.peak_jobs = 0
+        self.charges: Counter = Counter()  # (endpoint, input hash or URL) -> paid calls
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle_error(self, request, client_address):
+        # A killed client leaves its connections half-open; that is expected here
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    def idempotent(self, key: Optional[str], handle: Callable[[], Tuple[int, Dict]]) -> Tuple[int, Dict]:
+        """Run `handle` once per Idempotency-Key; later requests with the key get its 200 response."""
+        if not key:
+            return handle()
+        with self.lock:
+            entry = self.responses.get(key)
+            first = entry is None
+            if first:
+                entry = self.responses[key] = {'done': threading.Event()}
+        if not first:
+            entry['done'].wait()
+            if 'response' in entry:
+                with self.lock:
+                    self.replays += 1
+                return entry['response']
+            return self.idempotent(key, handle)
+        try:
+            response = handle()
+            if response[0] == 200:
+                entry['response'] = response
+            return response
+        finally:
+            if 'response' not in entry:
+                # Only successes are remembered, so a failed request can be retried
+                with self.lock:
+                    self.responses.pop(key, None)
+            entry['done'].set()
+
+    def charge(self, endpoint: str, job_input: str):
+        with self.lock:
+            self.charges[(endpoint, job_input)] += 1
+
+    def repeated_charges(self) -> List[Tuple[Tuple[str, str], int]]:
+        """Inputs that were paid for more than once."""
+        with self.lock:
+            return [(key, count) for key, count in self.charges.items() if count > 1]
+
+    def add_job(self, kind: str, result, job_input: str) -> str:
+        job_id = uuid.uuid4().hex
+        self.charge(kind, job_input)
+        with self.lock:
+            stall = self.stall_submits > 0
+            if stall:
+                self.stall_submits -= 1
+            self.jobs[job_id] = {
+                'kind': kind,
+                'ready_at': time.time() + self.latency[kind] * random.uniform(1 - self.jitter, 1 + self.jitter),
+                'failed': random.random() < self.failure_rate,
+                'result': result
+            }
+            self.submitted += 1
+            running = sum(1 for job in self.jobs.values() if time.time() < job['ready_at'])
+            self.peak_jobs = max(self.peak_jobs, running)
+        if stall:
+            time.sleep(self.stall_seconds)
+        return job_id
+
+    def job_status(self, kind: str, job_id: str) -> Optional[Dict]:
+        with self.lock:
+            self.polls += 1
+            job = self.jobs.get(job_id)
+        if job is None or job['kind'] != kind:
+            return None
+        if time.time() < job['ready_at']:
+            return {'status': 'processing'}
+        if job['failed']:
+            return {'status': 'failed'}
+        return {'status': 'completed', 'result': job['result']}
+
+    def reset_stats(self):
+        with self.lock:
+            self.submitted = self.polls = self.detects = self.peak_jobs = self.replays = 0
+            self.charges.clear()
+
+
+class FakeMaxStudioHandler(BaseHTTPRequestHandler):
+    server: FakeMaxStudioServer
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: Dict):
+        data = json.dumps(body).encode('utf-8')
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client gave up (timed out or was killed)
+
+    def _authorized(self) -> bool:
+        if self.headers.get('x-api-key'):
+            return True
+        self._send_json(401, {'error': 'missing x-api-key'})
+        return False
+
+    def _fetch(self, url: str) -> Optional[bytes]:
+        """Download a URL the client handed us, as the real service would."""
+        try:
+            with urlopen(url, timeout=10) as response:
+                return response.read()
+        except Exception:
+            return None
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        data = self.rfile.read(length)
+        if len(data) < length:
+            return  # the client went away mid-request; nothing was submitted
+        body = json.loads(data or b'{}')
+        if not self._authorized():
+            return
+        handler = {
+            '/image-enhancer': self._enhance,
+            '/detect-face-image': self._detect,
+            '/swap-image': self._swap
+        }.get(self.path.rstrip('/'))
+        if handler is None:
+            self._send_json(404, {'error': 'not found'})
+            return
+        self._send_json(*self.server.idempotent(self.headers.get('Idempotency-Key'), lambda: handler(body)))
+
+    def _enhance(self, body: Dict) -> Tuple[int, Dict]:
+        if not body.get('image'):
+            return 400, {'error': 'image is required'}
+        image_hash = hashlib.sha256(body['image'].encode('utf-8')).hexdigest()
+        return 200, {'jobId': self.server.add_job('image-enhancer', body['image'], image_hash)}
+
+    def _detect(self, body: Dict) -> Tuple[int, Dict]:
+        time.sleep(self.server.detect_latency)
+        with self.server.lock:
+            self.server.detects += 1
+        if self._fetch(body.get('imageUrl', '')) is None:
+            return 400, {'error': f"could not download {body.get('imageUrl')}"}
+        self.server.charge('detect-face-image', body['imageUrl'])
+        return 200, {'detectedFaces': [{'x': 412, 'y': 180, 'width': 220, 'height': 260}]}
+
+    def _swap(self, body: Dict) -> Tuple[int, Dict]:
+        media = self._fetch(body.get('mediaUrl', ''))
+        faces = body.get('faces') or []
+        if media is None or not faces or not faces[0].get('newFace'):
+            return 400, {'error': 'mediaUrl and faces[].newFace are required'}
+        if faces[0]['newFace'].startswith('http') and self._fetch(faces[0]['newFace']) is None:
+            return 400, {'error': f"could not download {faces[0]['newFace']}"}
+        media_id = uuid.uuid4().hex
+        with self.server.lock:
+            # Trailing bytes (ignored by JPEG decoders) make the result differ from its input
+            self.server.media[media_id] = media + b'swapped:' + media_id.encode('ascii')
+        result = {'mediaUrl': f"{self.server.url}/media/{media_id}.jpg"}
+        return 200, {'jobId': self.server.add_job('swap-image', result, body['mediaUrl'])}
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if len(parts) == 2 and parts[0] == 'media':
+            with self.server.lock:
+                media = self.server.media.get(parts[1].rsplit('.', 1)[0])
+            if media is None:
+                self._send_json(404, {'error': 'not found'})
+                return
+            try:
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(media)))
+                self.end_headers()
+                self.wfile.write(media)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            return
+
+        if not self._authorized():
+            return
+        if len(parts) == 2 and parts[0] in self.server.latency:
+            status = self.server.job_status(parts[0], parts[1])
+            if status is not None:
+                self._send_json(200, status)
+                return
+        self._send_json(404, {'error': 'not found'})
+
+
+def start_server(
+    host: str = '127.0.0.1',
+    port: int = 0,
+    enhance_latency: float = 6.0,
+    swap_latency: float = 10.0,
+    detect_latency: float = 1.0,
+    failure_rate: float = 0.0,
+    jitter: float = 0.0,
+    stall_submits: int = 0,
+    stall_seconds: float = 5.0
+) -> FakeMaxStudioServer:
+    """Start a fake MaxStudio API on a background thread (port 0 picks a free port)."""
+    server = FakeMaxStudioServer((host, port), enhance_latency=enhance_latency, swap_latency=swap_latency,
+                                 detect_latency=detect_latency, failure_rate=failure_rate, jitter=jitter,
+                                 stall_submits=stall_submits, stall_seconds=stall_seconds)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the MaxStudio face swap API')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Bind address')
+    parser.add_argument('--port', type=int, default=8700, help='Port to listen on')
+    parser.add_argument('--enhance-latency', type=float, default=6.0, help='Seconds an enhancer job takes')
+    parser.add_argument('--swap-latency', type=float, default=10.0, help='Seconds a swap job takes')
+    parser.add_argument('--detect-latency', type=float, default=1.0, help='Seconds a face detection takes')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of jobs that end "failed"')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Job latencies vary uniformly by this fraction (0.3 = +/-30%%)')
+    parser.add_argument('--stall-submits', type=int, default=0,
+                        help='Accept this many submissions but answer them late')
+    parser.add_argument('--stall-seconds', type=float, default=5.0, help='How late stalled submissions are answered')
+    args = parser.parse_args()
+
+    server = FakeMaxStudioServer((args.host, args.port), enhance_latency=args.enhance_latency,
+                                 swap_latency=args.swap_latency, detect_latency=args.detect_latency,
+                                 failure_rate=args.failure_rate, jitter=args.jitter,
+                                 stall_submits=args.stall_submits, stall_seconds=args.stall_seconds)
+    print(f"Fake MaxStudio: {server.url} (enhance {args.enhance_latency}s, swap {args.swap_latency}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"{server.submitted} jobs, {server.polls} status polls, {server.detects} detections, "
+              f"{server.replays} replayed, peak {server.peak_jobs} concurrent jobs")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the S3 bucket the face-swap pipeline uploads to.
+
+Path-style object storage in memory: PUT /{bucket}/{key} stores the body,
+GET and HEAD /{bucket}/{key} serve it back (with ETag and Content-Length),
+so the MaxStudio stand-in can fetch the "public" URLs it is given.
+Requests are not signed or checked. PUTs, HEADs, GETs and bytes stored are
+counted for benchmarks. Clients that drop their connection are not reported.
+
+Usage:
+  python3 fake_s3.py --port 9000
+  python3 faceswap_pipeline.py blondie source/blondie-1.png targets/ --s3-endpoint http://127.0.0.1:9000
+"""
+
+import sys
+import time
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+
+class FakeS3Server(ThreadingHTTPServer):
+    """Threaded in-memory object store."""
+
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0.0):
+        super().__init__(address, FakeS3Handler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.objects: Dict[str, Tuple[bytes, str]] = {}  # "bucket/key" -> (body, content type)
+        self.puts = 0
+        self.heads = 0
+        self.gets = 0
+        self.bytes_stored = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle_error(self, request, client_address):
+        # A killed client leaves its connections half-open; that is expected here
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    def reset_stats(self):
+        with self.lock:
+            self.puts = self.heads = self.gets = self.bytes_stored = 0
+
+
+class FakeS3Handler(BaseHTTPRequestHandler):
+    server: FakeS3Server
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _object(self):
+        with self.server.lock:
+            return self.server.objects.get(self.path.split('?', 1)[0].lstrip('/'))
+
+    def _send_headers(self, status: int, body: bytes, content_type: str, length: Optional[int] = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body) if length is None else length))
+        self.send_header('ETag', f'"{hashlib.md5(body).hexdigest()}"')
+        self.end_headers()
+
+    def _send_missing(self, head: bool = False):
+        body = b'<Error><Code>NoSuchKey</Code></Error>'
+        self.send_response(404)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', '0' if head else str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def do_PUT(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        if len(body) < length:
+            return  # the client went away mid-upload; store nothing
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.objects[self.path.split('?', 1)[0].lstrip('/')] = (
+                body, self.headers.get('Content-Type', 'application/octet-stream'))
+            self.server.puts += 1
+            self.server.bytes_stored += len(body)
+        self._send_headers(200, body, 'application/xml', length=0)
+
+    def do_HEAD(self):
+        with self.server.lock:
+            self.server.heads += 1
+        stored = self._object()
+        if stored is None:
+            self._send_missing(head=True)
+            return
+        self._send_headers(200, *stored)
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.gets += 1
+        stored = self._object()
+        if stored is None:
+            self._send_missing()
+            return
+        self._send_headers(200, *stored)
+        self.wfile.write(stored[0])
+
+
+def start_server(host: str = '127.0.0.1', port: int = 0, latency: float = 0.0) -> FakeS3Server:
+    """Start a fake S3 endpoint on a background thread (port 0 picks a free port)."""
+    server = FakeS3Server((host, port), latency=latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for S3 (path-style, in memory, unsigned)')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Bind address')
+    parser.add_argument('--port', type=int, default=9000, help='Port to listen on')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every PUT')
+    args = parser.parse_args()
+
+    server = FakeS3Server((args.host, args.port), latency=args.latency)
+    print(f"Fake S3: {server.url} (path-style: {server.url}/<bucket>/<key>)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"{server.puts} PUTs ({server.bytes_stored} bytes), {server.heads} HEADs, {server.gets} GETs")
+
+
+if __name__ == '__main__':
+    main()
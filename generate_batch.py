@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
-import requests
-import json
 import time
 
+from http_client import get_client
+from workflow_template import load_template
+
 # Test prompts
 prompts = [
     "blondie woman, black leather jacket, city street at night, neon lights, professional photo, cinematic",
@@ -12,8 +13,7 @@ prompts = [
 ]
 
 # Load base workflow
-with open('/workspace/comfyui_workflow_blondie.json', 'r') as f:
-    workflow = json.load(f)
+template = load_template('/workspace/comfyui_workflow_blondie.json')
 
 for i, prompt in enumerate(prompts, 2):
     print(f"\n{'='*60}")
@@ -22,12 +22,11 @@ for i, prompt in enumerate(prompts, 2):
     print('='*60)
 
     # Update prompt
-    workflow["3"]["inputs"]["text"] = prompt
-    workflow["8"]["inputs"]["filename_prefix"] = f"blondie_test_{i:05d}"
+    workflow = template.render(prompt=prompt, prefix=f"blondie_test_{i:05d}")
 
     # Queue
     payload = {"prompt": workflow, "client_id": f"blondie_test_{i:03d}"}
-    response = requests.post("http://127.0.0.1:8188/prompt", json=payload)
+    response = get_client().post("http://127.0.0.1:8188/prompt", json=payload)
 
     if response.status_code == 200:
         prompt_id = response.json().get('prompt_id')
@@ -2,13 +2,15 @@
 """
 Generate images using ComfyUI API with trained LoRA
 """
-import json
 import requests
 import time
-import uuid
-import os
+import argparse
 from pathlib import Path
 
+from comfyui_scheduler import ComfyUIScheduler
+from http_client import CircuitOpenError, get_client
+from workflow_template import load_template
+
 # ComfyUI server URL (adjust if different)
 COMFYUI_URL = "http://127.0.0.1:8188"
 
@@ -21,62 +23,19 @@ TEST_PROMPTS = [
     "blondie woman, elegant evening gown, luxury ballroom, glamorous, professional fashion photography"
 ]
 
-def load_workflow(workflow_path):
-    """Load workflow JSON"""
-    with open(workflow_path, 'r') as f:
-        return json.load(f)
-
-def queue_prompt(workflow):
-    """Queue a prompt for generation"""
-    prompt_id = str(uuid.uuid4())
-    data = {
-        "prompt": workflow,
-        "client_id": prompt_id
-    }
-
-    response = requests.post(f"{COMFYUI_URL}/prompt", json=data)
-
-    if response.status_code == 200:
-        result = response.json()
-        return result.get('prompt_id'), prompt_id
-    else:
-        print(f"❌ Error queuing prompt: {response.status_code}")
-        print(response.text)
-        return None, None
-
-def check_status(prompt_id):
-    """Check generation status"""
-    response = requests.get(f"{COMFYUI_URL}/history/{prompt_id}")
-
-    if response.status_code == 200:
-        history = response.json()
-        if prompt_id in history:
-            return history[prompt_id].get('status', {})
-
-    return None
-
-def wait_for_completion(prompt_id, timeout=300):
-    """Wait for generation to complete"""
-    start_time = time.time()
-
-    while time.time() - start_time < timeout:
-        status = check_status(prompt_id)
-
-        if status and status.get('status_str') == 'success':
-            print("✅ Generation complete!")
-            return True
-        elif status and status.get('status_str') == 'error':
-            print(f"❌ Generation failed: {status.get('messages', [])}")
-            return False
+def generate_images(workflow_path, output_dir, window=3, timeout=300, poll_interval=1.0, comfyui_url=COMFYUI_URL):
+    """Generate test images with different prompts
 
-        print("⏳ Generating...", end='\r')
-        time.sleep(2)
-
-    print(f"❌ Timeout after {timeout}s")
-    return False
-
-def generate_images(workflow_path, output_dir):
-    """Generate test images with different prompts"""
+    Up to `window` prompts are kept queued on the server, so the next one is
+    already waiting when the GPU finishes the current one (window=1 runs
+    them one at a time). All outstanding prompts are watched with a single
+    /queue poll and completions are reported as they arrive. A prompt's
+    `timeout` clock starts once it is running (or is the oldest still
+    outstanding), not when it is submitted, so waiting behind the window
+    does not count against it. A prompt that times out is cancelled on the
+    server, so the prompts behind it get the GPU instead of timing out in
+    turn.
+    """
 
     # Create output directory
     Path(output_dir).mkdir(parents=True, exist_ok=True)
@@ -84,66 +43,56 @@ def generate_images(workflow_path, output_dir):
     print(f"🚀 Starting image generation...")
     print(f"   Workflow: {workflow_path}")
     print(f"   Output: {output_dir}")
-    print(f"   Test prompts: {len(TEST_PROMPTS)}\n")
+    print(f"   Test prompts: {len(TEST_PROMPTS)}")
+    print(f"   Window: {window} queued at once\n")
 
-    # Load base workflow
-    workflow = load_workflow(workflow_path)
+    # Compile the base workflow once; each image gets its own rendered copy
+    template = load_template(workflow_path)
+    scheduler = ComfyUIScheduler(comfyui_url, queue_depth=window, poll_interval=poll_interval, job_timeout=timeout)
+    start_time = time.time()
 
     for i, prompt in enumerate(TEST_PROMPTS, 1):
-        print(f"\n{'='*60}")
-        print(f"[{i}/{len(TEST_PROMPTS)}] Generating image...")
-        print(f"Prompt: {prompt[:80]}...")
-        print('='*60)
-
-        # Update prompt in workflow
-        workflow["3"]["inputs"]["text"] = prompt
-
-        # Update seed for variation
-        workflow["6"]["inputs"]["seed"] = int(time.time()) + i
-
-        # Update output filename
-        workflow["8"]["inputs"]["filename_prefix"] = f"blondie_test_{i:02d}"
-
-        # Queue the prompt
-        prompt_id, client_id = queue_prompt(workflow)
-
-        if not prompt_id:
-            print(f"❌ Failed to queue prompt {i}")
-            continue
-
-        print(f"✅ Queued (ID: {prompt_id})")
-
-        # Wait for completion
-        if wait_for_completion(prompt_id):
-            print(f"✅ Image {i} generated successfully!")
-        else:
-            print(f"❌ Image {i} generation failed")
+        # Prompt, a new seed for variation, and the output filename
+        workflow = template.render(
+            prompt=prompt,
+            seed=int(time.time()) + i,
+            prefix=f"blondie_test_{i:02d}"
+        )
+        # Waits for a free slot first, collecting completions meanwhile
+        scheduler.submit(workflow, f"[{i}/{len(TEST_PROMPTS)}] {prompt[:60]}...")
 
-        # Small delay between generations
-        time.sleep(1)
+    scheduler.drain()
 
     print(f"\n{'='*60}")
     print(f"📊 Generation Complete!")
     print(f"{'='*60}")
+    print(f"✅ {scheduler.completed} generated, ❌ {scheduler.failed} failed, "
+          f"⏱  {scheduler.timed_out} timed out in {time.time() - start_time:.0f}s")
     print(f"Check ComfyUI output folder for generated images:")
     print(f"/workspace/ComfyUI/output/")
     print('='*60)
 
 if __name__ == "__main__":
-    workflow_path = "/workspace/comfyui_workflow_blondie.json"
-    output_dir = "/workspace/ComfyUI/output"
+    parser = argparse.ArgumentParser(description="Generate test images with the trained LoRA")
+    parser.add_argument("--comfyui-url", type=str, default=COMFYUI_URL, help=f"ComfyUI server (default: {COMFYUI_URL})")
+    parser.add_argument("--workflow", type=str, default="/workspace/comfyui_workflow_blondie.json")
+    parser.add_argument("--output-dir", type=str, default="/workspace/ComfyUI/output")
+    parser.add_argument("--window", type=int, default=3, help="Prompts queued on the server at once (1 = one at a time)")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds before a single prompt is given up on")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between completion checks")
+    args = parser.parse_args()
 
     # Check if ComfyUI is running
     try:
-        response = requests.get(f"{COMFYUI_URL}/system_stats")
+        response = get_client().get(f"{args.comfyui_url}/system_stats", retries=0)
         if response.status_code == 200:
             print("✅ ComfyUI is running")
         else:
             print("❌ ComfyUI is not responding properly")
             exit(1)
-    except requests.exceptions.ConnectionError:
+    except (requests.exceptions.ConnectionError, CircuitOpenError):
         print("❌ Cannot connect to ComfyUI. Is it running?")
         print("   Start ComfyUI first: cd /workspace/ComfyUI && python main.py")
         exit(1)
 
-    generate_images(workflow_path, output_dir)
+    generate_images(args.workflow, args.output_dir, args.window, args.timeout, args.poll_interval, args.comfyui_url)
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Shared HTTP client for every outbound API (Anthropic, ComfyUI, MaxStudio).
+
+One pooled requests.Session keeps connections alive across calls, so only
+the first request to a host pays for the TCP+TLS handshake. On top of it:
+
+- a per-host concurrency cap (threads beyond it wait for a slot),
+- retries on connection errors, timeouts, 429 and 5xx with jittered
+  exponential backoff that honours Retry-After. Non-idempotent requests
+  (POST, unless the caller passes idempotent=True) are only retried when
+  they never reached the server (connect failure) or on 429; a POST that
+  timed out or came back 5xx may already have started a paid job,
+- a per-host circuit breaker: after `failure_threshold` consecutive
+  connection errors or 5xx responses the host is skipped for
+  `reset_timeout` seconds, then a single trial request decides whether
+  it closes again.
+
+Usage:
+  from http_client import get_client
+  response = get_client().post(url, json=payload, timeout=60)
+"""
+
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+import telemetry
+
+
+# 529 is Anthropic's "overloaded"
+RETRY_STATUSES = (429, 500, 502, 503, 504, 529)
+
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised without contacting the host while its circuit is open."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for one host."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self) -> bool:
+        """Whether a request may go out now (one trial at a time when half-open)."""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+def retry_after_seconds(response: requests.Response) -> Optional[float]:
+    """Parse a Retry-After header given either in seconds or as an HTTP date."""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def never_sent(error: Exception) -> bool:
+    """Whether a request failed before the server could have received it."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    cause = error.args[0] if error.args else None
+    return isinstance(cause, MaxRetryError) and isinstance(cause.reason, NewConnectionError)
+
+
+class HttpClient:
+    """Pooled, retrying, circuit-breaking wrapper around a requests.Session."""
+
+    def __init__(
+        self,
+        max_per_host: int = 16,
+        retries: int = 4,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        retry_statuses=RETRY_STATUSES,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        default_timeout: float = 60.0
+    ):
+        self.max_per_host = max_per_host
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_statuses = set(retry_statuses)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.default_timeout = default_timeout
+
+        self.session = requests.Session()
+        # Retries are handled here so they can honour Retry-After and the breaker
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=max_per_host, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        self.retried = 0
+
+    def _host_state(self, url: str):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._slots:
+                self._slots[host] = threading.BoundedSemaphore(self.max_per_host)
+                self._breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return host, self._slots[host], self._breakers[host]
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        return self._host_state(url)[2]
+
+    def backoff_delay(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        """Full-jitter exponential backoff, or the server's Retry-After when given."""
+        if response is not None:
+            retry_after = retry_after_seconds(response)
+            if retry_after is not None:
+                return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        retries: Optional[int] = None,
+        idempotent: Optional[bool] = None,
+        **kwargs
+    ) -> requests.Response:
+        """
+        Send a request, retrying transient failures.
+
+        Returns the last response once retries are exhausted (callers keep
+        their own status checks); raises the last connection error, or
+        CircuitOpenError while the host's circuit is open. `idempotent`
+        defaults by method; when False only connect failures and 429 are
+        retried, so a request the server may have acted on is never resent.
+        """
+        retries = self.retries if retries is None else retries
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        kwargs.setdefault('timeout', self.default_timeout)
+        host, slot, breaker = self._host_state(url)
+
+        with telemetry.span('http', method=method, host=host) as span:
+            response = self._send(method, url, host, slot, breaker, retries, idempotent, span, kwargs)
+            span['status'] = response.status_code
+            return response
+
+    def _send(
+        self,
+        method: str,
+        url: str,
+        host: str,
+        slot: threading.BoundedSemaphore,
+        breaker: CircuitBreaker,
+        retries: int,
+        idempotent: bool,
+        span,
+        kwargs: Dict
+    ) -> requests.Response:
+        """Retry loop behind `request`; records the attempt count on `span`."""
+        for attempt in range(retries + 1):
+            span['retries'] = attempt
+            if not breaker.allow():
+                raise CircuitOpenError(f"circuit open for {host} after {breaker.failures} consecutive failures")
+
+            response = None
+            error = None
+            with slot:
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = e
+
+            if error is None and response.status_code not in self.retry_statuses:
+                breaker.record_success()
+                return response
+
+            # 429 is backpressure from a live host, not a reason to trip the breaker
+            if error is None and response.status_code == 429:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+            if idempotent:
+                retryable = True
+            elif error is not None:
+                retryable = never_sent(error)
+            else:
+                retryable = response.status_code == 429
+            if attempt == retries or not retryable:
+                if error is not None:
+                    raise error
+                return response
+
+            delay = self.backoff_delay(attempt, response)
+            reason = error.__class__.__name__ if error is not None else f"HTTP {response.status_code}"
+            print(f"  ⚠ {method} {host}: {reason}, retry {attempt + 1}/{retries} in {delay:.1f}s")
+            with self._lock:
+                self.retried += 1
+            time.sleep(delay)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        return self.request('HEAD', url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request('PUT', url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_default_client: Optional[HttpClient] = None
+_default_lock = threading.Lock()
+
+
+def get_client() -> HttpClient:
+    """Process-wide shared client, created on first use."""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = HttpClient()
+        return _default_client
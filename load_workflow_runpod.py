@@ -3,23 +3,20 @@
 Load workflow into RunPod ComfyUI via API and generate image
 """
 import requests
-import json
 import time
 
+from http_client import get_client
+from workflow_template import load_template
+
 # RunPod ComfyUI URL
 COMFYUI_URL = "https://w08uzdoduk1wd5-8188.proxy.runpod.net"
 
-# Load workflow
-with open('/workspace/comfyui_workflow_blondie.json', 'r') as f:
-    workflow = json.load(f)
-
-# Update to use 750-step checkpoint with better settings
-workflow["2"]["inputs"]["lora_name"] = "blondie_lora-step00000750.safetensors"
-workflow["2"]["inputs"]["strength_model"] = 0.7
-workflow["2"]["inputs"]["strength_clip"] = 0.7
-
-# Better photorealistic prompt
-workflow["3"]["inputs"]["text"] = "blondie woman, professional portrait photo, natural lighting, photorealistic, 8k uhd, dslr, soft lighting, high quality, detailed face, film grain, Fujifilm XT3"
+# Load workflow: 750-step checkpoint with better settings and a better photorealistic prompt
+workflow = load_template('/workspace/comfyui_workflow_blondie.json').render(
+    lora="blondie_lora-step00000750.safetensors",
+    strength=0.7,
+    prompt="blondie woman, professional portrait photo, natural lighting, photorealistic, 8k uhd, dslr, soft lighting, high quality, detailed face, film grain, Fujifilm XT3"
+)
 
 # Queue the workflow
 payload = {
@@ -32,7 +29,7 @@ print(f"   URL: {COMFYUI_URL}")
 print()
 
 try:
-    response = requests.post(f"{COMFYUI_URL}/prompt", json=payload, timeout=30)
+    response = get_client().post(f"{COMFYUI_URL}/prompt", json=payload, timeout=30)
 
     if response.status_code == 200:
         result = response.json()
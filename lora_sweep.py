@@ -0,0 +1,562 @@
+#!/usr/bin/env python3
+"""
+Declarative LoRA evaluation sweeps with a resumable job manifest.
+
+A sweep spec (YAML or JSON) lists the grid to evaluate:
+
+  name: checkpoints
+  workflow: comfyui_workflow_blondie.json
+  checkpoints: [realvisxl.safetensors]  # optional; omitted = workflow default
+  loras: [blondie_lora-step00000250.safetensors, blondie_lora-step00000500.safetensors]
+  strengths: [0.7]                     # optional; omitted = workflow default
+  prompts: {portrait: "blondie woman, professional portrait, ..."}
+  seeds: {base: 1000, count: 5}        # or an explicit list
+  batch_size: 1                        # optional; images per prompt (latent batch)
+  prefix: "test_checkpoint_{lora_step}_{variation:02d}"
+
+Prefix fields are the job's parameters plus name, lora_step, prompt_name,
+prompt_index, variation and strength10 (strength x 10, so 0.7 -> 7). A
+strength with a second decimal place has no strength10 of its own; such
+specs must use {strength} in the prefix instead.
+
+It expands to checkpoint x lora x strength x prompt x seed jobs. Each job
+id is a hash of its parameters, so the same spec always yields the same
+ids and seeds. Pending jobs are submitted grouped by (checkpoint, LoRA,
+strength), starting with whatever the server has loaded, so ComfyUI
+reloads and re-patches the model once per group instead of once per job;
+the number of model switches is reported per run.
+
+With batch_size N > 1, every N variations become one prompt whose
+EmptyLatentImage renders N images from the first seed of the group, so
+prompt validation, text encoding and the queue round-trip are paid once
+per N images. ComfyUI draws the whole batch's noise from that one seed, so
+an image is identified by (seed, batch_index) rather than its own seed;
+both are recorded per image in the job's done record.
+
+Progress is appended to sweeps/manifests/{name}.jsonl (queued with the
+prompt id, then done with output filenames, or failed).
+With an OutputStore (comfyui_outputs.py), each finished job's images are
+streamed into a local content-addressed store while the sweep keeps
+generating; sidecars carry the job parameters, seed and timings. The done
+record says whether every image was fetched (`fetched`), and a re-run
+fetches the images of done jobs whose downloads failed again.
+
+Re-running a spec skips done jobs and re-attaches to prompts still on the
+server. Only missing or failed jobs are submitted again. With several
+servers, a job whose node goes down is recorded as requeued and then
+queued again with the prompt id it gets on another node.
+
+Usage:
+  python3 lora_sweep.py sweeps/checkpoints.yaml
+  python3 lora_sweep.py sweeps/checkpoints.yaml --dry-run
+  python3 lora_sweep.py sweeps/checkpoints.yaml --no-reorder   # submit in spec order
+"""
+
+import sys
+import json
+import time
+import hashlib
+import argparse
+import itertools
+from pathlib import Path
+from concurrent.futures import Future
+from typing import Dict, Iterable, List, Optional
+
+from comfyui_outputs import DEFAULT_STORE_DIR, OutputStore
+from comfyui_pool import REQUEUED, ComfyUIPool, create_dispatcher
+from workflow_template import WorkflowTemplate, load_template
+
+
+MANIFEST_DIR = Path('sweeps/manifests')
+DEFAULT_SEED_BASE = 1000
+
+
+def load_spec(path: Path) -> Dict:
+    """Read a sweep spec from YAML (needs PyYAML) or JSON."""
+    text = Path(path).read_text()
+    if Path(path).suffix.lower() in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            print("Error: YAML specs need PyYAML. Run: pip install pyyaml (or use a .json spec)")
+            sys.exit(1)
+        return yaml.safe_load(text)
+    return json.loads(text)
+
+
+def lora_step(lora: str) -> str:
+    """'blondie_lora-step00000750.safetensors' -> '00000750'; no step -> 'final'."""
+    return lora.split("step")[1].split(".")[0] if "step" in lora else "final"
+
+
+def spec_seeds(spec: Dict) -> List[int]:
+    seeds = spec.get('seeds', {'count': 1})
+    if isinstance(seeds, dict):
+        base = seeds.get('base', DEFAULT_SEED_BASE)
+        return [base + i for i in range(seeds.get('count', 1))]
+    return list(seeds)
+
+
+def spec_prompts(spec: Dict) -> List[tuple]:
+    """(name, text) pairs; a plain list of prompts is named p01, p02, ..."""
+    prompts = spec['prompts']
+    if isinstance(prompts, dict):
+        return list(prompts.items())
+    return [(f"p{i:02d}", text) for i, text in enumerate(prompts, 1)]
+
+
+def make_job_id(params: Dict) -> str:
+    canonical = json.dumps(params, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+def expand_spec(spec: Dict) -> List[Dict]:
+    """Expand the grid into jobs with deterministic ids, seeds and filename prefixes."""
+    seeds = spec_seeds(spec)
+    prompts = spec_prompts(spec)
+    checkpoints = spec.get('checkpoints') or [None]
+    strengths = spec.get('strengths') or [None]
+    batch_size = max(1, int(spec.get('batch_size', 1)))
+    variations = list(enumerate(seeds, 1))
+    seed_groups = [variations[i:i + batch_size] for i in range(0, len(variations), batch_size)]
+    prefix = spec.get('prefix', '{name}_{lora_step}_{prompt_name}_{variation:03d}')
+    if '{strength10' in prefix:
+        # 0.6 and 0.65 would both be strength10=6 and share output names
+        inexact = [s for s in strengths if s is not None and abs(s * 10 - round(s * 10)) > 1e-9]
+        if inexact:
+            raise ValueError(f"strengths {inexact} have more than one decimal place; "
+                             f"use {{strength}} instead of {{strength10}} in the prefix")
+
+    jobs = []
+    for checkpoint, lora, strength, (prompt_index, (prompt_name, prompt)), group in itertools.product(
+        checkpoints, spec['loras'], strengths, enumerate(prompts, 1), seed_groups
+    ):
+        variation, seed = group[0]
+        params = {
+            'workflow': spec['workflow'],
+            'lora': lora,
+            'strength': strength,
+            'prompt': prompt,
+            'seed': seed
+        }
+        if checkpoint is not None:
+            # Only present when swept, so ids of existing single-checkpoint manifests stay valid
+            params['checkpoint'] = checkpoint
+        if batch_size > 1:
+            params['batch_size'] = len(group)
+        fields = dict(
+            params,
+            name=spec['name'],
+            checkpoint=checkpoint or '',
+            lora_step=lora_step(lora),
+            strength10=int(round((strength or 0) * 10)),
+            prompt_name=prompt_name,
+            prompt_index=prompt_index,
+            variation=variation
+        )
+        jobs.append(dict(
+            params,
+            job_id=make_job_id(params),
+            prompt_name=prompt_name,
+            variation=variation,
+            variations=[v for v, _ in group],
+            prefix=prefix.format(**fields)
+        ))
+    return jobs
+
+
+def model_key(job: Dict) -> tuple:
+    """What ComfyUI has to (re)load for a job: (checkpoint, LoRA file, strength)."""
+    return (job.get('checkpoint') or '', job['lora'], -1.0 if job['strength'] is None else job['strength'])
+
+
+def order_jobs(jobs: List[Dict], current: Optional[tuple] = None) -> List[Dict]:
+    """
+    Group jobs by model, keeping spec order within a group.
+
+    The group matching `current` (the model the server last ran for us)
+    goes first, so a resumed or continued sweep does not start with a switch.
+    """
+    ordered = sorted(jobs, key=model_key)
+    return sorted(ordered, key=lambda job: model_key(job) != current)
+
+
+def count_model_switches(jobs: List[Dict]) -> int:
+    keys = [model_key(job) for job in jobs]
+    return sum(1 for a, b in zip(keys, keys[1:]) if a != b)
+
+
+def render_job(template: WorkflowTemplate, job: Dict) -> Dict:
+    """The job's graph: its model, strength, prompt, seed, batch and output prefix on `template`."""
+    return template.render(
+        checkpoint=job.get('checkpoint'),
+        lora=job['lora'],
+        strength=job['strength'],
+        prompt=job['prompt'],
+        seed=job['seed'],
+        batch_size=job.get('batch_size', 1),
+        prefix=job['prefix']
+    )
+
+
+def output_filenames(history_entry: Dict) -> List[str]:
+    files = []
+    for node_output in history_entry.get('outputs', {}).values():
+        for image in node_output.get('images', []):
+            files.append(f"{image['subfolder']}/{image['filename']}" if image.get('subfolder') else image['filename'])
+    return files
+
+
+def image_provenance(job: Dict, files: List[str]) -> List[Dict]:
+    """One record per output image; files come back from SaveImage in batch order."""
+    variations = job.get('variations') or [job['variation']]
+    return [
+        {
+            'file': file,
+            'seed': job['seed'],
+            'batch_index': index,
+            'variation': variations[index] if index < len(variations) else None,
+            'prompt': job['prompt'],
+            'checkpoint': job.get('checkpoint'),
+            'lora': job['lora'],
+            'strength': job['strength']
+        }
+        for index, file in enumerate(files)
+    ]
+
+
+class SweepManifest:
+    """
+    Append-only JSONL log of job states for one sweep.
+
+    The last line for a job id wins, so a crash can at worst lose the line
+    being written; a torn final line is ignored on load.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.jobs: Dict[str, Dict] = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if 'job_id' in record:
+                        self.jobs[record['job_id']] = record
+        self._file = open(self.path, 'a', buffering=1)
+
+    def status(self, job_id: str) -> Optional[str]:
+        record = self.jobs.get(job_id)
+        return record['status'] if record else None
+
+    def record(self, job_id: str, status: str, **fields):
+        record = dict(fields, job_id=job_id, status=status, ts=round(time.time(), 3))
+        self.jobs[job_id] = record
+        self._file.write(json.dumps(record) + '\n')
+
+    def update(self, job_id: str, **fields):
+        """Re-record the job's last state with `fields` changed."""
+        record = {k: v for k, v in self.jobs[job_id].items() if k not in ('job_id', 'status', 'ts')}
+        self.record(job_id, self.jobs[job_id]['status'], **dict(record, **fields))
+
+    def write_header(self, name: str, total: int):
+        self._file.write(json.dumps({'sweep': name, 'total': total, 'ts': round(time.time(), 3)}) + '\n')
+
+    def close(self):
+        self._file.close()
+
+
+def manifest_path(spec: Dict) -> Path:
+    return MANIFEST_DIR / f"{spec['name']}.jsonl"
+
+
+def fetch_outputs(store: Optional[OutputStore], base_url: str, job: Dict, entry: Dict, sweep: str,
+                  prompt_id: str, submitted: Optional[float] = None) -> List[Future]:
+    """Queue the job's images for download into `store` (no-op without a store); returns their futures."""
+    if store is None:
+        return []
+    completed = time.time()
+    timings = {'completed': round(completed, 3)}
+    if submitted is not None:
+        timings.update(submitted=round(submitted, 3), generate_s=round(completed - submitted, 3))
+    # The store records filename/subfolder itself, so the manifest's 'file' is dropped
+    provenance = [
+        dict({k: v for k, v in image.items() if k != 'file'}, sweep=sweep, job_id=job['job_id'],
+             prompt_id=prompt_id, **timings)
+        for image in image_provenance(job, output_filenames(entry))
+    ]
+    return store.fetch(base_url, entry, provenance)
+
+
+def record_done(manifest: SweepManifest, store: Optional[OutputStore], base_url: str, job: Dict, entry: Dict,
+                sweep: str, prompt_id: str, submitted: Optional[float] = None,
+                fetching: Optional[Dict[str, List[Future]]] = None, **fields):
+    """
+    Record a finished job and queue its images for download.
+
+    With a store the record says fetched=False until settle_fetches() sees
+    every download succeed, so a failed fetch is retried by the next run
+    (refetch_outputs). The downloads are added to `fetching` by job id.
+    """
+    files = output_filenames(entry)
+    if store is not None:
+        fields.update(node=base_url, fetched=False)
+    manifest.record(job['job_id'], 'done', prompt_id=prompt_id, outputs=files,
+                    images=image_provenance(job, files), **fields)
+    futures = fetch_outputs(store, base_url, job, entry, sweep, prompt_id, submitted)
+    if store is not None and fetching is not None:
+        fetching[job['job_id']] = futures
+
+
+def settle_fetches(manifest: SweepManifest, fetching: Dict[str, List[Future]]):
+    """Mark jobs whose downloads have all finished as fetched (or leave them for the next run)."""
+    for job_id, futures in list(fetching.items()):
+        if not all(f.done() for f in futures):
+            continue
+        del fetching[job_id]
+        if all(f.exception() is None and f.result() is not None for f in futures):
+            manifest.update(job_id, fetched=True)
+
+
+def refetch_outputs(manifest: SweepManifest, store: OutputStore, jobs: Iterable[Dict], sweep: str,
+                    fetching: Dict[str, List[Future]]) -> int:
+    """Fetch again the images of done jobs whose downloads failed in an earlier run; returns the job count."""
+    refetched = 0
+    for job in jobs:
+        record = manifest.jobs.get(job['job_id'])
+        if not record or record['status'] != 'done' or record.get('fetched') is not False:
+            continue
+        images = []
+        for file in record.get('outputs', []):
+            subfolder, _, filename = file.rpartition('/')
+            images.append({'filename': filename, 'subfolder': subfolder, 'type': 'output'})
+        entry = {'outputs': {'0': {'images': images}}}
+        record_done(manifest, store, record['node'], job, entry, sweep, record.get('prompt_id'), fetching=fetching,
+                    **{k: v for k, v in record.items()
+                       if k not in ('job_id', 'status', 'ts', 'prompt_id', 'outputs', 'images', 'node', 'fetched')})
+        refetched += 1
+    return refetched
+
+
+def reattach_queued(scheduler, manifest: SweepManifest, jobs: Iterable[Dict], sweep: str = '',
+                    store: Optional[OutputStore] = None, fetching: Optional[Dict[str, List[Future]]] = None) -> int:
+    """
+    Reconcile jobs left 'queued' by an interrupted run with the server(s).
+
+    Prompts that finished meanwhile are recorded from /history; prompts
+    still queued or running are adopted by the scheduler (or by the pool
+    node holding them) instead of being submitted twice. Returns the
+    number of jobs reconciled.
+    """
+    queued = [j for j in jobs if manifest.status(j['job_id']) == 'queued']
+    if not queued:
+        return 0
+
+    # prompt_id -> endpoint, for prompts still queued or running somewhere
+    active: Dict[str, str] = {}
+    reachable = []
+    for base_url in scheduler.endpoints:
+        try:
+            queue = scheduler.client.get(f"{base_url}/queue", timeout=10, retries=0).json()
+        except Exception as e:
+            print(f"  ⚠ Could not read queue of {base_url} ({e})")
+            continue
+        reachable.append(base_url)
+        for item in queue.get('queue_running', []) + queue.get('queue_pending', []):
+            active[item[1]] = base_url
+
+    reconciled = 0
+    for job in queued:
+        prompt_id = manifest.jobs[job['job_id']].get('prompt_id')
+        if not prompt_id:
+            continue
+        if prompt_id in active:
+            scheduler.adopt(prompt_id, job['prefix'], base_url=active[prompt_id], job_id=job['job_id'])
+            reconciled += 1
+            continue
+        for base_url in reachable:
+            try:
+                history = scheduler.client.get(f"{base_url}/history/{prompt_id}", timeout=10, retries=0).json()
+            except Exception:
+                continue
+            entry = history.get(prompt_id)
+            if entry and entry.get('status', {}).get('status_str', 'success') == 'success':
+                record_done(manifest, store, base_url, job, entry, sweep, prompt_id, fetching=fetching)
+                reconciled += 1
+                break
+    return reconciled
+
+
+def record_queued(manifest: SweepManifest, job: Dict, prompt_id: str):
+    manifest.record(job['job_id'], 'queued', prompt_id=prompt_id, prefix=job['prefix'],
+                    checkpoint=job.get('checkpoint'), lora=job['lora'], strength=job['strength'],
+                    prompt_name=job['prompt_name'], seed=job['seed'], batch_size=job.get('batch_size', 1))
+
+
+def submit_jobs(
+    scheduler,
+    manifest: SweepManifest,
+    jobs: List[Dict],
+    template: WorkflowTemplate,
+    reorder: bool = True
+) -> int:
+    """Submit `jobs` (grouped by model unless `reorder` is off), recording each in the manifest; returns failures."""
+    if reorder:
+        jobs = order_jobs(jobs, scheduler.last_model)
+    failed = 0
+    for i, job in enumerate(jobs, 1):
+        prompt_id = scheduler.submit(render_job(template, job), f"[{i}/{len(jobs)}] {job['prefix']}",
+                                     model=model_key(job), job_id=job['job_id'])
+        if prompt_id == REQUEUED:
+            # Its node went down; the pool resubmits it elsewhere and on_resubmit records the new prompt id
+            manifest.record(job['job_id'], 'requeued', prefix=job['prefix'])
+        elif prompt_id:
+            record_queued(manifest, job, prompt_id)
+        else:
+            manifest.record(job['job_id'], 'failed', error='submit')
+            failed += 1
+    return failed
+
+
+def run_sweep(
+    spec: Dict,
+    scheduler,
+    template: Optional[WorkflowTemplate] = None,
+    manifest_file: Optional[Path] = None,
+    reorder: bool = True,
+    store: Optional[OutputStore] = None
+) -> Dict[str, int]:
+    """
+    Submit every job of `spec` that is not yet done and wait for them all.
+
+    `scheduler` is a ComfyUIScheduler or a ComfyUIPool.
+
+    `template` defaults to the spec's workflow file (UI or API format).
+    With a `store`, images are fetched as jobs finish and the call returns
+    once the last download is done. Returns counts of
+    done/failed/skipped jobs, images generated and model switches for
+    this run.
+    """
+    jobs = expand_spec(spec)
+    manifest = SweepManifest(manifest_file or manifest_path(spec))
+    manifest.write_header(spec['name'], len(jobs))
+    if template is None:
+        template = load_template(spec['workflow'])
+
+    counts = {'done': 0, 'failed': 0, 'skipped': 0, 'images': 0, 'switches': 0}
+    jobs_by_id = {job['job_id']: job for job in jobs}
+    fetching: Dict[str, List[Future]] = {}
+
+    def on_complete(job: Dict, entry: Dict):
+        status = entry.get('status', {}).get('status_str', 'success')
+        if status == 'success':
+            record_done(manifest, store, job.get('node') or scheduler.endpoints[0], jobs_by_id[job['job_id']],
+                        entry, spec['name'], job['prompt_id'], job['submitted'], fetching=fetching,
+                        duration=round(time.time() - job['submitted'], 3))
+            counts['done'] += 1
+            counts['images'] += len(output_filenames(entry))
+        else:
+            manifest.record(job['job_id'], 'failed', prompt_id=job['prompt_id'], error=status)
+            counts['failed'] += 1
+        settle_fetches(manifest, fetching)
+
+    def on_resubmit(job: Dict, prompt_id: str):
+        record_queued(manifest, jobs_by_id[job['job_id']], prompt_id)
+
+    previous_callback = scheduler.on_complete
+    scheduler.on_complete = on_complete
+    if isinstance(scheduler, ComfyUIPool):
+        scheduler.on_resubmit = on_resubmit
+    try:
+        reattached = reattach_queued(scheduler, manifest, jobs, spec['name'], store, fetching)
+        if reattached:
+            print(f"  ↻ Reconciled {reattached} job(s) left queued by an earlier run")
+        if store is not None:
+            refetched = refetch_outputs(manifest, store, jobs, spec['name'], fetching)
+            if refetched:
+                print(f"  ↻ Re-fetching images of {refetched} done job(s) whose downloads failed")
+
+        tracked = scheduler.tracked_job_ids()
+        pending = []
+        for job in jobs:
+            if manifest.status(job['job_id']) == 'done':
+                counts['skipped'] += 1
+            elif job['job_id'] not in tracked:
+                pending.append(job)
+
+        switches_before = scheduler.model_switches
+        counts['failed'] += submit_jobs(scheduler, manifest, pending, template, reorder)
+        scheduler.drain()
+        counts['switches'] = scheduler.model_switches - switches_before
+        if store is not None:
+            store.wait()
+            settle_fetches(manifest, fetching)
+    finally:
+        scheduler.on_complete = previous_callback
+        if isinstance(scheduler, ComfyUIPool):
+            scheduler.on_resubmit = None
+        manifest.close()
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a declarative LoRA sweep against ComfyUI')
+    parser.add_argument('spec', type=str, help='Sweep spec (.yaml/.yml or .json)')
+    parser.add_argument('--comfyui-url', type=str, default='http://127.0.0.1:8188',
+                        help='ComfyUI server, or a comma-separated list to spread the sweep over several')
+    parser.add_argument('--queue-depth', type=int, default=2, help='Prompts kept queued on each server')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between completion checks')
+    parser.add_argument('--dry-run', action='store_true', help='Print the expanded jobs and their manifest state')
+    parser.add_argument('--store', type=str, default=str(DEFAULT_STORE_DIR),
+                        help=f'Local content-addressed store for fetched images (default: {DEFAULT_STORE_DIR})')
+    parser.add_argument('--no-fetch', action='store_true', help='Leave images on the ComfyUI server')
+    parser.add_argument('--no-reorder', action='store_true',
+                        help='Submit in spec order instead of grouping jobs by checkpoint/LoRA/strength')
+    args = parser.parse_args()
+
+    spec = load_spec(Path(args.spec))
+    try:
+        jobs = expand_spec(spec)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    path = manifest_path(spec)
+
+    if args.dry_run:
+        manifest = SweepManifest(path)
+        if not args.no_reorder:
+            jobs = order_jobs(jobs)
+        for job in jobs:
+            print(f"{job['job_id']}  {manifest.status(job['job_id']) or 'pending':<8} "
+                  f"seed={job['seed']:<8} {job['prefix']}")
+        done = sum(1 for j in jobs if manifest.status(j['job_id']) == 'done')
+        print(f"\n{len(jobs)} jobs, {done} done, {len(jobs) - done} to run, "
+              f"{count_model_switches(jobs)} model switches (manifest: {path})")
+        manifest.close()
+        return
+
+    print(f"\n{'='*60}")
+    print(f"Sweep: {spec['name']} ({len(jobs)} jobs)")
+    print(f"Manifest: {path}")
+    print(f"{'='*60}")
+
+    start = time.time()
+    scheduler = create_dispatcher(args.comfyui_url, queue_depth=args.queue_depth, poll_interval=args.poll_interval)
+    store = None if args.no_fetch else OutputStore(Path(args.store))
+    counts = run_sweep(spec, scheduler, reorder=not args.no_reorder, store=store)
+    print(f"\n✅ {counts['done']} done ({counts['images']} images), {counts['failed']} failed, "
+          f"{counts['skipped']} already done "
+          f"in {(time.time() - start) / 60:.1f} min ({counts['switches']} model switches)")
+    if isinstance(scheduler, ComfyUIPool):
+        print(f"   Nodes: {scheduler.summary()}")
+    if store is not None:
+        store.close()
+        print(f"   Store: {store.root} ({store.summary()})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+One status poller for every outstanding MaxStudio job in the process.
+
+Polling each job on a fixed 2-3 s timer (as face-swap-model.sh does) spends
+most status calls on jobs that cannot be done yet, and a job that finishes
+just after a poll waits a whole interval to be noticed. JobPoller keeps all
+job ids in one due-time heap on the event loop instead:
+
+- Each endpoint keeps the completion times of its last `window` jobs (the
+  midpoint between the last "processing" poll and the "completed" one).
+  Once `min_samples` are in, a job of age `a` is next polled when half of
+  the observed jobs that ran longer than `a` had finished (the conditional
+  median), so polls land where completions are likely, not on a timer.
+- Until then, and for jobs older than anything seen so far, polls back off
+  from the endpoint's initial interval by `backoff` up to `max_interval`.
+- Status calls across all jobs go through one token bucket capped at
+  `max_rate` per second; polls that come due together are issued together.
+
+`fixed_interval` restores the old fixed timer for comparison. stats()
+reports status calls per job and the median submit-to-result latency.
+
+Usage:
+  poller = JobPoller(get_client(), MAXSTUDIO_API_URL, api_key)
+  result, polls = await poller.wait('image-enhancer', job_id)
+"""
+
+import heapq
+import asyncio
+import itertools
+from bisect import bisect_right
+from collections import deque
+from functools import partial
+from concurrent.futures import Executor
+from typing import Dict, Optional, Tuple
+
+import telemetry
+from http_client import HttpClient
+
+
+# Seconds before the first poll until completion times have been observed,
+# and how long a job may run, as in face-swap-model.sh (60 polls)
+POLL_INTERVALS = {'image-enhancer': 2.0, 'swap-image': 3.0}
+POLL_TIMEOUTS = {'image-enhancer': 120.0, 'swap-image': 180.0}
+
+
+class JobError(Exception):
+    """A MaxStudio job failed, timed out or its status could not be read."""
+
+
+class JobFailed(JobError):
+    """MaxStudio reported the job as failed."""
+
+
+class JobNotFound(JobError):
+    """MaxStudio does not know the job id (e.g. it expired)."""
+
+
+class JobPoller:
+    """Polls outstanding MaxStudio jobs from one task on the running event loop."""
+
+    def __init__(
+        self,
+        client: HttpClient,
+        api_url: str,
+        api_key: str,
+        executor: Optional[Executor] = None,
+        max_rate: float = 10.0,
+        min_interval: float = 0.5,
+        max_interval: float = 10.0,
+        backoff: float = 1.5,
+        window: int = 200,
+        min_samples: int = 5,
+        fixed_interval: Optional[float] = None,
+        timeout: Optional[float] = None
+    ):
+        self.client = client
+        self.api_url = api_url.rstrip('/')
+        self.api_key = api_key
+        self.executor = executor
+        self.max_rate = max_rate
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.window = window
+        self.min_samples = min_samples
+        self.fixed_interval = fixed_interval
+        self.timeout = timeout
+
+        self._heap = []
+        self._seq = itertools.count()
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._inflight = set()
+        self._tokens = max_rate
+        self._refilled = 0.0
+        self._durations: Dict[str, deque] = {}
+        self._latencies: Dict[str, list] = {}
+
+        self.status_calls = 0
+        self.completed = 0
+        self.failed = 0
+
+    async def wait(self, endpoint: str, job_id: str, age: float = 0.0) -> Tuple[object, int]:
+        """
+        Wait for a submitted job; returns (result, status polls) or raises JobError.
+
+        `age` is how long ago the job was submitted, for jobs picked up again
+        after a restart.
+        """
+        loop = asyncio.get_running_loop()
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._refilled = loop.time()
+            self._task = asyncio.ensure_future(self._run())
+
+        now = loop.time()
+        job = {
+            'endpoint': endpoint,
+            'id': job_id,
+            'submitted': now - age,
+            'last_poll': now - age,
+            'gap': None,
+            'polls': 0,
+            'future': loop.create_future()
+        }
+        self._schedule(job, now)
+        return await job['future']
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, *self._inflight, return_exceptions=True)
+            self._task = None
+
+    def _next_gap(self, job: Dict, now: float) -> float:
+        if self.fixed_interval:
+            return self.fixed_interval
+
+        age = now - job['submitted']
+        history = sorted(self._durations.get(job['endpoint'], ()))
+        if len(history) >= self.min_samples:
+            later = history[bisect_right(history, age):]
+            if later:
+                return max(self.min_interval, telemetry.percentile(later, 50) - age)
+
+        # No model yet, or older than every job seen: back off
+        if job['gap'] is None:
+            return POLL_INTERVALS.get(job['endpoint'], self.min_interval)
+        return min(self.max_interval, max(self.min_interval, job['gap'] * self.backoff))
+
+    def _schedule(self, job: Dict, now: float):
+        job['gap'] = self._next_gap(job, now)
+        heapq.heappush(self._heap, (now + job['gap'], next(self._seq), job))
+        self._wake.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            self._tokens = min(self.max_rate, self._tokens + (now - self._refilled) * self.max_rate)
+            self._refilled = now
+
+            if self._heap and self._heap[0][0] <= now and self._tokens >= 1:
+                _, _, job = heapq.heappop(self._heap)
+                self._tokens -= 1
+                task = asyncio.ensure_future(self._poll(job))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+                continue
+
+            if not self._heap:
+                delay = None
+            elif self._tokens < 1:
+                delay = (1 - self._tokens) / self.max_rate
+            else:
+                delay = self._heap[0][0] - now
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, job: Dict):
+        loop = asyncio.get_running_loop()
+        endpoint = job['endpoint']
+        try:
+            response = await loop.run_in_executor(self.executor, partial(
+                self.client.get, f"{self.api_url}/{endpoint}/{job['id']}", headers={'x-api-key': self.api_key}))
+            if response.status_code == 404:
+                raise JobNotFound(f"{endpoint} job {job['id']} not found")
+            if response.status_code != 200:
+                raise JobError(f"{endpoint} status: {response.status_code}")
+            data = response.json()
+        except Exception as e:
+            self._finish(job, exception=e if isinstance(e, JobError) else JobError(f"{endpoint} status: {e}"))
+            return
+        finally:
+            self.status_calls += 1
+            job['polls'] += 1
+
+        now = loop.time()
+        if data['status'] == 'completed':
+            durations = self._durations.setdefault(endpoint, deque(maxlen=self.window))
+            durations.append((job['last_poll'] + now) / 2 - job['submitted'])
+            self._latencies.setdefault(endpoint, []).append(now - job['submitted'])
+            self._finish(job, result=data['result'])
+        elif data['status'] == 'failed':
+            self._finish(job, exception=JobFailed(f"{endpoint} job {job['id']} failed"))
+        elif now - job['submitted'] > (self.timeout or POLL_TIMEOUTS.get(endpoint, 120.0)):
+            self._finish(job, exception=JobError(f"{endpoint} job {job['id']} timed out"))
+        else:
+            job['last_poll'] = now
+            self._schedule(job, now)
+
+    def _finish(self, job: Dict, result=None, exception: Optional[Exception] = None):
+        if job['future'].done():
+            return
+        if exception is not None:
+            self.failed += 1
+            job['future'].set_exception(exception)
+        else:
+            self.completed += 1
+            job['future'].set_result((result, job['polls']))
+
+    def stats(self) -> Dict:
+        jobs = self.completed + self.failed
+        return {
+            'status_calls': self.status_calls,
+            'jobs': jobs,
+            'calls_per_job': self.status_calls / jobs if jobs else 0.0,
+            'median_latency': {
+                endpoint: telemetry.percentile(sorted(latencies), 50)
+                for endpoint, latencies in self._latencies.items()
+            }
+        }
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Local quality pre-filter for face swap targets.
+
+Every target used to go through image-enhancer, an S3 upload and
+detect-face-image before anything looked at it, so a blurry, tiny or
+faceless image was only dropped ("No faces found") after it had been paid
+for. assess_target() looks at the image locally first, with vectorized
+NumPy on a reduced-scale decode (JPEG draft mode, ANALYSIS_EDGE on the
+long side), and routes it:
+
+- reject:        too small, too dark/bright, too blurry, or no face-sized
+                 skin-tone region. Nothing is sent to MaxStudio or Anthropic.
+- skip_enhance:  already high resolution and sharp; the first enhance job is
+                 skipped and the original is uploaded as is.
+- full:          everything else, as before.
+
+Metrics:
+
+- resolution:  full-size width/height (read from the header, not decoded).
+- sharpness:   variance of the 4-neighbour Laplacian of the luma channel.
+               Measured at ANALYSIS_EDGE, so it does not grow with resolution.
+- exposure:    mean luma and the fraction of pixels clipped to black/white.
+- face:        skin-tone pixels (YCbCr box from Chai & Ngan) are counted per
+               cell of a grid sized for a small face, and the target passes
+               if at least one cell is mostly skin. This is deliberately
+               loose: it only rejects images with no face-sized skin region
+               at all, and detect-face-image still decides where the face is.
+
+Functions are top-level and return plain dicts so they can run in a
+ProcessPoolExecutor (as scripts/preprocess.py does). numpy is already
+installed as an imagehash dependency.
+
+Usage:
+  python3 quality_filter.py Blondie/targets
+  python3 quality_filter.py Blondie/targets --min-sharpness 50 --skip-enhance-edge 1440
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+
+ROUTES = ('full', 'skip_enhance', 'reject')
+
+# Long edge the metrics are computed at
+ANALYSIS_EDGE = 512
+
+DEFAULT_THRESHOLDS = {
+    'min_edge': 512,            # shorter side, in full-size pixels
+    'min_sharpness': 30.0,      # Laplacian variance at ANALYSIS_EDGE (sharp targets: ~80-400)
+    'min_brightness': 40.0,     # mean luma, 0-255
+    'max_brightness': 225.0,
+    'max_clipped': 0.5,         # fraction of pixels at pure black or white
+    'min_face_cells': 1,        # grid cells that are mostly skin
+    'skip_enhance_edge': 2048,  # shorter side at which the first enhance adds nothing
+    'skip_enhance_sharpness': 100.0
+}
+
+# Cells are 1/12 of the shorter side; a cell counts as skin when this much of it is
+FACE_GRID = 12
+FACE_CELL_SKIN = 0.6
+
+# Paid calls each route saves compared to the full pipeline
+AVOIDED_CALLS = {
+    'full': {},
+    'skip_enhance': {'enhance': 1},
+    'reject': {'enhance': 2, 'detect': 1, 'swap': 1, 'upload': 1, 'caption': 1}
+}
+
+
+def image_metrics(img: Image.Image) -> Dict:
+    """Sharpness, exposure and face-presence metrics of an (already reduced) image."""
+    ycc = np.asarray(img.convert('YCbCr'), dtype=np.float32)
+    luma, cb, cr = ycc[..., 0], ycc[..., 1], ycc[..., 2]
+
+    laplacian = (4 * luma[1:-1, 1:-1] - luma[:-2, 1:-1] - luma[2:, 1:-1]
+                 - luma[1:-1, :-2] - luma[1:-1, 2:])
+
+    skin = (cb >= 77) & (cb <= 127) & (cr >= 133) & (cr <= 173) & (luma > 40)
+    height, width = skin.shape
+    cell = max(4, min(height, width) // FACE_GRID)
+    rows, cols = height // cell, width // cell
+    cells = skin[:rows * cell, :cols * cell].reshape(rows, cell, cols, cell).mean(axis=(1, 3))
+
+    return {
+        'sharpness': round(float(laplacian.var()), 1),
+        'brightness': round(float(luma.mean()), 1),
+        'clipped': round(float(((luma <= 8) | (luma >= 247)).mean()), 4),
+        'skin': round(float(skin.mean()), 4),
+        'face_cells': int((cells >= FACE_CELL_SKIN).sum())
+    }
+
+
+def route_target(width: int, height: int, image_format: Optional[str], metrics: Dict,
+                 thresholds: Dict) -> Dict:
+    """Pick a route from the metrics; returns {'route', 'reason'}."""
+    short_edge = min(width, height)
+    if short_edge < thresholds['min_edge']:
+        return {'route': 'reject', 'reason': f"too small ({width}x{height})"}
+    if not thresholds['min_brightness'] <= metrics['brightness'] <= thresholds['max_brightness']:
+        return {'route': 'reject', 'reason': f"badly exposed (mean {metrics['brightness']:.0f})"}
+    if metrics['clipped'] > thresholds['max_clipped']:
+        return {'route': 'reject', 'reason': f"{metrics['clipped']:.0%} clipped"}
+    if metrics['sharpness'] < thresholds['min_sharpness']:
+        return {'route': 'reject', 'reason': f"too blurry (sharpness {metrics['sharpness']:.0f})"}
+    if metrics['face_cells'] < thresholds['min_face_cells']:
+        return {'route': 'reject', 'reason': 'no face-sized skin region'}
+    # The original is uploaded in place of the enhanced JPEG, so only JPEGs skip
+    if (image_format == 'JPEG' and short_edge >= thresholds['skip_enhance_edge']
+            and metrics['sharpness'] >= thresholds['skip_enhance_sharpness']):
+        return {'route': 'skip_enhance', 'reason': f"already {width}x{height} and sharp"}
+    return {'route': 'full', 'reason': ''}
+
+
+def assess_target(path: Path, thresholds: Optional[Dict] = None) -> Dict:
+    """
+    Measure one target and route it; safe to run in a process pool.
+
+    Returns the route and reason, full-size dimensions, metrics and
+    `seconds` spent. Unreadable images are rejected.
+    """
+    thresholds = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+    start = time.perf_counter()
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+            image_format = img.format
+            img.draft('RGB', (ANALYSIS_EDGE, ANALYSIS_EDGE))
+            img = img.convert('RGB')
+            img.thumbnail((ANALYSIS_EDGE, ANALYSIS_EDGE))
+            metrics = image_metrics(img)
+    except Exception as e:
+        return {'path': str(path), 'route': 'reject', 'reason': f"unreadable ({e})",
+                'seconds': round(time.perf_counter() - start, 4)}
+
+    return {
+        'path': str(path),
+        **route_target(width, height, image_format, metrics, thresholds),
+        'width': width,
+        'height': height,
+        **metrics,
+        'seconds': round(time.perf_counter() - start, 4)
+    }
+
+
+def exit_with_parent(interval: float = 1.0):
+    """
+    Process pool initializer: exit once the parent process is gone.
+
+    A pool worker of a killed (SIGKILL) pipeline would otherwise wait for
+    work forever, holding its parent's stdout open.
+    """
+    parent = os.getppid()
+
+    def watch():
+        while os.getppid() == parent:
+            time.sleep(interval)
+        os._exit(1)
+
+    threading.Thread(target=watch, daemon=True).start()
+
+
+def avoided_calls(routes: Dict[str, int]) -> Dict[str, int]:
+    """Paid calls saved, given how many targets took each route."""
+    totals: Dict[str, int] = {}
+    for route, count in routes.items():
+        for call, saved in AVOIDED_CALLS[route].items():
+            totals[call] = totals.get(call, 0) + saved * count
+    return totals
+
+
+def format_avoided(routes: Dict[str, int]) -> str:
+    avoided = avoided_calls(routes)
+    jobs = avoided.get('enhance', 0) + avoided.get('swap', 0)
+    parts = [f"{jobs} MaxStudio jobs", f"{avoided.get('detect', 0)} detections",
+             f"{avoided.get('upload', 0)} uploads", f"{avoided.get('caption', 0)} captions"]
+    return ', '.join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Route face swap targets by local image quality')
+    parser.add_argument('targets_dir', type=str, help='Directory of target images (.jpg, .jpeg, .png)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Processes (default: CPU count)')
+    parser.add_argument('--json', action='store_true', help='Print one JSON result per target')
+    for name, value in DEFAULT_THRESHOLDS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value,
+                            help=f"Threshold (default: {value})")
+    args = parser.parse_args()
+
+    targets_dir = Path(args.targets_dir)
+    if not targets_dir.is_dir():
+        print(f"Error: Targets directory not found: {targets_dir}")
+        sys.exit(1)
+    targets = sorted(p for p in targets_dir.rglob('*') if p.is_file() and p.suffix.lower() in ('.jpg', '.jpeg', '.png'))
+    if not targets:
+        print(f"Error: No image files found in {targets_dir}")
+        sys.exit(1)
+    thresholds = {name: getattr(args, name) for name in DEFAULT_THRESHOLDS}
+
+    start = time.perf_counter()
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            results: List[Dict] = list(pool.map(assess_target, targets, [thresholds] * len(targets)))
+    else:
+        results = [assess_target(target, thresholds) for target in targets]
+    elapsed = time.perf_counter() - start
+
+    routes = {route: 0 for route in ROUTES}
+    for result in results:
+        routes[result['route']] += 1
+        if args.json:
+            print(json.dumps(result))
+            continue
+        mark = {'full': '✓', 'skip_enhance': '→', 'reject': '✗'}[result['route']]
+        detail = '' if 'sharpness' not in result else (
+            f" ({result['width']}x{result['height']}, sharpness {result['sharpness']:.0f}, "
+            f"mean {result['brightness']:.0f}, {result['face_cells']} skin cells)")
+        reason = f" — {result['reason']}" if result['reason'] else ''
+        print(f"  {mark} {Path(result['path']).name}: {result['route']}{reason}{detail}")
+
+    if not args.json:
+        print()
+        print(f"{len(results)} targets in {elapsed:.1f}s: {routes['full']} full, "
+              f"{routes['skip_enhance']} skip-enhance, {routes['reject']} rejected")
+        print(f"API calls avoided: {format_avoided(routes)}")
+
+
+if __name__ == '__main__':
+    main()
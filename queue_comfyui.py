@@ -1,12 +1,12 @@
 #!/usr/bin/env python3
-import requests
-import json
 import time
 import sys
 
-# Load workflow
-with open('/workspace/comfyui_workflow_blondie.json', 'r') as f:
-    workflow = json.load(f)
+from http_client import get_client
+from workflow_template import load_template
+
+# Load workflow (UI-format exports are converted to the API format)
+workflow = load_template('/workspace/comfyui_workflow_blondie.json').render()
 
 # Wrap in proper API format
 payload = {
@@ -15,7 +15,7 @@ payload = {
 }
 
 print("🚀 Queueing workflow in ComfyUI...")
-response = requests.post("http://127.0.0.1:8188/prompt", json=payload)
+response = get_client().post("http://127.0.0.1:8188/prompt", json=payload)
 
 if response.status_code == 200:
     result = response.json()
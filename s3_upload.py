@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Content-addressed S3 uploads for the face swap scripts.
+
+MaxStudio only takes images by public URL, so every enhanced target and the
+source face are uploaded first. Objects are keyed by the SHA-256 of their
+bytes (`{prefix}/{sha256}.jpg`), which makes keys unique per content:
+concurrent workers never overwrite each other, and identical content maps
+to the same key. Before a PUT the key is checked with a HEAD, so content
+already uploaded by an earlier job or run is not sent again; within a
+process the URL is also remembered, and concurrent uploads of the same
+bytes wait for the first one instead of racing it.
+
+Uploads go to AWS through boto3 (public-read). With `endpoint_url` (a local
+stand-in such as fake_s3.py) they are plain path-style HEADs and PUTs
+through the shared HTTP pool instead, unsigned.
+
+Usage:
+  from s3_upload import S3Uploader
+  uploader = S3Uploader('modelcrew', 'us-east-2')
+  url = uploader.upload(image_bytes, 'blondie/temp')
+"""
+
+import os
+import hashlib
+import threading
+from concurrent.futures import Future
+from typing import Dict, Optional
+
+import telemetry
+from http_client import HttpClient, get_client
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+
+class UploadError(Exception):
+    """The object store rejected a HEAD or PUT."""
+
+
+def content_key(data: bytes, prefix: str, extension: str = '.jpg') -> str:
+    return f"{prefix.rstrip('/')}/{hashlib.sha256(data).hexdigest()}{extension}"
+
+
+class S3Uploader:
+    """One S3 client shared by every upload in the process (thread-safe)."""
+
+    def __init__(
+        self,
+        bucket: str,
+        region: str,
+        endpoint_url: Optional[str] = None,
+        client: Optional[HttpClient] = None
+    ):
+        self.bucket = bucket
+        self.region = region
+        self.endpoint_url = endpoint_url.rstrip('/') if endpoint_url else None
+        self.client = client or get_client()
+        self.s3 = None
+        if self.endpoint_url is None:
+            if boto3 is None:
+                raise RuntimeError('boto3 is required for S3 uploads (pip install boto3), or pass --s3-endpoint')
+            self.s3 = boto3.client(
+                's3',
+                aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+                aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+                region_name=region
+            )
+
+        self._lock = threading.Lock()
+        self._urls: Dict[str, Future] = {}  # key -> Future resolving to its public URL
+        self.puts = 0
+        self.found = 0   # already in the bucket (HEAD hit)
+        self.reused = 0  # already uploaded or in flight in this process
+
+    def url_for(self, key: str) -> str:
+        if self.endpoint_url:
+            return f"{self.endpoint_url}/{self.bucket}/{key}"
+        return f"https://{self.bucket}.s3.{self.region}.amazonaws.com/{key}"
+
+    def exists(self, key: str) -> bool:
+        if self.s3 is not None:
+            try:
+                self.s3.head_object(Bucket=self.bucket, Key=key)
+                return True
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                    return False
+                raise
+        response = self.client.head(self.url_for(key))
+        if response.status_code == 404:
+            return False
+        if response.status_code != 200:
+            raise UploadError(f"S3 HEAD {key}: {response.status_code}")
+        return True
+
+    def put(self, data: bytes, key: str, content_type: str = 'image/jpeg'):
+        if self.s3 is not None:
+            self.s3.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type, ACL='public-read')
+            return
+        response = self.client.put(
+            self.url_for(key),
+            data=data,
+            headers={'Content-Type': content_type, 'x-amz-acl': 'public-read'}
+        )
+        if response.status_code != 200:
+            raise UploadError(f"S3 PUT {key}: {response.status_code}")
+
+    def upload(self, data: bytes, prefix: str, extension: str = '.jpg', content_type: str = 'image/jpeg') -> str:
+        """Upload `data` under `prefix` unless identical bytes are already there; returns the public URL."""
+        key = content_key(data, prefix, extension)
+        with self._lock:
+            pending = self._urls.get(key)
+            if pending is None:
+                self._urls[key] = Future()
+        if pending is not None:
+            url = pending.result()
+            with self._lock:
+                self.reused += 1
+            return url
+
+        try:
+            with telemetry.span('s3_upload', bytes=len(data)) as span:
+                found = self.exists(key)
+                if not found:
+                    self.put(data, key, content_type)
+                span['cached'] = found
+        except Exception as e:
+            # Let a later call retry rather than replaying the failure forever
+            with self._lock:
+                future = self._urls.pop(key)
+            future.set_exception(e)
+            raise
+
+        url = self.url_for(key)
+        with self._lock:
+            if found:
+                self.found += 1
+            else:
+                self.puts += 1
+            self._urls[key].set_result(url)
+        return url
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Benchmark the captioning pipeline against the local fake Messages endpoint.
+
+Runs the same image set sequentially, with --concurrency N, with
+--concurrency N plus downscaled upload payloads, and with K images per
+request on top of that, each into a throwaway dataset directory. Reports
+wall time, captions per minute, speedup over the sequential pass,
+requests, request bytes sent, uncached prompt-text tokens and mean request
+latency (the fake endpoint simulates a limited uplink so payload size
+shows up in latency).
+
+The default latency (4s) is that of a real vision caption request with a
+few hundred output tokens, and the default count is four full windows at
+--concurrency 16. Decoding and encoding still cost the same CPU time in
+every pass, so with a much lower --latency the concurrent passes become
+CPU-bound and the speedup falls well short of N.
+
+Usage:
+  python3 scripts/bench_caption.py
+  python3 scripts/bench_caption.py --count 40 --latency 0.5 --concurrency 16
+  python3 scripts/bench_caption.py --images-dir Blondie/outputs/faceswapped --limit 30 --bandwidth-mbps 50
+"""
+
+import io
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Dict, List
+
+from PIL import Image
+
+from preprocess import DEFAULT_PAYLOAD_MAX_EDGE, DEFAULT_PAYLOAD_QUALITY
+
+import fake_anthropic
+from meta_store import MetaStore
+from post_swap_caption import iter_prepared, process_image, process_images_async
+
+
+def make_synthetic_images(out_dir: Path, count: int, size=(2880, 3600)) -> List[Path]:
+    """Write `count` distinct gradient JPEGs for benchmarking."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(count):
+        img = Image.linear_gradient('L').resize(size).convert('RGB')
+        img = img.rotate(i * 7, fillcolor=(i * 5 % 255, 80, 160))
+        path = out_dir / f"synthetic_{i:04d}.jpg"
+        img.save(path, 'JPEG', quality=92)
+        paths.append(path)
+    return paths
+
+
+def make_dataset_dirs(root: Path) -> Dict[str, Path]:
+    dirs = {name: root / name for name in ('clean', 'captions', 'prompts', 'meta')}
+    for d in dirs.values():
+        d.mkdir(parents=True, exist_ok=True)
+    return dirs
+
+
+def run_pass(
+    image_files: List[Path],
+    root: Path,
+    api_url: str,
+    concurrency: int,
+    workers: int = 1,
+    payload_max_edge: int = 0,
+    payload_quality: int = DEFAULT_PAYLOAD_QUALITY,
+    images_per_request: int = 1
+) -> float:
+    """Caption every image once and return the elapsed wall time."""
+    dirs = make_dataset_dirs(root)
+    meta_store = MetaStore(dirs['meta'] / 'meta.jsonl')
+
+    cpu_pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        prepared_images = iter_prepared(
+            image_files, meta_store, cpu_pool, dedup='off', payload_max_edge=payload_max_edge,
+            payload_quality=payload_quality, lookahead=2 * max(workers, concurrency)
+        )
+        if concurrency > 1 or images_per_request > 1:
+            asyncio.run(process_images_async(
+                prepared_images, dirs['clean'], dirs['captions'], dirs['prompts'], meta_store,
+                'fake-key', 'blondie', 'woman', concurrency, api_url, images_per_request=images_per_request
+            ))
+        else:
+            for prepared in prepared_images:
+                process_image(
+                    prepared, dirs['clean'], dirs['captions'], dirs['prompts'], meta_store,
+                    'fake-key', 'blondie', 'woman', api_url
+                )
+    elapsed = time.perf_counter() - start
+    meta_store.close()
+    if cpu_pool is not None:
+        cpu_pool.shutdown()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark captioning throughput against a fake endpoint')
+    parser.add_argument('--images-dir', type=str, help='Use real images instead of synthetic ones')
+    parser.add_argument('--count', type=int, default=64, help='Synthetic images to generate')
+    parser.add_argument('--limit', type=int, help='Limit to N images from --images-dir')
+    parser.add_argument('--latency', type=float, default=4.0, help='Fake endpoint latency in seconds')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrency for the async pass')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Decode/encode processes for the async pass')
+    parser.add_argument('--bandwidth-mbps', type=float, default=50.0,
+                        help='Simulated uplink of the fake endpoint in Mbit/s (0 = unlimited)')
+    parser.add_argument('--payload-max-edge', type=int, default=DEFAULT_PAYLOAD_MAX_EDGE,
+                        help='Long edge for the optimized-payload pass')
+    parser.add_argument('--payload-quality', type=int, default=DEFAULT_PAYLOAD_QUALITY,
+                        help='JPEG quality for the optimized-payload pass')
+    parser.add_argument('--images-per-request', type=int, default=4,
+                        help='Images per request for the multi-image pass')
+    args = parser.parse_args()
+
+    server = fake_anthropic.start_server(latency=args.latency, bandwidth=args.bandwidth_mbps * 1e6 / 8)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        if args.images_dir:
+            image_files = sorted(
+                p for p in Path(args.images_dir).iterdir()
+                if p.suffix.lower() in {'.jpg', '.jpeg', '.png', '.webp'}
+            )[:args.limit]
+        else:
+            image_files = make_synthetic_images(tmp / 'images', args.count)
+
+        print(f"Images: {len(image_files)}, endpoint latency: {args.latency}s, "
+              f"uplink: {args.bandwidth_mbps or 'unlimited'} Mbit/s")
+
+        passes = [
+            ('sequential', 1, 0, 1),
+            (f'concurrency={args.concurrency}', args.concurrency, 0, 1),
+            (f'+payload {args.payload_max_edge}px', args.concurrency, args.payload_max_edge, 1),
+            (f'+{args.images_per_request} per request', args.concurrency, args.payload_max_edge,
+             args.images_per_request),
+        ]
+        results = []
+        for name, concurrency, max_edge, per_request in passes:
+            server.reset_stats()
+            wall = run_pass(
+                image_files, tmp / name, server.url, concurrency, args.workers if concurrency > 1 else 1,
+                max_edge, args.payload_quality, per_request
+            )
+            latency = sum(server.durations) / max(len(server.durations), 1)
+            results.append((name, wall, server.requests, server.bytes_received, server.text_tokens, latency))
+
+    server.shutdown()
+
+    n = len(image_files)
+    sequential = results[0][1]
+    print(f"{'mode':<22}{'wall (s)':>10}{'captions/min':>15}{'speedup':>9}{'requests':>10}{'MB sent':>10}"
+          f"{'text tokens':>13}{'latency (s)':>13}")
+    for name, wall, requests, sent, tokens, latency in results:
+        print(f"{name:<22}{wall:>10.2f}{n / wall * 60:>15.1f}{sequential / wall:>8.1f}x{requests:>10}"
+              f"{sent / 1e6:>10.2f}{tokens:>13}{latency:>13.3f}")
+    print(f"Concurrency speedup: {results[0][1] / results[1][1]:.1f}x, "
+          f"payload bytes reduction: {results[1][3] / max(results[2][3], 1):.1f}x, "
+          f"text tokens per caption: {results[2][4] / n:.0f} -> {results[3][4] / n:.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache for Anthropic caption results.
+
+A caption is keyed by the image content hash plus everything that shapes the
+API answer (prompt template, model, trigger/class tokens), so re-running the
+pipeline over unchanged images costs zero API calls. Entries live in a small
+SQLite file under dataset/ and are evicted least-recently-used once the
+entry or size limits are exceeded.
+"""
+
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+DEFAULT_CACHE_PATH = Path('dataset/cache/captions.sqlite')
+
+
+def file_sha256(path: Path) -> str:
+    """Hash file contents in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_cache_key(content_hash: str, prompt_template: str, model: str, trigger_token: str, class_token: str) -> str:
+    """Combine image hash and request parameters into a single cache key."""
+    digest = hashlib.sha256()
+    for part in (content_hash, prompt_template, model, trigger_token, class_token):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class CaptionCache:
+    """LRU-evicting SQLite cache mapping cache keys to caption metadata dicts."""
+
+    def __init__(self, path: Path = DEFAULT_CACHE_PATH, max_entries: int = 100_000, max_bytes: int = 256 * 1024 * 1024):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        # Shared across the worker threads of the concurrent mode
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS captions ('
+            ' key TEXT PRIMARY KEY,'
+            ' value TEXT NOT NULL,'
+            ' size INTEGER NOT NULL,'
+            ' created REAL NOT NULL,'
+            ' last_used REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS captions_last_used ON captions(last_used)')
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return the cached metadata for `key`, or None on a miss."""
+        return self.get_any([key])
+
+    def get_any(self, keys: List[str]) -> Optional[Dict]:
+        """Return the metadata of the first of `keys` that is cached, counting one hit or miss."""
+        with self._lock:
+            for key in keys:
+                row = self._conn.execute('SELECT value FROM captions WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    self._conn.execute('UPDATE captions SET last_used = ? WHERE key = ?', (time.time(), key))
+                    self._conn.commit()
+                    self.hits += 1
+                    return json.loads(row[0])
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: Dict):
+        """Store metadata for `key` and evict old entries if over the limits."""
+        data = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO captions (key, value, size, created, last_used) VALUES (?, ?, ?, ?, ?)',
+                (key, data, len(data), now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count, total = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM captions').fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        # Walk from least recently used until both limits are satisfied
+        doomed = []
+        for key, size in self._conn.execute('SELECT key, size FROM captions ORDER BY last_used ASC'):
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            count -= 1
+            total -= size
+        self._conn.executemany('DELETE FROM captions WHERE key = ?', doomed)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM captions').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
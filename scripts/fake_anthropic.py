@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Anthropic Messages endpoint.
+
+Answers POST /v1/messages with a well-formed caption after a configurable
+delay, so the captioning pipeline can be exercised and benchmarked without
+an API key or network access. An optional simulated uplink bandwidth adds
+transfer time proportional to the request size; the link is shared, so
+concurrent uploads queue behind each other like they would on a real pipe.
+The Message Batches endpoints are emulated too: a batch reports
+in_progress until --batch-latency seconds have passed, then serves its
+results as JSONL.
+
+Multi-image requests (instructions in a system block) are answered with a
+JSON array, and cache_control blocks are counted as prompt-cache reads
+after their first use so token savings can be measured.
+
+A message request whose Idempotency-Key header was already answered with
+200 gets the same message back and is counted in `replays`, not as a new
+billed message. The real Messages API does not document such a key; the
+face-swap crash test uses it to check that the pipeline resends an
+interrupted caption under its journaled key rather than as a new request.
+Clients that drop their connection are not reported.
+
+Usage:
+  python3 scripts/fake_anthropic.py --port 8765 --latency 1.0
+  ANTHROPIC_API_URL=http://127.0.0.1:8765/v1/messages ANTHROPIC_API_KEY=fake \\
+      python3 scripts/post_swap_caption.py --images-dir Blondie/outputs/faceswapped --concurrency 16
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+def text_blocks(request: Dict) -> List[Dict]:
+    """Every text block of a request: system blocks first, then message content."""
+    blocks = [b for b in request.get('system', []) if isinstance(b, dict)]
+    blocks += [b for b in request['messages'][0]['content'] if b.get('type') == 'text']
+    return blocks
+
+
+def fake_caption(request: Dict) -> Dict:
+    """Build a caption payload that passes the pipeline's key validation."""
+    text = ''
+    for block in text_blocks(request):
+        if 'MUST start with' in block['text']:
+            text = block['text']
+
+    # Echo the trigger/class prefix the prompt asked for
+    prefix = 'subject'
+    marker = 'MUST start with "'
+    if marker in text:
+        prefix = text.split(marker, 1)[1].split(',', 1)[0]
+
+    return {
+        'caption': f'{prefix}, standing indoors, neutral expression, soft daylight',
+        'recreation_prompt': 'Portrait photograph with soft window light, 50mm lens at f/2, shallow depth of field, neutral color grading.',
+        'style': ['portrait', 'natural light', 'bokeh', 'neutral tones', 'indoor'],
+        'sfw': True,
+        'ar': '4:5'
+    }
+
+
+def fake_message(request: Dict, message_id: str, usage: Optional[Dict] = None) -> Dict:
+    """Caption response; multi-image requests (with a system block) get a JSON array."""
+    caption = fake_caption(request)
+    if request.get('system'):
+        images = sum(1 for b in request['messages'][0]['content'] if b.get('type') == 'image')
+        text = json.dumps([dict(caption, index=i) for i in range(images)])
+    else:
+        text = json.dumps(caption)
+
+    return {
+        'id': message_id,
+        'type': 'message',
+        'role': 'assistant',
+        'model': request.get('model'),
+        'content': [{'type': 'text', 'text': text}],
+        'stop_reason': 'end_turn',
+        'usage': usage or {'input_tokens': 0, 'output_tokens': 0}
+    }
+
+
+class FakeAnthropicServer(ThreadingHTTPServer):
+    """Threaded HTTP server that records request counts and bytes received."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        latency: float = 1.0,
+        bandwidth: float = 0.0,
+        batch_latency: float = 5.0,
+        error_rate: float = 0.0,
+        retry_after: float = 1.0
+    ):
+        super().__init__(address, FakeAnthropicHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.errors = 0
+        self.bandwidth = bandwidth
+        self.batch_latency = batch_latency
+        self.batches: Dict[str, Dict] = {}
+        self.lock = threading.Lock()
+        # Idempotency-Key -> {'done': Event, 'response': (status, body, headers)}
+        self.responses: Dict[str, Dict] = {}
+        self.replays = 0
+        self.requests = 0
+        self.bytes_received = 0
+        self.durations = []
+        self.text_tokens = 0
+        self.cached_tokens = 0
+        self._prompt_cache = set()
+        self._link_free_at = 0.0
+
+    def handle_error(self, request, client_address):
+        # A killed client leaves its connections half-open; that is expected here
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    def idempotent(self, key: Optional[str], handle: Callable[[], Tuple]) -> Tuple:
+        """Run `handle` once per Idempotency-Key; later requests with the key get its 200 response."""
+        if not key:
+            return handle()
+        with self.lock:
+            entry = self.responses.get(key)
+            first = entry is None
+            if first:
+                entry = self.responses[key] = {'done': threading.Event()}
+        if not first:
+            entry['done'].wait()
+            if 'response' in entry:
+                with self.lock:
+                    self.replays += 1
+                return entry['response']
+            return self.idempotent(key, handle)
+        try:
+            response = handle()
+            if response[0] == 200:
+                entry['response'] = response
+            return response
+        finally:
+            if 'response' not in entry:
+                # Only successes are remembered, so a failed request can be retried
+                with self.lock:
+                    self.responses.pop(key, None)
+            entry['done'].set()
+
+    def transfer_done_at(self, length: int) -> float:
+        """Reserve `length` bytes on the shared simulated uplink; return when they arrive."""
+        with self.lock:
+            start = max(time.perf_counter(), self._link_free_at)
+            self._link_free_at = start + length / self.bandwidth
+            return self._link_free_at
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests = 0
+            self.bytes_received = 0
+            self.durations = []
+            self.errors = 0
+            self.replays = 0
+            self.text_tokens = 0
+            self.cached_tokens = 0
+
+    def count_tokens(self, request: Dict) -> Dict:
+        """
+        Rough usage for the text of a request (~4 chars per token).
+
+        Blocks marked with cache_control are billed as cache reads after the
+        first time they are seen, like the real prompt cache.
+        """
+        fresh = cached = 0
+        with self.lock:
+            for block in text_blocks(request):
+                tokens = len(block['text']) // 4
+                if 'cache_control' in block and block['text'] in self._prompt_cache:
+                    cached += tokens
+                else:
+                    fresh += tokens
+                    if 'cache_control' in block:
+                        self._prompt_cache.add(block['text'])
+            self.text_tokens += fresh
+            self.cached_tokens += cached
+        return {'input_tokens': fresh, 'cache_read_input_tokens': cached, 'output_tokens': 0}
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/messages"
+
+    def batch_object(self, batch_id: str) -> Dict:
+        batch = self.batches[batch_id]
+        ended = time.time() - batch['created'] >= self.batch_latency
+        count = len(batch['requests'])
+        return {
+            'id': batch_id,
+            'type': 'message_batch',
+            'processing_status': 'ended' if ended else 'in_progress',
+            'request_counts': {
+                'processing': 0 if ended else count,
+                'succeeded': count if ended else 0,
+                'errored': 0,
+                'canceled': 0,
+                'expired': 0
+            },
+            'results_url': f"{self.url}/batches/{batch_id}/results" if ended else None
+        }
+
+
+class FakeAnthropicHandler(BaseHTTPRequestHandler):
+    server: FakeAnthropicServer
+
+    # Keep connections alive so client-side connection pooling is exercised
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: Dict, headers: Optional[Dict] = None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        start = time.perf_counter()
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        if len(body) < length:
+            return  # the client went away mid-request; nothing was sent to be billed
+
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.bytes_received += length
+
+        path = self.path.rstrip('/')
+        if path == '/v1/messages/batches':
+            self._create_batch(json.loads(body))
+            return
+        if path != '/v1/messages':
+            self._send_not_found()
+            return
+
+        request = json.loads(body)
+        self._send_json(*self.server.idempotent(self.headers.get('Idempotency-Key'),
+                                                lambda: self._message(request, length)))
+
+        with self.server.lock:
+            self.server.durations.append(time.perf_counter() - start)
+
+    def _message(self, request: Dict, length: int) -> Tuple[int, Dict, Optional[Dict]]:
+        if random.random() < self.server.error_rate:
+            with self.server.lock:
+                self.server.errors += 1
+            return 429, {'type': 'error', 'error': {'type': 'rate_limit_error'}}, \
+                {'Retry-After': f'{self.server.retry_after:g}'}
+        if self.server.bandwidth:
+            time.sleep(max(0.0, self.server.transfer_done_at(length) - time.perf_counter()))
+        time.sleep(self.server.latency)
+
+        usage = self.server.count_tokens(request)
+        return 200, fake_message(request, f'msg_fake_{self.server.requests}', usage), None
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        # /v1/messages/batches/{id}[/results]
+        if parts[:3] != ['v1', 'messages', 'batches'] or len(parts) not in (4, 5):
+            self._send_not_found()
+            return
+
+        batch_id = parts[3]
+        if batch_id not in self.server.batches:
+            self._send_not_found()
+            return
+
+        batch = self.server.batch_object(batch_id)
+        if len(parts) == 4:
+            self._send_json(200, batch)
+            return
+        if batch['processing_status'] != 'ended':
+            self._send_json(409, {'type': 'error', 'error': {'type': 'invalid_request_error'}})
+            return
+
+        lines = []
+        for i, item in enumerate(self.server.batches[batch_id]['requests']):
+            lines.append(json.dumps({
+                'custom_id': item['custom_id'],
+                'result': {'type': 'succeeded', 'message': fake_message(item['params'], f'msg_{batch_id}_{i}')}
+            }))
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/binary')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _create_batch(self, body: Dict):
+        with self.server.lock:
+            batch_id = f'msgbatch_fake_{len(self.server.batches) + 1:04d}'
+            self.server.batches[batch_id] = {'created': time.time(), 'requests': body['requests']}
+        self._send_json(200, self.server.batch_object(batch_id))
+
+    def _send_not_found(self):
+        self._send_json(404, {'type': 'error', 'error': {'type': 'not_found_error'}})
+
+
+def start_server(
+    host: str = '127.0.0.1',
+    port: int = 0,
+    latency: float = 1.0,
+    bandwidth: float = 0.0,
+    batch_latency: float = 5.0,
+    error_rate: float = 0.0,
+    retry_after: float = 1.0
+) -> FakeAnthropicServer:
+    """Start a fake server on a background thread (port 0 picks a free port)."""
+    server = FakeAnthropicServer(
+        (host, port), latency=latency, bandwidth=bandwidth, batch_latency=batch_latency,
+        error_rate=error_rate, retry_after=retry_after
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the Anthropic Messages API')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Bind address')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on')
+    parser.add_argument('--latency', type=float, default=1.0, help='Seconds to wait before each response')
+    parser.add_argument('--bandwidth-mbps', type=float, default=0.0,
+                        help='Simulated uplink in Mbit/s; adds request-size-proportional delay (0 = off)')
+    parser.add_argument('--batch-latency', type=float, default=5.0,
+                        help='Seconds before a submitted message batch reports ended')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of message requests answered with 429 + Retry-After')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After seconds sent with a 429')
+    args = parser.parse_args()
+
+    bandwidth = args.bandwidth_mbps * 1e6 / 8
+    server = FakeAnthropicServer(
+        (args.host, args.port), latency=args.latency, bandwidth=bandwidth, batch_latency=args.batch_latency,
+        error_rate=args.error_rate, retry_after=args.retry_after
+    )
+    print(f"Fake Messages endpoint: {server.url} (latency {args.latency}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Served {server.requests} requests ({server.errors} rate-limited, {server.replays} replayed), {server.bytes_received} bytes received")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Minimal client for the Anthropic Message Batches API.
+
+Batches trade latency for cost: up to 100,000 requests (256MB) are submitted
+in one call, processed asynchronously within 24h at half the price, and the
+results are downloaded as a JSONL stream. post_swap_caption.py --batch uses
+these helpers together with a small state file so an interrupted run can
+pick its batches back up instead of paying for them twice.
+"""
+
+import sys
+import json
+import time
+import random
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from http_client import get_client
+
+
+# Stay comfortably below the documented 256MB / 100,000 request limits
+MAX_BATCH_BYTES = 200 * 1024 * 1024
+MAX_BATCH_REQUESTS = 100_000
+
+BATCH_STATE_VERSION = 1
+
+
+def batches_url(messages_url: str) -> str:
+    """The batches endpoint lives under the Messages endpoint."""
+    return messages_url.rstrip('/') + '/batches'
+
+
+def create_batch(url: str, headers: Dict, batch_requests: List[Dict]) -> Dict:
+    """Submit `batch_requests` ({custom_id, params}) and return the batch object."""
+    response = get_client().post(url, headers=headers, json={'requests': batch_requests}, timeout=600)
+    response.raise_for_status()
+    return response.json()
+
+
+def get_batch(url: str, headers: Dict, batch_id: str) -> Dict:
+    response = get_client().get(f"{url}/{batch_id}", headers=headers, timeout=60)
+    response.raise_for_status()
+    return response.json()
+
+
+def wait_for_batch(
+    url: str,
+    headers: Dict,
+    batch_id: str,
+    initial_delay: float = 30.0,
+    max_delay: float = 600.0,
+    backoff: float = 1.5
+) -> Dict:
+    """Poll until the batch has ended, backing off (with jitter) between polls."""
+    delay = initial_delay
+    while True:
+        try:
+            batch = get_batch(url, headers, batch_id)
+        except requests.RequestException as e:
+            print(f"  ⚠ Error polling batch {batch_id}: {e}")
+        else:
+            if batch['processing_status'] == 'ended':
+                return batch
+            counts = batch.get('request_counts', {})
+            print(f"  ⏳ Batch {batch_id}: {batch['processing_status']} "
+                  f"({counts.get('processing', '?')} processing, {counts.get('succeeded', 0)} succeeded)")
+
+        time.sleep(delay * random.uniform(0.9, 1.1))
+        delay = min(delay * backoff, max_delay)
+
+
+def iter_batch_results(results_url: str, headers: Dict) -> Iterator[Dict]:
+    """Stream result lines ({custom_id, result}) without loading the whole file."""
+    with get_client().get(results_url, headers=headers, stream=True, timeout=600) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line)
+
+
+def load_batch_state(path: Path) -> Optional[Dict]:
+    if not path.exists():
+        return None
+    state = json.loads(path.read_text())
+    if state.get('version') != BATCH_STATE_VERSION:
+        print(f"  ⚠ Ignoring batch state with unknown version: {path}")
+        return None
+    return state
+
+
+def save_batch_state(path: Path, state: Dict):
+    """Atomically persist batch ids and the custom_id -> image mapping."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+    tmp_path.write_text(json.dumps(state))
+    tmp_path.replace(path)
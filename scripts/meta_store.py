@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Resumable, keyed writer for dataset/meta/meta.jsonl.
+
+Records are keyed by their source image path. meta.jsonl stays append-only
+while a run is in progress, so a crash never corrupts earlier records; a
+compact index (meta.jsonl.idx) maps every key to the byte offset and length
+of its latest line and to its phash. That makes single-record reads
+O(1) and lets re-runs skip images whose record is already complete. When a
+record is replaced, the stale line is dropped by an atomic rewrite on close.
+
+The index is only written on close (and after compaction), so a run costs
+one index write however many records it upserts. If a run dies before
+closing, the lines it appended are re-indexed from the tail of meta.jsonl
+(past the size the index covers) the next time the store is opened.
+"""
+
+import os
+import json
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+
+INDEX_VERSION = 1
+
+
+def record_key(entry: Dict) -> str:
+    """Key a meta record by its source image (face-swap records only carry a path)."""
+    return entry.get('source') or entry['path']
+
+
+class MetaStore:
+    """Index-backed view of a meta.jsonl file supporting upserts and O(1) lookups."""
+
+    def __init__(self, meta_path: Path):
+        self.meta_path = Path(meta_path)
+        self.index_path = self.meta_path.with_name(self.meta_path.name + '.idx')
+
+        # key -> (offset, length) of the latest line for that key
+        self.records: Dict[str, Tuple[int, int]] = {}
+        # key -> phash, plus the reverse lookup (rebuilt in memory, not persisted)
+        self.phashes: Dict[str, str] = {}
+        self.keys_by_phash: Dict[str, str] = {}
+        self.stale = 0
+        self._covered = 0
+
+        self.meta_path.parent.mkdir(parents=True, exist_ok=True)
+        self.meta_path.touch(exist_ok=True)
+        self._load_index()
+        self._catch_up()
+        self._file = open(self.meta_path, 'ab')
+
+    def _load_index(self):
+        if not self.index_path.exists():
+            return
+        try:
+            index = json.loads(self.index_path.read_text())
+        except (OSError, json.JSONDecodeError):
+            return
+        if index.get('version') != INDEX_VERSION or index['size'] > self.meta_path.stat().st_size:
+            # meta.jsonl was rewritten or truncated behind our back; rebuild
+            return
+        self.records = {key: tuple(loc) for key, loc in index['records'].items()}
+        self.phashes = index['phashes']
+        self.keys_by_phash = {phash: key for key, phash in self.phashes.items()}
+        self.stale = index['stale']
+        self._covered = index['size']
+
+    def _catch_up(self):
+        """Index lines appended after the index was last written (by a run that did not close)."""
+        size = self.meta_path.stat().st_size
+        if self._covered >= size:
+            return
+
+        with open(self.meta_path, 'rb') as f:
+            f.seek(self._covered)
+            offset = self._covered
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Partial trailing write from an interrupted run
+                    break
+                if line.strip():
+                    try:
+                        self._index_line(json.loads(line), offset, len(line))
+                    except json.JSONDecodeError:
+                        break
+                offset += len(line)
+
+        if offset < size:
+            print(f"  ⚠ Truncating {size - offset} bytes of incomplete data from {self.meta_path}")
+            os.truncate(self.meta_path, offset)
+        self._covered = offset
+
+    def _index_line(self, entry: Dict, offset: int, length: int):
+        key = record_key(entry)
+        if key in self.records:
+            self.stale += 1
+        self.records[key] = (offset, length)
+        if entry.get('phash'):
+            self.phashes[key] = entry['phash']
+            self.keys_by_phash[entry['phash']] = key
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.records
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Read a single record by key with one seek."""
+        loc = self.records.get(key)
+        if loc is None:
+            return None
+        self._file.flush()
+        with open(self.meta_path, 'rb') as f:
+            f.seek(loc[0])
+            return json.loads(f.read(loc[1]))
+
+    def get_by_phash(self, phash: str) -> Optional[Dict]:
+        key = self.keys_by_phash.get(phash)
+        entry = self.get(key) if key else None
+        # The key may have been upserted with a different phash since
+        return entry if entry and entry.get('phash') == phash else None
+
+    def complete_sha256(self, key: str) -> Optional[str]:
+        """sha256 of the image content `key`'s record was made from, if its outputs exist."""
+        entry = self.get(key)
+        if not entry or not entry.get('sha256'):
+            return None
+        clean_path = self.meta_path.parent.parent / entry['path']
+        return entry['sha256'] if clean_path.exists() else None
+
+    def is_complete(self, key: str, sha256: str) -> bool:
+        """True if `key` has a record for the same image content whose outputs exist."""
+        return self.complete_sha256(key) == sha256
+
+    def upsert(self, entry: Dict):
+        """Append `entry`, superseding any earlier record with the same key."""
+        line = (json.dumps(entry) + '\n').encode('utf-8')
+        offset = self._covered
+        self._file.write(line)
+        self._file.flush()
+        self._index_line(entry, offset, len(line))
+        self._covered += len(line)
+
+    def iter_records(self) -> Iterator[Dict]:
+        """Yield live records in file order."""
+        for key, _ in sorted(self.records.items(), key=lambda item: item[1][0]):
+            yield self.get(key)
+
+    def flush_index(self):
+        """Atomically persist the index."""
+        self._file.flush()
+        index = {
+            'version': INDEX_VERSION,
+            'size': self._covered,
+            'stale': self.stale,
+            'records': self.records,
+            'phashes': self.phashes
+        }
+        tmp_path = self.index_path.with_name(self.index_path.name + '.tmp')
+        tmp_path.write_text(json.dumps(index, separators=(',', ':')))
+        os.replace(tmp_path, self.index_path)
+
+    def compact(self):
+        """Rewrite meta.jsonl without superseded lines, atomically."""
+        self._file.flush()
+        tmp_path = self.meta_path.with_name(self.meta_path.name + '.tmp')
+        records: Dict[str, Tuple[int, int]] = {}
+        offset = 0
+
+        with open(self.meta_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            for key, (old_offset, length) in sorted(self.records.items(), key=lambda item: item[1][0]):
+                src.seek(old_offset)
+                dst.write(src.read(length))
+                records[key] = (offset, length)
+                offset += length
+            dst.flush()
+            os.fsync(dst.fileno())
+
+        self._file.close()
+        os.replace(tmp_path, self.meta_path)
+        self._file = open(self.meta_path, 'ab')
+        self.records = records
+        self.stale = 0
+        self._covered = offset
+        self.flush_index()
+
+    def close(self):
+        if self.stale:
+            self.compact()
+        else:
+            self.flush_index()
+        os.fsync(self._file.fileno())
+        self._file.close()
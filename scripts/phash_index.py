@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Hamming-distance index over 64-bit perceptual hashes.
+
+Uses multi-index hashing: the 64 bits are split into max_distance + 1
+disjoint chunks, and by the pigeonhole principle any hash within
+max_distance of a query agrees with it exactly on at least one chunk. A
+lookup therefore only verifies the handful of entries sharing a chunk
+value, which keeps it in the microseconds even for tens of thousands of
+images. Used by post_swap_caption.py to skip or flag near-duplicate swaps
+before they are normalized and captioned.
+
+Usage:
+  python3 scripts/phash_index.py dataset/meta/meta.jsonl --distance 6
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+HASH_BITS = 64
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class PhashIndex:
+    """Multi-index hash table answering radius queries up to `max_distance`."""
+
+    def __init__(self, max_distance: int = 4):
+        if not 0 <= max_distance < HASH_BITS:
+            raise ValueError(f"max_distance must be between 0 and {HASH_BITS - 1}")
+        self.max_distance = max_distance
+
+        # Split the hash into max_distance + 1 near-equal (shift, mask) chunks
+        chunks = max_distance + 1
+        self._chunks = []
+        shift = 0
+        for i in range(chunks):
+            width = HASH_BITS // chunks + (1 if i < HASH_BITS % chunks else 0)
+            self._chunks.append((shift, (1 << width) - 1))
+            shift += width
+
+        self._tables: List[Dict[int, List[int]]] = [{} for _ in self._chunks]
+        self._values: List[int] = []
+        self._keys: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, phash: str, key: str):
+        value = int(phash, 16)
+        slot = len(self._keys)
+        self._values.append(value)
+        self._keys.append(key)
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            table.setdefault((value >> shift) & mask, []).append(slot)
+
+    def search(self, phash: str, max_distance: Optional[int] = None) -> List[Tuple[int, str]]:
+        """Return (distance, key) for every entry within `max_distance`, nearest first."""
+        if max_distance is None:
+            max_distance = self.max_distance
+        if max_distance > self.max_distance:
+            raise ValueError(f"index was built for distances up to {self.max_distance}")
+
+        value = int(phash, 16)
+        seen = set()
+        matches = []
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            for slot in table.get((value >> shift) & mask, ()):
+                if slot in seen:
+                    continue
+                seen.add(slot)
+                d = hamming(value, self._values[slot])
+                if d <= max_distance:
+                    matches.append((d, self._keys[slot]))
+
+        matches.sort()
+        return matches
+
+    def nearest_duplicate(self, phash: str, max_distance: Optional[int] = None, exclude: Optional[str] = None) -> Optional[Tuple[int, str]]:
+        """Closest entry within `max_distance` whose key is not `exclude`."""
+        for distance, key in self.search(phash, max_distance):
+            if key != exclude:
+                return distance, key
+        return None
+
+
+def build_index(entries: Iterable[Tuple[str, str]], max_distance: int = 4) -> PhashIndex:
+    """Build an index from (key, phash) pairs."""
+    index = PhashIndex(max_distance)
+    for key, phash in entries:
+        index.add(phash, key)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report near-duplicate images in a meta.jsonl file')
+    parser.add_argument('meta_path', type=str, help='Path to meta.jsonl')
+    parser.add_argument('--distance', type=int, default=6, help='Maximum Hamming distance (0-63)')
+    args = parser.parse_args()
+
+    from meta_store import MetaStore
+
+    meta_path = Path(args.meta_path)
+    if not meta_path.exists():
+        print(f"Error: {meta_path} not found")
+        sys.exit(1)
+
+    store = MetaStore(meta_path)
+    index = PhashIndex(args.distance)
+    duplicates = 0
+    lookup_time = 0.0
+
+    for key, phash in store.phashes.items():
+        start = time.perf_counter()
+        match = index.nearest_duplicate(phash, exclude=key)
+        lookup_time += time.perf_counter() - start
+        if match:
+            duplicates += 1
+            print(f"  ≈ {key}\n      near-duplicate of {match[1]} (distance {match[0]})")
+        index.add(phash, key)
+    store.close()
+
+    lookups = max(len(index), 1)
+    print(f"\n{len(index)} hashes, {duplicates} near-duplicates within distance {args.distance}")
+    print(f"Average lookup: {lookup_time / lookups * 1e6:.1f} µs")
+
+
+if __name__ == '__main__':
+    main()
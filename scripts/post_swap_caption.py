@@ -7,11 +7,17 @@ Generates captions and detailed recreation prompts for LoRA training.
 import os
 import sys
 import json
+import time
+import asyncio
 import argparse
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
 from pathlib import Path
-from typing import Dict, Optional
-import base64
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
+# imagehash and requests are used by preprocess.py and http_client.py;
+# importing them here reports a missing one before any work starts
 try:
     from PIL import Image
     import imagehash
@@ -20,56 +26,37 @@ except ImportError:
     print("Error: Missing dependencies. Run: pip install Pillow imagehash requests")
     sys.exit(1)
 
+# Shared modules (http_client) live at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
-def get_phash(image_path: Path) -> str:
-    """Generate perceptual hash for image deduplication."""
-    img = Image.open(image_path)
-    return str(imagehash.phash(img, hash_size=8))
+import telemetry
+from http_client import get_client
+from caption_cache import DEFAULT_CACHE_PATH, CaptionCache, make_cache_key
+from message_batches import (
+    BATCH_STATE_VERSION,
+    MAX_BATCH_BYTES,
+    MAX_BATCH_REQUESTS,
+    batches_url,
+    create_batch,
+    iter_batch_results,
+    load_batch_state,
+    save_batch_state,
+    wait_for_batch
+)
+from meta_store import MetaStore
+from phash_index import build_index
+from preprocess import (
+    DEFAULT_PAYLOAD_MAX_EDGE,
+    DEFAULT_PAYLOAD_QUALITY,
+    aspect_ratio_label,
+    try_prepare_image
+)
 
 
-def normalize_image(input_path: Path, output_path: Path, quality: int = 92):
-    """Convert image to JPEG format with specified quality."""
-    img = Image.open(input_path)
+ANTHROPIC_API_URL = os.getenv('ANTHROPIC_API_URL', 'https://api.anthropic.com/v1/messages')
+ANTHROPIC_MODEL = 'claude-3-5-sonnet-20241022'
 
-    # Convert RGBA to RGB if necessary
-    if img.mode in ('RGBA', 'LA', 'P'):
-        background = Image.new('RGB', img.size, (255, 255, 255))
-        if img.mode == 'P':
-            img = img.convert('RGBA')
-        background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-        img = background
-    elif img.mode != 'RGB':
-        img = img.convert('RGB')
-
-    img.save(output_path, 'JPEG', quality=quality)
-    return output_path
-
-
-def call_anthropic_api(image_path: Path, api_key: str, trigger_token: str, class_token: str) -> Optional[Dict]:
-    """Call Anthropic API to generate caption and recreation prompt."""
-
-    # Read and encode image
-    with open(image_path, 'rb') as f:
-        image_data = base64.standard_b64encode(f.read()).decode('utf-8')
-
-    # Determine media type
-    ext = image_path.suffix.lower()
-    media_type_map = {
-        '.jpg': 'image/jpeg',
-        '.jpeg': 'image/jpeg',
-        '.png': 'image/png',
-        '.webp': 'image/webp'
-    }
-    media_type = media_type_map.get(ext, 'image/jpeg')
-
-    # Construct API request
-    headers = {
-        'x-api-key': api_key,
-        'anthropic-version': '2023-06-01',
-        'content-type': 'application/json'
-    }
-
-    prompt = f"""Analyze this image and provide detailed information in JSON format.
+CAPTION_PROMPT_TEMPLATE = """Analyze this image and provide detailed information in JSON format.
 
 Requirements:
 1. caption: A concise caption (max 25 words) that MUST start with "{trigger_token} {class_token}, " followed by description of pose, expression, outfit, and setting.
@@ -89,8 +76,65 @@ Example:
   "ar": "4:5"
 }}"""
 
-    payload = {
-        'model': 'claude-3-5-sonnet-20241022',
+# Static instructions for captioning several images in one request. Sent as a
+# system block marked for prompt caching, so after the first request of a run
+# it is read from cache instead of billed as fresh input for every image.
+MULTI_CAPTION_PROMPT_TEMPLATE = """You caption images for a LoRA training dataset. Each user message contains several images, each preceded by a label "Image N:" where N is its 0-based index.
+
+For every image provide:
+1. caption: A concise caption (max 25 words) that MUST start with "{trigger_token} {class_token}, " followed by description of pose, expression, outfit, and setting.
+2. recreation_prompt: A detailed prompt (40-80 words) describing the exact photography setup - camera angle, lens type, lighting (natural/artificial/golden hour/etc), mood, color grading, composition, depth of field, and any photographic techniques visible.
+3. style: An array of 5-12 style keywords (e.g., ["portrait", "natural lighting", "bokeh", "warm tones"])
+4. sfw: Boolean indicating if image is safe for work
+5. ar: Aspect ratio as string (e.g., "1:1", "4:5", "3:4", "9:16", "16:9")
+
+Describe each image on its own; never mix details between images.
+
+Return ONLY a valid JSON array with one object per image, in index order, each with these exact keys: index, caption, recreation_prompt, style, sfw, ar
+
+Example for two images:
+[
+  {{
+    "index": 0,
+    "caption": "{trigger_token} {class_token}, sitting in car, casual blue top, soft smile, natural daylight",
+    "recreation_prompt": "Portrait photograph taken in car interior with natural window light from left side. Shot with 50mm lens at f/1.8 creating soft bokeh background. Soft, diffused daylight creates gentle shadows. Warm color temperature around 5500K. Shallow depth of field isolates subject. Natural, candid pose looking at camera. Instagram-style color grading with lifted shadows and slightly desaturated tones.",
+    "style": ["portrait", "natural light", "bokeh", "warm tones", "car interior", "candid", "shallow dof", "soft lighting"],
+    "sfw": true,
+    "ar": "4:5"
+  }},
+  {{
+    "index": 1,
+    "caption": "{trigger_token} {class_token}, standing on beach at sunset, white sundress, hair blowing, laughing",
+    "recreation_prompt": "Full-body photograph on a beach at golden hour with the sun low behind the subject, creating rim light in the hair. Shot with 85mm lens at f/2.8 from slightly below eye level. Warm orange and pink tones, gentle lens flare, soft fill from reflected sand. Background ocean compressed and blurred. Candid, joyful mood with film-like color grading.",
+    "style": ["full body", "golden hour", "backlit", "beach", "warm tones", "lens flare", "candid"],
+    "sfw": true,
+    "ar": "9:16"
+  }}
+]"""
+
+CAPTION_KEYS = ['caption', 'recreation_prompt', 'style', 'sfw', 'ar']
+
+
+def build_caption_prompt(trigger_token: str, class_token: str) -> str:
+    """Fill the caption instructions with the trigger and class tokens."""
+    return CAPTION_PROMPT_TEMPLATE.format(trigger_token=trigger_token, class_token=class_token)
+
+
+def anthropic_headers(api_key: str) -> Dict:
+    return {
+        'x-api-key': api_key,
+        'anthropic-version': '2023-06-01',
+        'content-type': 'application/json'
+    }
+
+
+def build_caption_request(image_data: str, media_type: str, trigger_token: str, class_token: str) -> Dict:
+    """Messages API request body captioning one base64-encoded image."""
+
+    prompt = build_caption_prompt(trigger_token, class_token)
+
+    return {
+        'model': ANTHROPIC_MODEL,
         'max_tokens': 1024,
         'messages': [
             {
@@ -113,16 +157,98 @@ Example:
         ]
     }
 
+
+def build_multi_caption_request(images: List[Tuple[str, str]], trigger_token: str, class_token: str) -> Dict:
+    """Messages API request body captioning several (base64 data, media type) images at once."""
+
+    content = []
+    for i, (image_data, media_type) in enumerate(images):
+        content.append({'type': 'text', 'text': f'Image {i}:'})
+        content.append({
+            'type': 'image',
+            'source': {
+                'type': 'base64',
+                'media_type': media_type,
+                'data': image_data
+            }
+        })
+    content.append({'type': 'text', 'text': f'Caption these {len(images)} images.'})
+
+    return {
+        'model': ANTHROPIC_MODEL,
+        'max_tokens': 1024 * len(images),
+        'system': [
+            {
+                'type': 'text',
+                'text': MULTI_CAPTION_PROMPT_TEMPLATE.format(trigger_token=trigger_token, class_token=class_token),
+                'cache_control': {'type': 'ephemeral'}
+            }
+        ],
+        'messages': [
+            {
+                'role': 'user',
+                'content': content
+            }
+        ]
+    }
+
+
+def strip_code_fence(content: str) -> str:
+    # Sometimes Claude wraps JSON in markdown code blocks
+    if '```json' in content:
+        return content.split('```json')[1].split('```')[0].strip()
+    elif '```' in content:
+        return content.split('```')[1].split('```')[0].strip()
+    return content
+
+
+def parse_caption_text(content: str) -> Optional[Dict]:
+    """Extract and validate the caption JSON from a model text response."""
+
+    # Try to parse JSON from response
+    data = json.loads(strip_code_fence(content))
+
+    # Validate required keys
+    if all(k in data for k in CAPTION_KEYS):
+        return data
+    else:
+        print(f"Warning: API response missing required keys: {data}")
+        return None
+
+
+def caption_image_data(
+    image_data: str,
+    media_type: str,
+    api_key: str,
+    trigger_token: str,
+    class_token: str,
+    api_url: str = ANTHROPIC_API_URL,
+    idempotency_key: Optional[str] = None
+) -> Optional[Dict]:
+    """Caption an already base64-encoded image.
+
+    `idempotency_key` is sent as an Idempotency-Key header so a caller that
+    journals it can resend an interrupted request under the same key.
+    """
+
+    # Construct API request
+    headers = anthropic_headers(api_key)
+    if idempotency_key:
+        headers['Idempotency-Key'] = idempotency_key
+    payload = build_caption_request(image_data, media_type, trigger_token, class_token)
+
     try:
-        response = requests.post(
-            'https://api.anthropic.com/v1/messages',
-            headers=headers,
-            json=payload,
-            timeout=60
-        )
+        with telemetry.span('api', images=1, bytes=len(image_data)) as span:
+            response = get_client().post(
+                api_url,
+                headers=headers,
+                json=payload,
+                timeout=60,
+                idempotent=True  # a caption request has no side effects
+            )
+            span['status'] = response.status_code
         print(f"  → Response status: {response.status_code}")
 
-        # Debug: print status and response
         if response.status_code != 200:
             print(f"  ✗ API Error {response.status_code}: {response.text[:500]}")
             return None
@@ -134,10 +260,6 @@ Example:
             print(f"  ✗ Empty response from API")
             return None
 
-        print(f"  → Response text length: {len(response.text)}")
-        if len(response.text) > 0:
-            print(f"  → First 200 chars: {response.text[:200]}")
-
         try:
             result = response.json()
         except json.JSONDecodeError as e:
@@ -145,43 +267,96 @@ Example:
             print(f"  ✗ Response text: {response.text[:500]}")
             return None
 
-        content = result['content'][0]['text']
+        return parse_caption_text(result['content'][0]['text'])
+
+    except Exception as e:
+        print(f"Error calling Anthropic API: {e}")
+        return None
 
-        # Try to parse JSON from response
-        # Sometimes Claude wraps JSON in markdown code blocks
-        if '```json' in content:
-            content = content.split('```json')[1].split('```')[0].strip()
-        elif '```' in content:
-            content = content.split('```')[1].split('```')[0].strip()
 
-        data = json.loads(content)
+def parse_multi_caption_text(content: str, count: int) -> List[Optional[Dict]]:
+    """
+    Extract the caption array from a multi-image response.
 
-        # Validate required keys
-        required = ['caption', 'recreation_prompt', 'style', 'sfw', 'ar']
-        if all(k in data for k in required):
-            return data
+    Returns one entry per image index; entries that are missing, duplicated
+    or fail validation are None so the caller can retry just those images.
+    """
+    captions = [None] * count
+    try:
+        data = json.loads(strip_code_fence(content))
+    except json.JSONDecodeError as e:
+        print(f"  ✗ Failed to parse multi-image JSON: {e}")
+        return captions
+    if not isinstance(data, list):
+        print(f"  ✗ Expected a JSON array, got {type(data).__name__}")
+        return captions
+
+    seen = set()
+    for item in data:
+        if not isinstance(item, dict):
+            continue
+        index = item.get('index')
+        if not isinstance(index, int) or not 0 <= index < count or index in seen:
+            continue
+        seen.add(index)
+        if all(k in item for k in CAPTION_KEYS):
+            captions[index] = {k: item[k] for k in CAPTION_KEYS}
         else:
-            print(f"Warning: API response missing required keys: {data}")
-            return None
+            print(f"Warning: image {index} missing required keys: {item}")
+
+    return captions
+
+
+def caption_images_data(
+    images: List[Tuple[str, str]],
+    api_key: str,
+    trigger_token: str,
+    class_token: str,
+    api_url: str = ANTHROPIC_API_URL
+) -> List[Optional[Dict]]:
+    """Caption several already base64-encoded images in a single request."""
+
+    headers = anthropic_headers(api_key)
+    payload = build_multi_caption_request(images, trigger_token, class_token)
+
+    try:
+        with telemetry.span('api', images=len(images), bytes=sum(len(data) for data, _ in images)) as span:
+            response = get_client().post(
+                api_url,
+                headers=headers,
+                json=payload,
+                timeout=60 + 30 * len(images),
+                idempotent=True
+            )
+            span['status'] = response.status_code
+        print(f"  → Response status: {response.status_code} ({len(images)} images)")
+
+        if response.status_code != 200:
+            print(f"  ✗ API Error {response.status_code}: {response.text[:500]}")
+            return [None] * len(images)
+
+        result = response.json()
+        usage = result.get('usage', {})
+        if usage.get('cache_read_input_tokens'):
+            print(f"  → Instructions read from prompt cache ({usage['cache_read_input_tokens']} tokens)")
+
+        return parse_multi_caption_text(result['content'][0]['text'], len(images))
 
     except Exception as e:
         print(f"Error calling Anthropic API: {e}")
-        return None
+        return [None] * len(images)
 
 
-def fallback_caption(image_path: Path, trigger_token: str, class_token: str) -> Dict:
+def fallback_caption(
+    image_path: Path,
+    trigger_token: str,
+    class_token: str,
+    size: Optional[Tuple[int, int]] = None
+) -> Dict:
     """Generate rule-based caption when API is unavailable."""
-    img = Image.open(image_path)
-    width, height = img.size
-
-    # Determine aspect ratio
-    ratio = width / height
-    if ratio > 1.1:
-        ar = "16:9"
-    elif ratio < 0.9:
-        ar = "9:16"
-    else:
-        ar = "1:1"
+    if size is None:
+        size = Image.open(image_path).size
+    ar = aspect_ratio_label(size)
 
     return {
         'caption': f'{trigger_token} {class_token}, portrait photograph',
@@ -192,54 +367,68 @@ def fallback_caption(image_path: Path, trigger_token: str, class_token: str) ->
     }
 
 
-def process_image(
-    input_path: Path,
-    clean_dir: Path,
-    captions_dir: Path,
-    prompts_dir: Path,
-    meta_path: Path,
-    api_key: Optional[str],
+def save_clean_image(prepared: Dict, clean_dir: Path) -> Path:
+    """Write the normalized JPEG encoded by the CPU stage to dataset/clean."""
+    clean_path = clean_dir / f"{prepared['source'].stem}-{prepared['phash']}.jpg"
+    with telemetry.span('save_clean', bytes=len(prepared['jpeg'])):
+        clean_path.write_bytes(prepared['jpeg'])
+    print(f"  ✓ Normalized to: {clean_path}")
+    return clean_path
+
+
+def record_prepare_timings(prepared: Dict):
+    """Report the per-step timings measured by `prepare_image` (possibly in a worker process)."""
+    step_bytes = {'encode': len(prepared['jpeg']), 'payload': prepared['payload_bytes']}
+    for step, seconds in prepared['timings'].items():
+        telemetry.record(step, seconds, bytes=step_bytes.get(step, 0))
+
+
+def save_meta_entry(meta_store: MetaStore, meta_entry: Dict):
+    with telemetry.span('meta_upsert'):
+        meta_store.upsert(meta_entry)
+
+
+def caption_cache_key(
+    sha256: str,
     trigger_token: str,
-    class_token: str
-):
-    """Process a single image: normalize, caption, and save metadata."""
+    class_token: str,
+    template: str = CAPTION_PROMPT_TEMPLATE
+) -> str:
+    return make_cache_key(sha256, template, ANTHROPIC_MODEL, trigger_token, class_token)
 
-    print(f"Processing: {input_path.name}")
 
-    # Generate phash for deduplication
-    phash = get_phash(input_path)
+def cached_caption(cache: CaptionCache, sha256: str, trigger_token: str, class_token: str) -> Optional[Dict]:
+    """Look up a caption made by either the single- or the multi-image prompt."""
+    return cache.get_any([
+        caption_cache_key(sha256, trigger_token, class_token, template)
+        for template in (CAPTION_PROMPT_TEMPLATE, MULTI_CAPTION_PROMPT_TEMPLATE)
+    ])
 
-    # Create clean image filename
-    stem = input_path.stem
-    clean_filename = f"{stem}-{phash}.jpg"
-    clean_path = clean_dir / clean_filename
 
-    # Normalize to JPEG
-    normalize_image(input_path, clean_path)
-    print(f"  ✓ Normalized to: {clean_path}")
+def write_caption_outputs(
+    metadata: Dict,
+    clean_path: Path,
+    clean_dir: Path,
+    captions_dir: Path,
+    prompts_dir: Path,
+    source: Path,
+    phash: str,
+    sha256: str,
+    duplicate_of: Optional[str] = None
+) -> Dict:
+    """Write caption and prompt files and return the meta.jsonl entry."""
 
-    # Generate caption and prompt (use normalized image for API)
-    if api_key:
-        print(f"  → Calling Anthropic API...")
-        metadata = call_anthropic_api(clean_path, api_key, trigger_token, class_token)
-        if not metadata:
-            print(f"  ⚠ API failed, using fallback caption")
-            metadata = fallback_caption(input_path, trigger_token, class_token)
-    else:
-        print(f"  ⚠ No API key, using fallback caption")
-        metadata = fallback_caption(input_path, trigger_token, class_token)
+    with telemetry.span('write_captions'):
+        # Write caption file
+        caption_path = captions_dir / f"{clean_path.stem}.txt"
+        caption_path.write_text(metadata['caption'])
 
-    # Write caption file
-    caption_path = captions_dir / f"{clean_path.stem}.txt"
-    caption_path.write_text(metadata['caption'])
+        # Write prompt file
+        prompt_path = prompts_dir / f"{clean_path.stem}.prompt.txt"
+        prompt_path.write_text(metadata['recreation_prompt'])
     print(f"  ✓ Caption: {caption_path}")
-
-    # Write prompt file
-    prompt_path = prompts_dir / f"{clean_path.stem}.prompt.txt"
-    prompt_path.write_text(metadata['recreation_prompt'])
     print(f"  ✓ Prompt: {prompt_path}")
 
-    # Append to meta.jsonl
     meta_entry = {
         'path': str(clean_path.relative_to(clean_dir.parent)),
         'caption': metadata['caption'],
@@ -247,31 +436,545 @@ def process_image(
         'style': metadata['style'],
         'ar': metadata['ar'],
         'phash': phash,
-        'source': str(input_path),
+        'sha256': sha256,
+        'source': str(source),
         'notes': 'faceswap output v1'
     }
+    if duplicate_of:
+        meta_entry['duplicate_of'] = duplicate_of
+
+    return meta_entry
+
+
+def build_meta_entry(
+    prepared: Dict,
+    clean_dir: Path,
+    captions_dir: Path,
+    prompts_dir: Path,
+    api_key: Optional[str],
+    trigger_token: str,
+    class_token: str,
+    api_url: str = ANTHROPIC_API_URL,
+    cache: Optional[CaptionCache] = None,
+    duplicate_of: Optional[str] = None
+) -> Dict:
+    """Save and caption an image prepared by `prepare_image`, returning its meta.jsonl entry."""
+    return build_meta_entries(
+        [prepared], clean_dir, captions_dir, prompts_dir, api_key,
+        trigger_token, class_token, api_url, cache, [duplicate_of]
+    )[0]
+
+
+def build_meta_entries(
+    group: List[Dict],
+    clean_dir: Path,
+    captions_dir: Path,
+    prompts_dir: Path,
+    api_key: Optional[str],
+    trigger_token: str,
+    class_token: str,
+    api_url: str = ANTHROPIC_API_URL,
+    cache: Optional[CaptionCache] = None,
+    duplicates_of: Optional[List[Optional[str]]] = None
+) -> List[Dict]:
+    """
+    Save and caption a group of prepared images, returning their meta.jsonl entries.
+
+    Cache misses in a group of two or more are captioned with one multi-image
+    request; any image whose entry is missing or invalid in the response is
+    retried with a single-image request before falling back to the rule-based
+    caption.
+    """
+    duplicates_of = duplicates_of or [None] * len(group)
+    clean_paths = []
+    captions: List[Optional[Dict]] = [None] * len(group)
+
+    def cache_put(i: int, template: str):
+        if captions[i] and cache is not None:
+            cache.put(caption_cache_key(group[i]['sha256'], trigger_token, class_token, template), captions[i])
+
+    for i, prepared in enumerate(group):
+        if len(group) > 1:
+            print(f"  [{i}] {prepared['source'].name}")
+        record_prepare_timings(prepared)
+        clean_paths.append(save_clean_image(prepared, clean_dir))
+        if api_key and cache is not None:
+            with telemetry.span('cache_lookup') as span:
+                captions[i] = cached_caption(cache, prepared['sha256'], trigger_token, class_token)
+                span['hit'] = bool(captions[i])
+            if captions[i]:
+                print(f"  ✓ Caption cache hit")
+
+    # Generate caption and prompt (upload the same in-memory JPEG)
+    if api_key:
+        misses = [i for i, metadata in enumerate(captions) if not metadata]
+        if len(misses) > 1:
+            print(f"  → Calling Anthropic API for {len(misses)} images...")
+            results = caption_images_data(
+                [(group[i]['payload'], group[i]['media_type']) for i in misses],
+                api_key, trigger_token, class_token, api_url
+            )
+            for i, metadata in zip(misses, results):
+                captions[i] = metadata
+                cache_put(i, MULTI_CAPTION_PROMPT_TEMPLATE)
+
+        for i in misses:
+            if not captions[i]:
+                if len(misses) > 1:
+                    print(f"  ⚠ No valid entry for {group[i]['source'].name}, retrying on its own")
+                else:
+                    print(f"  → Calling Anthropic API...")
+                captions[i] = caption_image_data(
+                    group[i]['payload'], group[i]['media_type'], api_key, trigger_token, class_token, api_url
+                )
+                cache_put(i, CAPTION_PROMPT_TEMPLATE)
+
+    entries = []
+    for prepared, clean_path, metadata, duplicate_of in zip(group, clean_paths, captions, duplicates_of):
+        input_path = prepared['source']
+        fallback = not metadata
+        if fallback:
+            print(f"  ⚠ {'API failed' if api_key else 'No API key'}, using fallback caption")
+            metadata = fallback_caption(input_path, trigger_token, class_token, prepared['size'])
+
+        entries.append(write_caption_outputs(
+            metadata,
+            clean_path,
+            clean_dir,
+            captions_dir,
+            prompts_dir,
+            input_path,
+            prepared['phash'],
+            prepared['sha256'],
+            duplicate_of
+        ))
+        telemetry.record(telemetry.IMAGE_STAGE, time.time() - prepared['started'], fallback=fallback)
+
+    return entries
+
+
+def iter_prepared(
+    image_files: List[Path],
+    meta_store: MetaStore,
+    cpu_pool: Optional[Executor] = None,
+    force: bool = False,
+    dedup: str = 'skip',
+    dedup_distance: int = 4,
+    payload_max_edge: Optional[int] = DEFAULT_PAYLOAD_MAX_EDGE,
+    payload_quality: int = DEFAULT_PAYLOAD_QUALITY,
+    counts: Optional[Dict[str, int]] = None,
+    lookahead: int = 8
+) -> Iterator[Dict]:
+    """
+    Prepare images in input order, dropping complete ones and near-duplicates.
+
+    Each image goes through `prepare_image` once (on `cpu_pool` when given,
+    at most `lookahead` ahead of the consumer): its sha256 tells whether the
+    existing record is complete, its phash is matched against the dataset
+    and earlier images, and the rest is what the caption stage uploads and
+    saves. Matching runs in input order so the first image of a
+    near-duplicate group is always the one kept; with dedup='flag' the
+    others are yielded with 'duplicate_of' set. Images that fail to prepare
+    are reported and skipped. `counts` tallies 'complete', 'duplicates' and
+    'errors'.
+    """
+    index = build_index(meta_store.phashes.items(), dedup_distance) if dedup != 'off' else None
+    counts = counts if counts is not None else {}
+    for name in ('complete', 'duplicates', 'errors'):
+        counts.setdefault(name, 0)
+
+    def options(image_path: Path) -> Dict:
+        return {
+            'payload_max_edge': payload_max_edge,
+            'payload_quality': payload_quality,
+            'complete_sha256': None if force else meta_store.complete_sha256(str(image_path))
+        }
+
+    def prepare_all() -> Iterator[Dict]:
+        if cpu_pool is None:
+            for image_path in image_files:
+                yield try_prepare_image(image_path, **options(image_path))
+            return
+        # Executor.map would submit every image at once and hold all their results
+        files = iter(image_files)
+        pending = deque(cpu_pool.submit(try_prepare_image, p, **options(p)) for p in islice(files, lookahead))
+        while pending:
+            prepared = pending.popleft().result()
+            for image_path in islice(files, 1):
+                pending.append(cpu_pool.submit(try_prepare_image, image_path, **options(image_path)))
+            yield prepared
+
+    for prepared in prepare_all():
+        input_path = prepared['source']
+        if 'error' in prepared:
+            print(f"Error processing {input_path}: {prepared['error']}\n")
+            counts['errors'] += 1
+            continue
+        if prepared.get('complete'):
+            counts['complete'] += 1
+            continue
+
+        prepared['duplicate_of'] = None
+        if index is not None:
+            key = str(input_path)
+            match = index.nearest_duplicate(prepared['phash'], exclude=key)
+            index.add(prepared['phash'], key)
+            if match:
+                counts['duplicates'] += 1
+                print(f"  ≈ {input_path.name}: near-duplicate of {match[1]} (distance {match[0]})")
+                if dedup == 'skip':
+                    continue
+                prepared['duplicate_of'] = match[1]
+        yield prepared
 
-    with open(meta_path, 'a') as f:
-        f.write(json.dumps(meta_entry) + '\n')
+
+def process_image(
+    prepared: Dict,
+    clean_dir: Path,
+    captions_dir: Path,
+    prompts_dir: Path,
+    meta_store: MetaStore,
+    api_key: Optional[str],
+    trigger_token: str,
+    class_token: str,
+    api_url: str = ANTHROPIC_API_URL,
+    cache: Optional[CaptionCache] = None
+):
+    """Process a single image prepared by `iter_prepared`: save, caption, and save metadata."""
+
+    print(f"Processing: {prepared['source'].name}")
+    meta_entry = build_meta_entry(
+        prepared,
+        clean_dir,
+        captions_dir,
+        prompts_dir,
+        api_key,
+        trigger_token,
+        class_token,
+        api_url,
+        cache,
+        prepared.get('duplicate_of')
+    )
+
+    # Append to meta.jsonl, superseding any earlier record for this image
+    save_meta_entry(meta_store, meta_entry)
 
     print(f"  ✓ Metadata saved\n")
 
 
+async def process_images_async(
+    prepared_images: Iterable[Dict],
+    clean_dir: Path,
+    captions_dir: Path,
+    prompts_dir: Path,
+    meta_store: MetaStore,
+    api_key: Optional[str],
+    trigger_token: str,
+    class_token: str,
+    concurrency: int,
+    api_url: str = ANTHROPIC_API_URL,
+    cache: Optional[CaptionCache] = None,
+    images_per_request: int = 1
+) -> int:
+    """
+    Caption images with at most `concurrency` requests in flight.
+
+    Images are captioned in groups of `images_per_request`, one API request
+    per group. `prepared_images` (usually `iter_prepared`, which decodes
+    ahead on a process pool) is read on its own thread, so the CPU stage
+    overlaps the requests in flight, and each group is saved and captioned
+    in a worker thread: the API call goes through the blocking
+    requests-based client, so asyncio only schedules and orders the work.
+    The speedup over a sequential run approaches `concurrency` once API
+    latency dominates the per-image CPU time (scripts/bench_caption.py
+    reports it). The semaphore bounds the in-flight window, which also
+    caps how many prepared images are held in memory. Records are written
+    to meta.jsonl in input order as soon as every earlier group has
+    finished, so the output is identical to a sequential run regardless of
+    completion order. Returns the number of records written.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    # Reading the next group blocks on the CPU stage; keep it off the API threads
+    reader = ThreadPoolExecutor(max_workers=1)
+    images = iter(prepared_images)
+    tasks: asyncio.Queue = asyncio.Queue()
+
+    async def run(group: List[Dict]) -> List[Dict]:
+        try:
+            for prepared in group:
+                print(f"Processing: {prepared['source'].name}")
+            return await loop.run_in_executor(
+                executor,
+                build_meta_entries,
+                group,
+                clean_dir,
+                captions_dir,
+                prompts_dir,
+                api_key,
+                trigger_token,
+                class_token,
+                api_url,
+                cache,
+                [p.get('duplicate_of') for p in group]
+            )
+        except Exception as e:
+            print(f"Error processing {', '.join(p['source'].name for p in group)}: {e}\n")
+            return []
+        finally:
+            semaphore.release()
+
+    async def produce():
+        try:
+            while True:
+                await semaphore.acquire()
+                group = await loop.run_in_executor(reader, lambda: list(islice(images, images_per_request)))
+                if not group:
+                    semaphore.release()
+                    return
+                tasks.put_nowait(asyncio.ensure_future(run(group)))
+        finally:
+            tasks.put_nowait(None)
+
+    producer = asyncio.ensure_future(produce())
+    written = 0
+
+    try:
+        while True:
+            task = await tasks.get()
+            if task is None:
+                break
+            for meta_entry in await task:
+                save_meta_entry(meta_store, meta_entry)
+                written += 1
+        await producer
+    finally:
+        executor.shutdown(wait=True)
+        reader.shutdown(wait=True)
+
+    return written
+
+
+def submit_batches(
+    prepared_images: Iterable[Dict],
+    clean_dir: Path,
+    captions_dir: Path,
+    prompts_dir: Path,
+    meta_store: MetaStore,
+    api_key: str,
+    trigger_token: str,
+    class_token: str,
+    state_path: Path,
+    api_url: str = ANTHROPIC_API_URL,
+    cache: Optional[CaptionCache] = None
+) -> Dict:
+    """
+    Submit every prepared image whose caption is not cached as Message Batches.
+
+    Clean images are written at submission time so results can be applied
+    without decoding again. The batch ids and the custom_id -> image mapping
+    are persisted to `state_path` after each batch is created. Images that
+    could not be prepared were already left out by `iter_prepared`.
+    """
+    url = batches_url(api_url)
+    headers = anthropic_headers(api_key)
+    state = {
+        'version': BATCH_STATE_VERSION,
+        'trigger_token': trigger_token,
+        'class_token': class_token,
+        'batches': [],
+        'items': {}
+    }
+    chunk = []
+    chunk_bytes = 0
+
+    def flush():
+        batch = create_batch(url, headers, chunk)
+        state['batches'].append({'id': batch['id'], 'done': False})
+        save_batch_state(state_path, state)
+        print(f"  ✓ Submitted batch {batch['id']} ({len(chunk)} requests, {chunk_bytes / 1e6:.1f} MB)")
+
+    for prepared in prepared_images:
+        input_path = prepared['source']
+        duplicate_of = prepared.get('duplicate_of')
+        print(f"Preparing: {input_path.name}")
+        record_prepare_timings(prepared)
+        clean_path = save_clean_image(prepared, clean_dir)
+
+        if cache is not None:
+            metadata = cached_caption(cache, prepared['sha256'], trigger_token, class_token)
+            if metadata:
+                print(f"  ✓ Caption cache hit")
+                save_meta_entry(meta_store, write_caption_outputs(
+                    metadata, clean_path, clean_dir, captions_dir, prompts_dir,
+                    input_path, prepared['phash'], prepared['sha256'], duplicate_of
+                ))
+                telemetry.record(telemetry.IMAGE_STAGE, time.time() - prepared['started'], fallback=False)
+                continue
+
+        custom_id = f"img-{len(state['items']):06d}"
+        request = {
+            'custom_id': custom_id,
+            'params': build_caption_request(prepared['payload'], prepared['media_type'], trigger_token, class_token)
+        }
+        size = len(json.dumps(request))
+        if chunk and (chunk_bytes + size > MAX_BATCH_BYTES or len(chunk) >= MAX_BATCH_REQUESTS):
+            flush()
+            chunk = []
+            chunk_bytes = 0
+
+        chunk.append(request)
+        chunk_bytes += size
+        state['items'][custom_id] = {
+            'source': str(input_path),
+            'clean_path': str(clean_path),
+            'phash': prepared['phash'],
+            'sha256': prepared['sha256'],
+            'size': prepared['size'],
+            'duplicate_of': duplicate_of
+        }
+
+    if chunk:
+        flush()
+
+    return state
+
+
+def finish_batches(
+    state: Dict,
+    state_path: Path,
+    clean_dir: Path,
+    captions_dir: Path,
+    prompts_dir: Path,
+    meta_store: MetaStore,
+    api_key: str,
+    api_url: str = ANTHROPIC_API_URL,
+    cache: Optional[CaptionCache] = None,
+    poll_interval: float = 30.0
+) -> int:
+    """
+    Wait for every unfinished batch in `state` and stream its results out.
+
+    Safe to re-run after a crash: results whose record is already complete
+    are skipped, and a batch is only marked done once fully applied.
+    Returns the number of records written.
+    """
+    url = batches_url(api_url)
+    headers = anthropic_headers(api_key)
+    trigger_token = state['trigger_token']
+    class_token = state['class_token']
+    written = 0
+
+    for batch in state['batches']:
+        if batch['done']:
+            continue
+
+        print(f"\nWaiting for batch {batch['id']}...")
+        with telemetry.span('batch_wait', batch=batch['id']):
+            ended = wait_for_batch(url, headers, batch['id'], initial_delay=poll_interval)
+        print(f"  ✓ Batch ended: {ended.get('request_counts')}")
+
+        for line in iter_batch_results(ended['results_url'], headers):
+            item = state['items'].get(line['custom_id'])
+            if item is None or meta_store.is_complete(item['source'], item['sha256']):
+                continue
+
+            source = Path(item['source'])
+            print(f"Result: {source.name}")
+            result = line['result']
+            metadata = None
+            if result['type'] == 'succeeded':
+                try:
+                    metadata = parse_caption_text(result['message']['content'][0]['text'])
+                except (KeyError, IndexError, json.JSONDecodeError) as e:
+                    print(f"  ✗ Failed to parse batch result: {e}")
+            else:
+                print(f"  ✗ Batch request {result['type']}")
+
+            if metadata and cache is not None:
+                cache.put(caption_cache_key(item['sha256'], trigger_token, class_token), metadata)
+            fallback = not metadata
+            if fallback:
+                print(f"  ⚠ Using fallback caption")
+                metadata = fallback_caption(source, trigger_token, class_token, tuple(item['size']))
+
+            save_meta_entry(meta_store, write_caption_outputs(
+                metadata, Path(item['clean_path']), clean_dir, captions_dir, prompts_dir,
+                source, item['phash'], item['sha256'], item.get('duplicate_of')
+            ))
+            # Latency of a batched image is the batch's; count it for throughput only
+            telemetry.record(telemetry.IMAGE_STAGE, 0.0, fallback=fallback)
+            written += 1
+
+        batch['done'] = True
+        save_batch_state(state_path, state)
+
+    return written
+
+
 def main():
     parser = argparse.ArgumentParser(description='Generate captions and prompts for face-swapped images')
     parser.add_argument('--images-dir', type=str, required=True, help='Directory containing images to process')
     parser.add_argument('--trigger', type=str, help='Trigger token (default: from env TRIGGER_TOKEN)')
     parser.add_argument('--class-token', type=str, help='Class token (default: from env CLASS_TOKEN)')
     parser.add_argument('--limit', type=int, help='Limit processing to N images (for testing)')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='Number of caption requests in flight (default: 1, sequential)')
+    parser.add_argument('--images-per-request', type=int, default=1,
+                        help='Caption K images per API request with a prompt-cached instruction block (default: 1)')
+    parser.add_argument('--api-url', type=str, default=ANTHROPIC_API_URL,
+                        help='Messages endpoint (default: from env ANTHROPIC_API_URL or api.anthropic.com)')
+    parser.add_argument('--cache-path', type=str, default=str(DEFAULT_CACHE_PATH),
+                        help=f'Caption cache database (default: {DEFAULT_CACHE_PATH})')
+    parser.add_argument('--cache-max-entries', type=int, default=100_000,
+                        help='Maximum cached captions before LRU eviction')
+    parser.add_argument('--cache-max-mb', type=int, default=256,
+                        help='Maximum cache size in MB before LRU eviction')
+    parser.add_argument('--no-cache', action='store_true', help='Always call the API, bypassing the caption cache')
+    parser.add_argument('--dedup', choices=['skip', 'flag', 'off'], default='skip',
+                        help='Near-duplicate handling: skip them, flag them in meta.jsonl, or off (default: skip)')
+    parser.add_argument('--dedup-distance', type=int, default=4,
+                        help='Maximum phash Hamming distance counted as a near-duplicate (default: 4)')
+    parser.add_argument('--force', action='store_true',
+                        help='Reprocess images that already have a complete record in meta.jsonl')
+    parser.add_argument('--payload-max-edge', type=int, default=DEFAULT_PAYLOAD_MAX_EDGE,
+                        help=f'Downscale API uploads to this long edge in px, 0 to send full size '
+                             f'(default: {DEFAULT_PAYLOAD_MAX_EDGE}; dataset/clean is never resized)')
+    parser.add_argument('--payload-quality', type=int, default=DEFAULT_PAYLOAD_QUALITY,
+                        help=f'JPEG quality of API uploads (default: {DEFAULT_PAYLOAD_QUALITY})')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Processes used for decoding/hashing/encoding (default: CPU count)')
+    parser.add_argument('--batch', action='store_true',
+                        help='Submit captions through the Message Batches API (half price, results within 24h)')
+    parser.add_argument('--batch-poll-interval', type=float, default=30.0,
+                        help='Initial seconds between batch status polls, backed off up to 10 minutes (default: 30)')
+
+    parser.add_argument('--telemetry', type=str, nargs='?', const=str(telemetry.DEFAULT_TELEMETRY_PATH),
+                        help=f'Record per-stage timings to a JSONL file (default when given without a path: '
+                             f'{telemetry.DEFAULT_TELEMETRY_PATH}; also enabled by PIPELINE_TELEMETRY)')
 
     args = parser.parse_args()
 
+    if args.telemetry:
+        telemetry.configure(Path(args.telemetry))
+
     # Get configuration
     api_key = os.getenv('ANTHROPIC_API_KEY')
     trigger_token = args.trigger or os.getenv('TRIGGER_TOKEN', 'blondie')
     class_token = args.class_token or os.getenv('CLASS_TOKEN', 'woman')
 
+    if args.images_per_request < 1:
+        print("Error: --images-per-request must be at least 1")
+        sys.exit(1)
+    if args.batch and args.images_per_request > 1:
+        print("Error: --batch captions one image per request; drop --images-per-request")
+        sys.exit(1)
+
     if not api_key:
+        if args.batch:
+            print("Error: --batch requires ANTHROPIC_API_KEY")
+            sys.exit(1)
         print("Warning: ANTHROPIC_API_KEY not set. Using fallback captions.")
 
     # Set up directories
@@ -292,50 +995,150 @@ def main():
     meta_dir.mkdir(parents=True, exist_ok=True)
 
     meta_path = meta_dir / 'meta.jsonl'
+    batch_state_path = meta_dir / 'batch_state.json'
+
+    cache = None
+    if not args.no_cache:
+        cache = CaptionCache(
+            Path(args.cache_path),
+            max_entries=args.cache_max_entries,
+            max_bytes=args.cache_max_mb * 1024 * 1024
+        )
 
     # Find all images
     image_extensions = {'.jpg', '.jpeg', '.png', '.webp'}
-    image_files = [
+    image_files = sorted(
         f for f in images_dir.iterdir()
         if f.is_file() and f.suffix.lower() in image_extensions
-    ]
+    )
 
     if args.limit:
         image_files = image_files[:args.limit]
 
+    meta_store = MetaStore(meta_path)
+
+    # CPU stage (read, sha256, decode, phash, JPEG encode) runs in a process pool
+    cpu_pool = ProcessPoolExecutor(max_workers=args.workers) if args.workers > 1 else None
+
+    # Each image is read and decoded once: complete records are skipped on their
+    # sha256 and near-duplicates dropped or flagged on their phash as they stream
+    # out of the CPU stage, before any API spend
+    counts: Dict[str, int] = {}
+
+    def prepared_images(files: List[Path]) -> Iterator[Dict]:
+        return iter_prepared(
+            files, meta_store, cpu_pool, args.force, args.dedup, args.dedup_distance,
+            args.payload_max_edge, args.payload_quality, counts, lookahead=2 * max(args.workers, args.concurrency)
+        )
+
     print(f"\n{'='*60}")
     print(f"Post-Swap Captioning Pipeline")
     print(f"{'='*60}")
     print(f"Images directory: {images_dir}")
     print(f"Found {len(image_files)} images")
+    print(f"Near-duplicates: {args.dedup} (distance ≤ {args.dedup_distance})")
     print(f"Trigger token: {trigger_token}")
     print(f"Class token: {class_token}")
     print(f"API key: {'✓ Set' if api_key else '✗ Not set'}")
+    print(f"Mode: {'message batches' if args.batch else f'concurrency {args.concurrency}'}")
+    print(f"Images per request: {args.images_per_request}")
     print(f"{'='*60}\n")
 
-    # Process each image
-    for image_path in image_files:
-        try:
-            process_image(
-                image_path,
+    start_time = time.time()
+
+    if args.batch:
+        # Finish batches left over from an interrupted run before paying for new ones
+        state = load_batch_state(batch_state_path)
+        if state is not None:
+            print(f"Resuming {len(state['batches'])} batch(es) from {batch_state_path}")
+            finish_batches(
+                state, batch_state_path, clean_dir, captions_dir, prompts_dir, meta_store,
+                api_key, args.api_url, cache, args.batch_poll_interval
+            )
+            pending = {item['source'] for item in state['items'].values()}
+            image_files = [f for f in image_files if str(f) not in pending]
+            batch_state_path.unlink()
+
+        if image_files:
+            state = submit_batches(
+                prepared_images(image_files),
                 clean_dir,
                 captions_dir,
                 prompts_dir,
-                meta_path,
+                meta_store,
                 api_key,
                 trigger_token,
-                class_token
+                class_token,
+                batch_state_path,
+                args.api_url,
+                cache
             )
-        except Exception as e:
-            print(f"Error processing {image_path}: {e}\n")
-            continue
+            finish_batches(
+                state, batch_state_path, clean_dir, captions_dir, prompts_dir, meta_store,
+                api_key, args.api_url, cache, args.batch_poll_interval
+            )
+            if batch_state_path.exists():
+                batch_state_path.unlink()
+    elif args.concurrency > 1 or args.images_per_request > 1:
+        asyncio.run(process_images_async(
+            prepared_images(image_files),
+            clean_dir,
+            captions_dir,
+            prompts_dir,
+            meta_store,
+            api_key,
+            trigger_token,
+            class_token,
+            args.concurrency,
+            args.api_url,
+            cache,
+            args.images_per_request
+        ))
+    else:
+        # Process each image
+        for prepared in prepared_images(image_files):
+            try:
+                process_image(
+                    prepared,
+                    clean_dir,
+                    captions_dir,
+                    prompts_dir,
+                    meta_store,
+                    api_key,
+                    trigger_token,
+                    class_token,
+                    args.api_url,
+                    cache
+                )
+            except Exception as e:
+                print(f"Error processing {prepared['source']}: {e}\n")
+                continue
+
+    elapsed = time.time() - start_time
+    processed = len(image_files) - counts.get('complete', 0)
+    if args.dedup == 'skip':
+        processed -= counts.get('duplicates', 0)
+    telemetry.record('run', elapsed, images=processed)
+    meta_store.close()
+    if cpu_pool is not None:
+        cpu_pool.shutdown()
+
+    if cache is not None:
+        print(f"Caption cache: {cache.hits} hits, {cache.misses} misses ({len(cache)} entries)")
+        cache.close()
 
     print(f"\n{'='*60}")
     print(f"Processing complete!")
+    print(f"Already complete: {counts.get('complete', 0)}, near-duplicates: {counts.get('duplicates', 0)} "
+          f"({args.dedup}), unreadable: {counts.get('errors', 0)}")
+    print(f"Elapsed: {elapsed:.1f}s ({processed / max(elapsed, 1e-9) * 60:.1f} images/min)")
     print(f"Clean images: {clean_dir}")
     print(f"Captions: {captions_dir}")
     print(f"Prompts: {prompts_dir}")
     print(f"Metadata: {meta_path}")
+    if telemetry.enabled():
+        print(f"Telemetry: {telemetry.sink_path()} (python3 telemetry.py report {telemetry.sink_path()})")
+        telemetry.close()
     print(f"{'='*60}\n")
 
 
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+CPU stage of the captioning pipeline.
+
+Each source image is read from disk once and fully decoded once; the
+sha256, phash, normalized training JPEG, dimensions/aspect ratio and base64
+upload payload are all derived from that in-memory copy. The phash is taken
+from the full-resolution decode exactly as imagehash.phash(Image.open(path))
+computes it, so clean filenames and the phashes stored in meta.jsonl stay
+comparable with earlier runs. An image whose meta.jsonl record already
+matches its sha256 is only read and hashed, never decoded.
+
+Functions here are top-level and return plain dicts so they can run in a
+ProcessPoolExecutor; per-step timings travel back in the dict so the
+parent process can report them.
+"""
+
+import io
+import time
+import base64
+import hashlib
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+import imagehash
+
+
+# Vision models downscale anything larger than ~1.15MP / 1568px long edge
+# server-side, so bigger uploads only cost bytes and latency
+DEFAULT_PAYLOAD_MAX_EDGE = 1568
+DEFAULT_PAYLOAD_QUALITY = 85
+
+
+def image_phash(img: Image.Image) -> str:
+    """Perceptual hash of a full-resolution image (before any mode conversion)."""
+    return str(imagehash.phash(img, hash_size=8))
+
+
+def get_phash(image_path: Path) -> str:
+    """Generate perceptual hash for image deduplication."""
+    return image_phash(Image.open(image_path))
+
+
+def to_rgb(img: Image.Image) -> Image.Image:
+    """Flatten transparency onto white and convert to RGB."""
+    if img.mode in ('RGBA', 'LA', 'P'):
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+def aspect_ratio_label(size: Tuple[int, int]) -> str:
+    """Coarse aspect-ratio bucket used by the fallback caption."""
+    width, height = size
+    ratio = width / height
+    if ratio > 1.1:
+        return "16:9"
+    elif ratio < 0.9:
+        return "9:16"
+    return "1:1"
+
+
+def encode_jpeg(img: Image.Image, quality: int) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', quality=quality)
+    return buf.getvalue()
+
+
+def optimize_payload(img: Image.Image, max_edge: int, quality: int) -> bytes:
+    """Downscale to `max_edge` on the long side (keeping aspect ratio) and re-encode."""
+    width, height = img.size
+    scale = max_edge / max(width, height)
+    if scale < 1:
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        # reducing_gap does a cheap box pre-shrink before the Lanczos pass
+        img = img.resize(size, Image.LANCZOS, reducing_gap=2.0)
+    return encode_jpeg(img, quality)
+
+
+def prepare_image(
+    input_path: Path,
+    quality: int = 92,
+    payload_max_edge: Optional[int] = DEFAULT_PAYLOAD_MAX_EDGE,
+    payload_quality: int = DEFAULT_PAYLOAD_QUALITY,
+    complete_sha256: Optional[str] = None
+) -> Dict:
+    """
+    Read and decode `input_path` once and derive everything later stages need.
+
+    If the file's sha256 equals `complete_sha256` (the content its existing,
+    complete record was made from), only {'source', 'sha256', 'complete'}
+    is returned, without decoding. The upload payload is a downscaled copy
+    unless `payload_max_edge` is None/0, in which case the full-resolution
+    training JPEG is sent; the clean JPEG is never resized. `timings` holds
+    seconds spent in each step.
+    """
+    started = time.time()
+    timings = {}
+    t = time.perf_counter()
+
+    def lap(step: str):
+        nonlocal t
+        now = time.perf_counter()
+        timings[step] = now - t
+        t = now
+
+    data = Path(input_path).read_bytes()
+    sha256 = hashlib.sha256(data).hexdigest()
+    lap('read')
+    if complete_sha256 is not None and sha256 == complete_sha256:
+        return {'source': Path(input_path), 'sha256': sha256, 'complete': True}
+
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    lap('decode')
+    phash = image_phash(img)
+    lap('phash')
+    img = to_rgb(img)
+    jpeg = encode_jpeg(img, quality)
+    lap('encode')
+    payload = optimize_payload(img, payload_max_edge, payload_quality) if payload_max_edge else jpeg
+    if payload_max_edge:
+        lap('payload')
+
+    return {
+        'source': Path(input_path),
+        'sha256': sha256,
+        'phash': phash,
+        'size': img.size,
+        'ar': aspect_ratio_label(img.size),
+        'jpeg': jpeg,
+        'media_type': 'image/jpeg',
+        'payload': base64.standard_b64encode(payload).decode('utf-8'),
+        'payload_bytes': len(payload),
+        'started': started,
+        'timings': timings
+    }
+
+
+def try_prepare_image(input_path: Path, *args, **kwargs) -> Dict:
+    """`prepare_image`, but a failure comes back as {'source', 'error'} instead of raising."""
+    try:
+        return prepare_image(input_path, *args, **kwargs)
+    except Exception as e:
+        return {'source': Path(input_path), 'error': f"{type(e).__name__}: {e}"}
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Lightweight span/metrics recording for the dataset pipelines.
+
+Stages are timed with `span()` (or reported after the fact with
+`record()`) and appended as one JSON line per event to a local sink:
+
+  {"run": "...", "stage": "api", "ts": 1718000000.1, "dur": 1.42, "bytes": 183022, ...}
+
+Recording is off unless `configure()` is called or PIPELINE_TELEMETRY
+names a sink file; while off, `span()` hands back a shared no-op object, so
+instrumented code pays one attribute check per stage. Events from several
+processes can share a sink (each line is a single append) and are grouped
+by run id (PIPELINE_RUN_ID, or one is generated per process).
+
+Usage:
+  python3 scripts/post_swap_caption.py --images-dir ... --telemetry dataset/telemetry.jsonl
+  python3 telemetry.py report dataset/telemetry.jsonl
+  python3 telemetry.py report dataset/telemetry.jsonl --run all
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+DEFAULT_TELEMETRY_PATH = Path('dataset/telemetry.jsonl')
+
+# Stage recorded once per finished image; report derives images/minute from it
+IMAGE_STAGE = 'image'
+
+
+class _NullSpan:
+    """Stand-in returned while recording is off; accepts and drops fields."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setitem__(self, key, value):
+        pass
+
+    def update(self, *args, **kwargs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(dict):
+    """Times a `with` block and records it, with any fields set on it, on exit."""
+
+    def __init__(self, sink: 'TelemetrySink', stage: str, fields: Dict):
+        super().__init__(fields)
+        self.sink = sink
+        self.stage = stage
+
+    def __enter__(self):
+        self.ts = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self['error'] = exc_type.__name__
+        self.sink.write(self.stage, time.perf_counter() - self.start, self, self.ts)
+        return False
+
+
+class TelemetrySink:
+    """Appends events for one run to a JSONL file."""
+
+    def __init__(self, path: Path, run_id: Optional[str] = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.run_id = run_id or os.getenv('PIPELINE_RUN_ID') or f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self._lock = threading.Lock()
+        # Line buffered: every event is one write() to an O_APPEND file
+        self._file = open(self.path, 'a', buffering=1)
+
+    def write(self, stage: str, duration: float, fields: Dict, ts: Optional[float] = None):
+        event = {'run': self.run_id, 'stage': stage, 'ts': round(ts or time.time(), 6), 'dur': round(duration, 6)}
+        event.update(fields)
+        line = json.dumps(event) + '\n'
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+_sink: Optional[TelemetrySink] = None
+
+
+def configure(path: Optional[Path] = None, run_id: Optional[str] = None) -> TelemetrySink:
+    """Start recording to `path` (default: PIPELINE_TELEMETRY or dataset/telemetry.jsonl)."""
+    global _sink
+    if _sink is not None:
+        _sink.close()
+    _sink = TelemetrySink(path or os.getenv('PIPELINE_TELEMETRY') or DEFAULT_TELEMETRY_PATH, run_id)
+    return _sink
+
+
+def enabled() -> bool:
+    return _sink is not None
+
+
+def sink_path() -> Optional[Path]:
+    return _sink.path if _sink is not None else None
+
+
+def span(stage: str, **fields):
+    """Context manager timing `stage`; set extra fields on the yielded span."""
+    if _sink is None:
+        return _NULL_SPAN
+    return _Span(_sink, stage, fields)
+
+
+def record(stage: str, duration: float, **fields):
+    """Record a stage measured elsewhere (e.g. in a worker process)."""
+    if _sink is not None:
+        _sink.write(stage, duration, fields, time.time() - duration)
+
+
+def close():
+    global _sink
+    if _sink is not None:
+        _sink.close()
+        _sink = None
+
+
+if os.getenv('PIPELINE_TELEMETRY'):
+    configure()
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def load_events(path: Path) -> List[Dict]:
+    events = []
+    with open(path) as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue  # partial line from a process killed mid-write
+    return events
+
+
+def print_report(run_id: str, events: List[Dict]):
+    stages: Dict[str, List[Dict]] = {}
+    for event in events:
+        stages.setdefault(event['stage'], []).append(event)
+
+    # Wall clock spans every process of the run, so parallel workers aren't double counted
+    start = min(e['ts'] for e in events)
+    wall = max(e['ts'] + e['dur'] for e in events) - start
+    images = len(stages.get(IMAGE_STAGE, []))
+
+    print(f"\n{'='*60}")
+    print(f"Run: {run_id}")
+    print(f"Started: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start))}")
+    print(f"Wall: {wall:.1f}s, images: {images} ({images / max(wall, 1e-9) * 60:.1f} images/min)")
+    print(f"{'='*60}")
+    print(f"{'stage':<16}{'count':>7}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'MB':>9}{'retries':>9}")
+
+    for stage, items in sorted(stages.items(), key=lambda kv: -sum(e['dur'] for e in kv[1])):
+        durations = sorted(e['dur'] for e in items)
+        sent = sum(e.get('bytes', 0) for e in items)
+        retries = sum(e.get('retries', 0) for e in items)
+        errors = sum(1 for e in items if 'error' in e)
+        print(
+            f"{stage:<16}{len(items):>7}{sum(durations):>10.2f}"
+            f"{percentile(durations, 50) * 1000:>10.1f}{percentile(durations, 95) * 1000:>10.1f}"
+            f"{percentile(durations, 99) * 1000:>10.1f}{sent / 1e6:>9.2f}{retries:>9}"
+            + (f"  ({errors} errors)" if errors else '')
+        )
+
+
+def report(path: Path, run: str = 'latest'):
+    events = load_events(path)
+    if not events:
+        print(f"No telemetry events in {path}")
+        return
+
+    by_run: Dict[str, List[Dict]] = {}
+    for event in events:
+        by_run.setdefault(event['run'], []).append(event)
+
+    if run == 'latest':
+        run = max(by_run, key=lambda r: max(e['ts'] for e in by_run[r]))
+    if run == 'all':
+        selected = sorted(by_run, key=lambda r: min(e['ts'] for e in by_run[r]))
+    elif run in by_run:
+        selected = [run]
+    else:
+        print(f"Error: run {run} not found in {path} (runs: {', '.join(by_run)})")
+        sys.exit(1)
+
+    for run_id in selected:
+        print_report(run_id, by_run[run_id])
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pipeline telemetry tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    report_parser = subparsers.add_parser('report', help='Print per-stage latency percentiles for a run')
+    report_parser.add_argument('path', type=str, nargs='?', default=str(DEFAULT_TELEMETRY_PATH),
+                               help=f'Telemetry JSONL file (default: {DEFAULT_TELEMETRY_PATH})')
+    report_parser.add_argument('--run', type=str, default='latest', help='Run id, "latest" (default) or "all"')
+    args = parser.parse_args()
+
+    path = Path(args.path)
+    if not path.exists():
+        print(f"Error: {path} not found")
+        sys.exit(1)
+    report(path, args.run)
+
+
+if __name__ == '__main__':
+    main()